@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import os
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, Optional
 
@@ -24,6 +25,7 @@ class Authenticator:
         thumbprint (str): The thumbprint of the certificate.
         certificate_path (str): The path to the certificate file.
         api_scope (str): The API scope for authentication.
+        token_cache_path (Optional[str]): The file the MSAL token cache is persisted to.
         access_token (Optional[str]): The current access token.
         token_expiry (Optional[datetime]): The expiry time of the current access token.
 
@@ -31,16 +33,23 @@ class Authenticator:
         __init__():
             Initializes the Authenticator instance with settings, access_token, and token_expiry.
 
-        async get_access_token() -> str:
+        async get_access_token(min_validity: float = 0) -> str:
             Acquires an access token using MSAL. Reuses the existing token if it is still valid.
 
-        _is_token_valid() -> bool:
+        _get_app() -> msal.ConfidentialClientApplication:
+            Returns the MSAL application, loading the certificate on first use only.
+
+        _is_token_valid(min_validity: float = 0) -> bool:
             Checks if the current access token is valid based on its expiry time.
 
         _process_token_result(result: Dict[str, Any]) -> str:
             Processes the result of the token acquisition and updates the access token and expiry time.
     """
 
+    # MSAL serves its cached token until this many seconds before it expires, so a
+    # token cannot be renewed earlier than that.
+    MSAL_REFRESH_WINDOW = 300.0
+
     def __init__(
         self,
         client_id: str,
@@ -48,21 +57,39 @@ class Authenticator:
         thumbprint: str,
         certificate_path: str,
         api_scope: str,
+        token_cache_path: Optional[str] = None,
     ) -> None:
         """
         Initializes the Authenticator instance with settings, access_token, and token_expiry.
+        The MSAL token cache is loaded from token_cache_path when the file exists.
         """
         self.client_id = client_id
         self.tenant_id = tenant_id
         self.thumbprint = thumbprint
         self.certificate_path = certificate_path
         self.api_scope = api_scope
+        self.token_cache_path = token_cache_path
         self.access_token: Optional[str] = None
         self.token_expiry: Optional[datetime] = None
-
-    async def get_access_token(self) -> str:
+        self._app: Optional[msal.ConfidentialClientApplication] = None
+        self._token_cache = msal.SerializableTokenCache()
+        if token_cache_path and os.path.exists(token_cache_path):
+            try:
+                with open(token_cache_path, "r") as cache_file:
+                    self._token_cache.deserialize(cache_file.read())
+            except Exception as e:
+                logging.warning(
+                    f"Ignoring unreadable token cache {token_cache_path}: {e}"
+                )
+
+    async def get_access_token(self, min_validity: float = 0) -> str:
         """
         Acquires an access token using MSAL. Reuses the existing token if it is still valid.
+        MSAL serves the token from its persisted cache when possible, so a new process
+        does not need a network round-trip while the cached token is valid.
+
+        Args:
+            min_validity (float): The number of seconds the reused token must remain valid.
 
         Returns:
             str: The access token.
@@ -72,21 +99,12 @@ class Authenticator:
             MSALAuthenticationError: If there is an error with MSAL authentication.
             AsyncioError: If there is an error with asyncio.
         """
-        if self._is_token_valid():
-            logging.info("Reusing existing access token")
+        if self._is_token_valid(min_validity):
+            logging.debug("Reusing existing access token")
             return self.access_token
 
         logging.info("Starting token acquisition process")
-        private_key = CertificateLoader.load_certificate(self.certificate_path)
-
-        app = msal.ConfidentialClientApplication(
-            self.client_id,
-            authority=f"https://login.microsoftonline.com/{self.tenant_id}",
-            client_credential={
-                "thumbprint": self.thumbprint,
-                "private_key": private_key,
-            },
-        )
+        app = self._get_app()
         try:
             loop = asyncio.get_event_loop()
             result = await loop.run_in_executor(
@@ -102,19 +120,66 @@ class Authenticator:
             logging.error(f"Asyncio error: {e}")
             raise AsyncioError(f"Asyncio error: {e}")
 
-        return self._process_token_result(result)
+        access_token = self._process_token_result(result)
+        self._save_token_cache()
+        return access_token
+
+    def _get_app(self) -> msal.ConfidentialClientApplication:
+        """
+        Returns the MSAL application, loading the certificate and building the
+        application on first use only.
+
+        Returns:
+            msal.ConfidentialClientApplication: The MSAL application.
+        """
+        if self._app is None:
+            private_key = CertificateLoader.load_certificate(self.certificate_path)
+            self._app = msal.ConfidentialClientApplication(
+                self.client_id,
+                authority=f"https://login.microsoftonline.com/{self.tenant_id}",
+                client_credential={
+                    "thumbprint": self.thumbprint,
+                    "private_key": private_key,
+                },
+                token_cache=self._token_cache,
+            )
+        return self._app
+
+    def _save_token_cache(self) -> None:
+        """
+        Persists the MSAL token cache, readable by the current user only, if it changed.
+        The cache is written to a temporary file moved in place, so the worker
+        processes of a manifest migration never read a partly written cache.
+        """
+        if not self.token_cache_path or not self._token_cache.has_state_changed:
+            return
+        temporary_path = f"{self.token_cache_path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as cache_file:
+                cache_file.write(self._token_cache.serialize())
+            os.replace(temporary_path, self.token_cache_path)
+            self._token_cache.has_state_changed = False
+        except OSError as e:
+            logging.warning(
+                f"Failed to persist token cache {self.token_cache_path}: {e}"
+            )
 
-    def _is_token_valid(self) -> bool:
+    def _is_token_valid(self, min_validity: float = 0) -> bool:
         """
         Checks if the current access token is valid based on its expiry time.
 
+        Args:
+            min_validity (float): The number of seconds the token must remain valid.
+
         Returns:
             bool: True if the token is valid, False otherwise.
         """
         return (
             self.access_token is not None
             and self.token_expiry is not None
-            and datetime.now(timezone.utc) < self.token_expiry
+            and datetime.now(timezone.utc) + timedelta(seconds=min_validity)
+            < self.token_expiry
         )
 
     def _process_token_result(self, result: Dict[str, Any]) -> str:
@@ -131,7 +196,9 @@ class Authenticator:
             TokenAcquisitionError: If the token acquisition fails.
         """
         if "access_token" in result:
-            logging.info("Token acquisition successful")
+            logging.info(
+                f"Token acquisition successful (source: {result.get('token_source', 'identity_provider')})"
+            )
             self.access_token = result["access_token"]
             self.token_expiry = datetime.now(timezone.utc) + timedelta(
                 seconds=result["expires_in"]
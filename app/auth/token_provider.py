@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from app.auth.authenticator import Authenticator
+
+
+class TokenProvider:
+    """
+    A service that keeps a valid access token for the whole process. It reuses one
+    Authenticator (and so one MSAL application and token cache) and refreshes the
+    token in the background refresh_margin seconds before it expires.
+
+    Services call get_headers() for every request, so runs longer than the token
+    lifetime keep working. MSAL returns its cached token until it is within
+    Authenticator.MSAL_REFRESH_WINDOW seconds of expiry, so a larger refresh_margin
+    is capped to that window; otherwise no refresh would ever satisfy the margin and
+    every request would acquire a token again.
+
+    Attributes:
+        authenticator (Authenticator): The authenticator acquiring the tokens.
+        refresh_margin (float): Seconds before expiry at which the token is refreshed.
+        retry_interval (float): Seconds between attempts after a failed refresh.
+    """
+
+    def __init__(
+        self,
+        authenticator: Authenticator,
+        refresh_margin: float = 300.0,
+        retry_interval: float = 30.0,
+    ) -> None:
+        """
+        Initializes the TokenProvider instance with the authenticator to use.
+        """
+        self.authenticator = authenticator
+        if refresh_margin > Authenticator.MSAL_REFRESH_WINDOW:
+            logging.warning(
+                f"Token refresh margin {refresh_margin}s exceeds the MSAL refresh "
+                f"window; using {Authenticator.MSAL_REFRESH_WINDOW}s"
+            )
+            refresh_margin = Authenticator.MSAL_REFRESH_WINDOW
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Acquires the first token and starts the background refresh.
+
+        Raises:
+            TokenAcquisitionError: If the token acquisition fails.
+            MSALAuthenticationError: If there is an error with MSAL authentication.
+        """
+        await self.get_access_token()
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        """
+        Stops the background refresh.
+        """
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def get_access_token(self) -> str:
+        """
+        Returns a token valid for at least refresh_margin seconds, acquiring a new one
+        if needed. Concurrent callers share a single acquisition.
+
+        Returns:
+            str: The access token.
+        """
+        async with self._lock:
+            return await self.authenticator.get_access_token(self.refresh_margin)
+
+    async def get_headers(self) -> Dict[str, str]:
+        """
+        Returns the Authorization header with the current token.
+
+        Returns:
+            Dict[str, str]: The Authorization header.
+        """
+        return {"Authorization": f"Bearer {await self.get_access_token()}"}
+
+    async def _refresh_loop(self) -> None:
+        """
+        Refreshes the token refresh_margin seconds before it expires.
+        """
+        while True:
+            delay = self.retry_interval
+            expiry = self.authenticator.token_expiry
+            if expiry is not None:
+                remaining = (expiry - datetime.now(timezone.utc)).total_seconds()
+                delay = max(self.retry_interval, remaining - self.refresh_margin)
+            await asyncio.sleep(delay)
+            try:
+                await self.get_access_token()
+            except Exception as e:
+                logging.warning(f"Background token refresh failed: {e}")
+
+    async def __aenter__(self) -> "TokenProvider":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+
+class StaticTokenProvider(TokenProvider):
+    """
+    A token provider serving a fixed token, for callers that already hold one. It
+    has no authenticator and never refreshes.
+    """
+
+    def __init__(self, access_token: str) -> None:
+        super().__init__(None)  # type: ignore[arg-type]
+        self.access_token = access_token
+
+    async def start(self) -> None:
+        pass
+
+    async def get_access_token(self) -> str:
+        return self.access_token
@@ -1,60 +1,136 @@
+import atexit
 import logging
 import logging.config
-from typing import Any, Dict
+import logging.handlers
+import queue
+from typing import Any, Dict, Optional
 
 from app.exceptions import LoggingConfigurationError
+from app.utils.log_handlers import (
+    DeferredQueueHandler,
+    JsonFormatter,
+    RateLimitFilter,
+    request_log,
+)
 
 
 class LogSettings:
     """
     A class used to configure logging settings for the application.
 
+    With log_queue, the handlers of the root logger are moved behind a queue: logging
+    calls only append the record to an in-memory queue, and a background listener
+    thread formats and writes it, so console I/O never blocks the event loop. The
+    messages logged for every request go through the app.requests logger, which
+    keeps at most request_log_rate messages per second of each kind.
+
     Methods
     -------
-    __init__(log_level: str, log_format: str):
+    __init__(log_level: str, log_format: str, log_json: bool = False, log_queue: bool = True, request_log_rate: float = 10.0):
         Initializes the LogSettings instance with provided settings and configures logging.
+    stop():
+        Writes the queued records and stops the listener thread.
     """
 
-    def __init__(self, log_level: str, log_format: str) -> None:
-        self.configure_logging(log_level, log_format)
+    def __init__(
+        self,
+        log_level: str,
+        log_format: str,
+        log_json: bool = False,
+        log_queue: bool = True,
+        request_log_rate: float = 10.0,
+    ) -> None:
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self.configure_logging(
+            log_level, log_format, log_json, log_queue, request_log_rate
+        )
 
-    def configure_logging(self, log_level: str, log_format: str) -> None:
+    def configure_logging(
+        self,
+        log_level: str,
+        log_format: str,
+        log_json: bool = False,
+        log_queue: bool = True,
+        request_log_rate: float = 10.0,
+    ) -> None:
         """
         Configures logging settings.
 
         Args:
             log_level (str): The logging level.
-            log_format (str): The logging format.
+            log_format (str): The logging format, unused for JSON lines.
+            log_json (bool): Whether to write JSON lines instead of formatted text.
+            log_queue (bool): Whether to write the records from a background thread.
+            request_log_rate (float): The messages per second kept for each kind of
+                per-request message, 0 for no limit.
 
         Raises:
             LoggingConfigurationError: If there is an error configuring logging.
         """
-        logging_config: Dict[str, Any] = self._get_logging_config(log_level, log_format)
+        logging_config: Dict[str, Any] = self._get_logging_config(
+            log_level, log_format, log_json
+        )
         try:
             logging.config.dictConfig(logging_config)
+            for log_filter in list(request_log.filters):
+                if isinstance(log_filter, RateLimitFilter):
+                    request_log.removeFilter(log_filter)
+            if request_log_rate > 0:
+                request_log.addFilter(RateLimitFilter(request_log_rate))
+            if log_queue:
+                self._start_listener()
             logging.info("Logging is configured.")
         except Exception as e:
             raise LoggingConfigurationError(f"Error configuring logging: {e}")
 
+    def stop(self) -> None:
+        """
+        Writes the queued records and stops the listener thread.
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def _start_listener(self) -> None:
+        """
+        Replaces the handlers of the root logger with a queue, and starts a listener
+        thread passing the queued records to them.
+        """
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        for handler in handlers:
+            root.removeHandler(handler)
+        root.addHandler(DeferredQueueHandler(records))
+        self.listener = logging.handlers.QueueListener(
+            records, *handlers, respect_handler_level=True
+        )
+        self.listener.start()
+        atexit.register(self.stop)
+
     @staticmethod
-    def _get_logging_config(log_level: str, log_format: str) -> Dict[str, Any]:
+    def _get_logging_config(
+        log_level: str, log_format: str, log_json: bool = False
+    ) -> Dict[str, Any]:
         """
         Returns the logging configuration dictionary.
 
         Args:
             log_level (str): The logging level.
             log_format (str): The logging format.
+            log_json (bool): Whether to format records as JSON lines.
 
         Returns:
             Dict[str, Any]: The logging configuration dictionary.
         """
+        formatter: Dict[str, Any] = {"format": log_format}
+        if log_json:
+            formatter = {"()": JsonFormatter}
         return {
             "version": 1,
             "disable_existing_loggers": False,
             "formatters": {
-                "standard": {
-                    "format": log_format,
-                },
+                "standard": formatter,
             },
             "handlers": {
                 "console": {
@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Any, List, Mapping, Optional
 
 from dotenv import load_dotenv
 
@@ -10,12 +10,24 @@ class Settings:
     """
     A class used to load and store configuration settings from environment variables.
 
+    The settings of one site of a multi-site migration are loaded with the values of
+    its manifest entry as overrides, which take precedence over the environment and
+    are parsed the same way.
+
     Attributes
     ----------
     LOG_LEVEL : str
         The logging level.
     LOG_FORMAT : str
         The logging format.
+    LOG_JSON : bool
+        Whether to write logs as JSON lines instead of LOG_FORMAT.
+    LOG_QUEUE : bool
+        Whether to write logs from a background thread, so the event loop never waits
+        for console I/O.
+    LOG_REQUEST_RATE : float
+        The messages per second kept for each kind of per-request message, such as
+        retries (0 for no limit).
     CLIENT_ID : str
         The client ID for authentication.
     TENANT_ID : str
@@ -28,12 +40,18 @@ class Settings:
         The path to the certificate file.
     API_SCOPE : str
         The API scope for authentication.
+    TOKEN_CACHE_PATH : str
+        The file the MSAL token cache is persisted to, by default in DATA_DIR (empty
+        to disable).
+    TOKEN_REFRESH_MARGIN : float
+        The number of seconds before expiry at which the access token is refreshed,
+        at most 300 since MSAL serves its cached token until then.
     ORIGIN_URL : str
         The origin URL of the SharePoint site.
     PARTIAL_ORIGIN_URL : str
         The partial URL of the SharePoint site.
     FETCH_FILENAME : str
-        The filename for the fetched SharePoint folder structure.
+        The filename of the optional Excel export of the folder structure.
     BASE_URL : str
         The base URL of the SharePoint site.
     IS_MOVE_MODE : bool
@@ -54,34 +72,191 @@ class Settings:
         Whether to exclude children.
     LEVEL : int
         The level of items to create copy jobs for.
+    SELECT_NAME_PATTERNS : List[str]
+        Glob patterns of the folder names to create copy jobs for (empty for all).
+    SELECT_MODIFIED_SINCE : str
+        Only create copy jobs for folders modified at or after this ISO date (empty for all).
+    SELECT_MIN_ITEM_COUNT : int
+        The minimum ItemCount of a folder to create a copy job for.
+    SELECT_MAX_ITEM_COUNT : int
+        The maximum ItemCount of a folder to create a copy job for (0 for no limit).
+    FOLDER_INCLUDE : List[str]
+        Filter rules of the folders to crawl and copy, separated by ";" (empty for all),
+        e.g. "path:Projects/*;level<=3".
+    FOLDER_EXCLUDE : List[str]
+        Filter rules of the folders to skip with their subfolders, separated by ";",
+        e.g. "name:Forms;path~^Archive/;modified<2020-01-01". Excluded subtrees are
+        not crawled.
+    COPY_JOB_BATCH_SIZE : int
+        The maximum number of folders per CreateCopyJobs call.
+    COPY_JOB_BATCH_MAX_ITEMS : int
+        The maximum total ItemCount per CreateCopyJobs call (0 for no limit).
+    COPY_JOB_PARTITION : str
+        How folders are cut into copy jobs: "level" (every folder at LEVEL) or "items"
+        (subtrees of at most COPY_JOB_MAX_ITEMS items, splitting larger folders).
+    COPY_JOB_MAX_ITEMS : int
+        The maximum number of items per copy job in "items" partitioning.
+    COPY_JOB_PRESERVE_HIERARCHY : bool
+        Whether to copy each folder at LEVEL below the destination path of its parent
+        folder, creating its ancestors in the destination first, instead of directly
+        into DESTINATION_URL.
+    COPY_JOB_PROVISION_BATCH_SIZE : int
+        The maximum number of destination folders created per $batch request.
+    DESTINATION_SITE_URL : str
+        The URL of the destination site, needed when the DESTINATION_URL folder is in
+        a subsite (empty to derive it from DESTINATION_URL).
+    JOB_LEDGER_FILENAME : str
+        The filename of the ledger of submitted copy jobs (empty to disable).
+    PIPELINE_JOBS : bool
+        Whether to create the copy jobs of the folders at LEVEL while the crawl runs.
+    PIPELINE_QUEUE_SIZE : int
+        The number of folders waiting for a copy job above which the crawl pauses.
+    MONITOR_JOBS : bool
+        Whether to monitor the created copy jobs until they finish.
+    MONITOR_MIN_INTERVAL : float
+        The number of seconds between polls of an active copy job.
+    MONITOR_MAX_INTERVAL : float
+        The maximum number of seconds between polls of an idle copy job.
+    MONITOR_BATCH_SIZE : int
+        The maximum number of copy jobs polled per batch.
+    MONITOR_MAX_REQUESTS_PER_SECOND : float
+        The maximum number of progress requests per second.
     DESTINATION_URL : str
         The destination URL for the copy jobs.
     AIOHTTP_LIMIT : int
         The connection limit for aiohttp.
+    AIOHTTP_KEEPALIVE_TIMEOUT : float
+        The number of seconds an idle pooled connection is kept open for reuse.
+    AIOHTTP_DNS_CACHE_TTL : int
+        The number of seconds a resolved host is kept in the DNS cache.
+    RATE_MIN_CONCURRENCY : int
+        The lowest number of concurrent SharePoint requests the rate governor allows.
+    RATE_MAX_CONCURRENCY : int
+        The highest number of concurrent SharePoint requests the rate governor allows.
+    RATE_MAX_RETRIES : int
+        The number of retries of a throttled or failed SharePoint request.
+    RATE_LATENCY_TARGET : float
+        The request latency in seconds above which the rate governor reduces concurrency.
+    RATE_BREAKER_THRESHOLD : int
+        The consecutive server or network errors that pause all requests (0 to disable).
+    RATE_BREAKER_COOLDOWN : float
+        The number of seconds requests are paused when the circuit breaker opens.
+    CRAWL_WORKERS : int
+        The number of worker tasks crawling the folder structure (0 to match RATE_MAX_CONCURRENCY).
+    CRAWL_QUEUE_SIZE : int
+        The maximum number of pending folders kept in memory during the crawl.
+    CRAWL_PROGRESS_INTERVAL : float
+        The number of seconds between crawl progress reports.
+    CRAWL_ENUMERATION : str
+        How folders are enumerated: "folders" (one request per folder) or "list"
+        (paged list item queries over the document library).
+    CRAWL_LIST_PAGE_SIZE : int
+        The number of list items per page in "list" enumeration (at most 5000).
+    CRAWL_LIST_SERVER_SIDE_FILTER : bool
+        Whether "list" enumeration filters folders on the server with FSObjType.
+    ODATA_METADATA : str
+        The OData metadata level requested from SharePoint ("verbose", "minimalmetadata"
+        or "nometadata").
+    CRAWL_CHECKPOINT_FILENAME : str
+        The filename of the checkpoint an interrupted crawl is resumed from.
+    CRAWL_CHECKPOINT_INTERVAL : float
+        The number of seconds between crawl checkpoints.
+    CRAWL_FOLDER_RETRIES : int
+        The number of times a folder whose listing failed is retried before it is
+        quarantined.
+    CRAWL_FOLDER_RETRY_DELAY : float
+        The base number of seconds before a failed folder is retried.
+    CRAWL_QUARANTINE_FILENAME : str
+        The filename of the list of folders the crawl could not list.
+    CRAWL_MAX_QUARANTINED : int
+        The number of quarantined folders above which the crawl fails (0 to fail on
+        the first folder that cannot be listed).
+    INVENTORY_BACKEND : str
+        The folder inventory backend ("sqlite", "parquet", "jsonl" or "excel").
+    INVENTORY_FILENAME : str
+        The filename of the folder inventory.
+    EXPORT_EXCEL : bool
+        Whether to also export the folder inventory to the FETCH_FILENAME Excel file.
+    INCREMENTAL_CRAWL : bool
+        Whether to recrawl an existing inventory incrementally instead of reusing it.
+    CHANGESET_FILENAME : str
+        The filename of the changeset written by an incremental crawl.
+    METRICS_PROMETHEUS_PATH : str
+        The Prometheus text file the request metrics are written to, by default in
+        DATA_DIR (empty to disable).
+    METRICS_SUMMARY_PATH : str
+        The JSON file the run summary is written to, by default in DATA_DIR (empty to
+        disable).
+    DATA_DIR : str
+        The directory of the inventory, checkpoint, quarantine, changeset, ledger,
+        token cache and metrics files.
+    ORCHESTRATOR_MAX_SITES : int
+        The number of sites of a manifest migrated at the same time.
+    ORCHESTRATOR_SITE_CONCURRENCY : int
+        The highest number of concurrent SharePoint requests of one site of a manifest
+        (0 for no limit besides RATE_MAX_CONCURRENCY).
+    ORCHESTRATOR_PROCESSES : int
+        The number of worker processes the sites of a manifest are spread across (0 or
+        1 to migrate them in the main process).
+    ORCHESTRATOR_REPORT_FILENAME : str
+        The filename of the progress report of a manifest migration.
+    ORCHESTRATOR_PROGRESS_INTERVAL : float
+        The number of seconds between progress reports of a manifest migration.
+    VERIFY_INVENTORY_FILENAME : str
+        The filename of the destination folder inventory crawled by --verify.
+    VERIFY_REPORT_FILENAME : str
+        The filename of the JSON Lines report of the differences found by --verify.
 
     Methods
     -------
-    __init__():
+    __init__(overrides: Optional[Mapping[str, Any]] = None, require_site: bool = True):
         Initializes the Settings instance and loads environment variables.
     """
 
-    def __init__(self) -> None:
+    # The settings every entry of a site manifest must set.
+    SITE_SETTINGS = ("ORIGIN_URL", "PARTIAL_ORIGIN_URL", "DESTINATION_URL")
+
+    def __init__(
+        self, overrides: Optional[Mapping[str, Any]] = None, require_site: bool = True
+    ) -> None:
         """
         Initializes the Settings instance and loads environment variables.
+
+        Args:
+            overrides (Optional[Mapping[str, Any]]): Values taking precedence over the
+                environment variables, e.g. those of a site of a manifest.
+            require_site (bool): Whether the SITE_SETTINGS must be set. The settings a
+                manifest migration is started with leave them to the manifest.
         """
         load_dotenv()
+        self._overrides = {
+            name: str(value) for name, value in (overrides or {}).items()
+        }
+        site_default = None if require_site else ""
         self.LOG_LEVEL: str = self._get_env_var("LOG_LEVEL", "INFO").upper()
         self.LOG_FORMAT: str = self._get_env_var(
             "LOG_FORMAT", "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
         )
+        self.LOG_JSON: bool = self._get_env_var("LOG_JSON", "False").lower() == "true"
+        self.LOG_QUEUE: bool = self._get_env_var("LOG_QUEUE", "True").lower() == "true"
+        self.LOG_REQUEST_RATE: float = float(self._get_env_var("LOG_REQUEST_RATE", 10))
         self.CLIENT_ID: str = self._get_env_var("CLIENT_ID")
         self.TENANT_ID: str = self._get_env_var("TENANT_ID")
         self.TENANT_NAME: str = self._get_env_var("TENANT_NAME")
         self.THUMBPRINT: str = self._get_env_var("THUMBPRINT")
         self.CERTIFICATE_PATH: str = self._get_env_var("CERTIFICATE_PATH")
         self.API_SCOPE: str = self._get_env_var("API_SCOPE")
-        self.ORIGIN_URL: str = self._get_env_var("ORIGIN_URL")
-        self.PARTIAL_ORIGIN_URL: str = self._get_env_var("PARTIAL_ORIGIN_URL")
+        self.DATA_DIR: str = self._get_env_var("DATA_DIR", "app/data")
+        self.TOKEN_CACHE_PATH: str = self._get_env_var(
+            "TOKEN_CACHE_PATH", os.path.join(self.DATA_DIR, "token_cache.json")
+        )
+        self.TOKEN_REFRESH_MARGIN: float = float(
+            self._get_env_var("TOKEN_REFRESH_MARGIN", 300)
+        )
+        self.ORIGIN_URL: str = self._get_env_var("ORIGIN_URL", site_default)
+        self.PARTIAL_ORIGIN_URL: str = self._get_env_var(
+            "PARTIAL_ORIGIN_URL", site_default
+        )
         self.FETCH_FILENAME: str = self._get_env_var("FETCH_FILENAME")
         self.BASE_URL: str = self._get_env_var("BASE_URL")
         self.IS_MOVE_MODE: bool = (
@@ -112,13 +287,175 @@ class Settings:
             self._get_env_var("EXCLUDE_CHILDREN", "False").lower() == "true"
         )
         self.LEVEL: int = int(self._get_env_var("LEVEL", 0))
-        self.DESTINATION_URL: str = self._get_env_var("DESTINATION_URL")
+        self.SELECT_NAME_PATTERNS: List[str] = [
+            pattern.strip()
+            for pattern in self._get_env_var("SELECT_NAME_PATTERNS", "").split(",")
+            if pattern.strip()
+        ]
+        self.SELECT_MODIFIED_SINCE: str = self._get_env_var("SELECT_MODIFIED_SINCE", "")
+        self.SELECT_MIN_ITEM_COUNT: int = int(
+            self._get_env_var("SELECT_MIN_ITEM_COUNT", 0)
+        )
+        self.SELECT_MAX_ITEM_COUNT: int = int(
+            self._get_env_var("SELECT_MAX_ITEM_COUNT", 0)
+        )
+        self.FOLDER_INCLUDE: List[str] = [
+            rule.strip()
+            for rule in self._get_env_var("FOLDER_INCLUDE", "").split(";")
+            if rule.strip()
+        ]
+        self.FOLDER_EXCLUDE: List[str] = [
+            rule.strip()
+            for rule in self._get_env_var("FOLDER_EXCLUDE", "").split(";")
+            if rule.strip()
+        ]
+        self.COPY_JOB_BATCH_SIZE: int = int(self._get_env_var("COPY_JOB_BATCH_SIZE", 1))
+        self.COPY_JOB_BATCH_MAX_ITEMS: int = int(
+            self._get_env_var("COPY_JOB_BATCH_MAX_ITEMS", 0)
+        )
+        self.COPY_JOB_PARTITION: str = self._get_env_var(
+            "COPY_JOB_PARTITION", "level"
+        ).lower()
+        self.COPY_JOB_MAX_ITEMS: int = int(
+            self._get_env_var("COPY_JOB_MAX_ITEMS", 100000)
+        )
+        self.COPY_JOB_PRESERVE_HIERARCHY: bool = (
+            self._get_env_var("COPY_JOB_PRESERVE_HIERARCHY", "False").lower() == "true"
+        )
+        self.COPY_JOB_PROVISION_BATCH_SIZE: int = int(
+            self._get_env_var("COPY_JOB_PROVISION_BATCH_SIZE", 100)
+        )
+        self.DESTINATION_SITE_URL: str = self._get_env_var("DESTINATION_SITE_URL", "")
+        self.JOB_LEDGER_FILENAME: str = self._get_env_var(
+            "JOB_LEDGER_FILENAME", "copy_jobs_ledger.db"
+        )
+        self.PIPELINE_JOBS: bool = (
+            self._get_env_var("PIPELINE_JOBS", "False").lower() == "true"
+        )
+        self.PIPELINE_QUEUE_SIZE: int = int(
+            self._get_env_var("PIPELINE_QUEUE_SIZE", 1000)
+        )
+        self.MONITOR_JOBS: bool = (
+            self._get_env_var("MONITOR_JOBS", "False").lower() == "true"
+        )
+        self.MONITOR_MIN_INTERVAL: float = float(
+            self._get_env_var("MONITOR_MIN_INTERVAL", 5)
+        )
+        self.MONITOR_MAX_INTERVAL: float = float(
+            self._get_env_var("MONITOR_MAX_INTERVAL", 300)
+        )
+        self.MONITOR_BATCH_SIZE: int = int(self._get_env_var("MONITOR_BATCH_SIZE", 50))
+        self.MONITOR_MAX_REQUESTS_PER_SECOND: float = float(
+            self._get_env_var("MONITOR_MAX_REQUESTS_PER_SECOND", 10)
+        )
+        self.DESTINATION_URL: str = self._get_env_var("DESTINATION_URL", site_default)
         self.AIOHTTP_LIMIT: int = int(self._get_env_var("AIOHTTP_LIMIT", 10))
+        self.AIOHTTP_KEEPALIVE_TIMEOUT: float = float(
+            self._get_env_var("AIOHTTP_KEEPALIVE_TIMEOUT", 30)
+        )
+        self.AIOHTTP_DNS_CACHE_TTL: int = int(
+            self._get_env_var("AIOHTTP_DNS_CACHE_TTL", 300)
+        )
+        self.RATE_MIN_CONCURRENCY: int = int(
+            self._get_env_var("RATE_MIN_CONCURRENCY", 1)
+        )
+        self.RATE_MAX_CONCURRENCY: int = int(
+            self._get_env_var("RATE_MAX_CONCURRENCY", self.AIOHTTP_LIMIT * 4)
+        )
+        self.RATE_MAX_RETRIES: int = int(self._get_env_var("RATE_MAX_RETRIES", 5))
+        self.RATE_LATENCY_TARGET: float = float(
+            self._get_env_var("RATE_LATENCY_TARGET", 5)
+        )
+        self.RATE_BREAKER_THRESHOLD: int = int(
+            self._get_env_var("RATE_BREAKER_THRESHOLD", 20)
+        )
+        self.RATE_BREAKER_COOLDOWN: float = float(
+            self._get_env_var("RATE_BREAKER_COOLDOWN", 30)
+        )
+        self.CRAWL_WORKERS: int = int(self._get_env_var("CRAWL_WORKERS", 0))
+        self.CRAWL_QUEUE_SIZE: int = int(self._get_env_var("CRAWL_QUEUE_SIZE", 10000))
+        self.CRAWL_PROGRESS_INTERVAL: float = float(
+            self._get_env_var("CRAWL_PROGRESS_INTERVAL", 30)
+        )
+        self.CRAWL_ENUMERATION: str = self._get_env_var(
+            "CRAWL_ENUMERATION", "folders"
+        ).lower()
+        self.CRAWL_LIST_PAGE_SIZE: int = int(
+            self._get_env_var("CRAWL_LIST_PAGE_SIZE", 5000)
+        )
+        self.CRAWL_LIST_SERVER_SIDE_FILTER: bool = (
+            self._get_env_var("CRAWL_LIST_SERVER_SIDE_FILTER", "True").lower() == "true"
+        )
+        self.ODATA_METADATA: str = self._get_env_var(
+            "ODATA_METADATA", "nometadata"
+        ).lower()
+        self.CRAWL_CHECKPOINT_FILENAME: str = self._get_env_var(
+            "CRAWL_CHECKPOINT_FILENAME", "crawl_checkpoint.json"
+        )
+        self.CRAWL_CHECKPOINT_INTERVAL: float = float(
+            self._get_env_var("CRAWL_CHECKPOINT_INTERVAL", 60)
+        )
+        self.CRAWL_FOLDER_RETRIES: int = int(
+            self._get_env_var("CRAWL_FOLDER_RETRIES", 2)
+        )
+        self.CRAWL_FOLDER_RETRY_DELAY: float = float(
+            self._get_env_var("CRAWL_FOLDER_RETRY_DELAY", 5)
+        )
+        self.CRAWL_QUARANTINE_FILENAME: str = self._get_env_var(
+            "CRAWL_QUARANTINE_FILENAME", "crawl_quarantine.jsonl"
+        )
+        self.CRAWL_MAX_QUARANTINED: int = int(
+            self._get_env_var("CRAWL_MAX_QUARANTINED", 100)
+        )
+        self.INVENTORY_BACKEND: str = self._get_env_var(
+            "INVENTORY_BACKEND", "sqlite"
+        ).lower()
+        inventory_extension = {"sqlite": "db", "excel": "xlsx"}.get(
+            self.INVENTORY_BACKEND, self.INVENTORY_BACKEND
+        )
+        self.INVENTORY_FILENAME: str = self._get_env_var(
+            "INVENTORY_FILENAME", f"sharepoint_folder_structure.{inventory_extension}"
+        )
+        self.EXPORT_EXCEL: bool = (
+            self._get_env_var("EXPORT_EXCEL", "False").lower() == "true"
+        )
+        self.INCREMENTAL_CRAWL: bool = (
+            self._get_env_var("INCREMENTAL_CRAWL", "False").lower() == "true"
+        )
+        self.CHANGESET_FILENAME: str = self._get_env_var(
+            "CHANGESET_FILENAME", "inventory_changeset.jsonl"
+        )
+        self.METRICS_PROMETHEUS_PATH: str = self._get_env_var(
+            "METRICS_PROMETHEUS_PATH", os.path.join(self.DATA_DIR, "metrics.prom")
+        )
+        self.METRICS_SUMMARY_PATH: str = self._get_env_var(
+            "METRICS_SUMMARY_PATH", os.path.join(self.DATA_DIR, "run_summary.json")
+        )
+        self.ORCHESTRATOR_MAX_SITES: int = int(
+            self._get_env_var("ORCHESTRATOR_MAX_SITES", 4)
+        )
+        self.ORCHESTRATOR_SITE_CONCURRENCY: int = int(
+            self._get_env_var("ORCHESTRATOR_SITE_CONCURRENCY", 10)
+        )
+        self.ORCHESTRATOR_PROCESSES: int = int(
+            self._get_env_var("ORCHESTRATOR_PROCESSES", 0)
+        )
+        self.ORCHESTRATOR_REPORT_FILENAME: str = self._get_env_var(
+            "ORCHESTRATOR_REPORT_FILENAME", "migration_report.json"
+        )
+        self.ORCHESTRATOR_PROGRESS_INTERVAL: float = float(
+            self._get_env_var("ORCHESTRATOR_PROGRESS_INTERVAL", 60)
+        )
+        self.VERIFY_INVENTORY_FILENAME: str = self._get_env_var(
+            "VERIFY_INVENTORY_FILENAME", f"destination_structure.{inventory_extension}"
+        )
+        self.VERIFY_REPORT_FILENAME: str = self._get_env_var(
+            "VERIFY_REPORT_FILENAME", "verification_report.jsonl"
+        )
 
-    @staticmethod
-    def _get_env_var(name: str, default: Optional[str] = None) -> str:
+    def _get_env_var(self, name: str, default: Optional[str] = None) -> str:
         """
-        Gets an environment variable or returns a default value.
+        Gets an override or an environment variable, or returns a default value.
 
         Args:
             name (str): The name of the environment variable.
@@ -130,7 +467,7 @@ class Settings:
         Raises:
             EnvironmentVariableError: If the environment variable is not set and no default value is provided.
         """
-        value = os.getenv(name, default)
+        value = self._overrides.get(name, os.getenv(name, default))
         if value is None:
             raise EnvironmentVariableError(
                 f"Environment variable {name} is not set and no default value provided."
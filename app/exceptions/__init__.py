@@ -9,15 +9,26 @@ from .certificate_exceptions import (
 )
 from .configuration_exceptions import (
     EnvironmentVariableError,
+    FilterRuleError,
     LoggingConfigurationError,
+    SiteManifestError,
 )
 from .excel_exceptions import (
     ExcelReadError,
     ExcelWriteError,
 )
-from .job_exceptions import JobCreationError
+from .inventory_exceptions import (
+    InventoryReadError,
+    InventoryWriteError,
+)
+from .job_exceptions import (
+    JobCreationError,
+    JobLedgerError,
+    JobMonitoringError,
+)
 from .main_exceptions import MainExecutionError
 from .sharepoint_exceptions import (
+    FolderProvisioningError,
     SharePointAPIError,
     SharePointStructureFetchError,
     SharePointSubfolderFetchError,
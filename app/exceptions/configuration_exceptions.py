@@ -8,3 +8,15 @@ class LoggingConfigurationError(Exception):
     """Exception raised for errors in configuring logging."""
 
     pass
+
+
+class FilterRuleError(Exception):
+    """Exception raised for invalid folder filter rules."""
+
+    pass
+
+
+class SiteManifestError(Exception):
+    """Exception raised for invalid site manifests."""
+
+    pass
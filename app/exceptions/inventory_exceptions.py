@@ -0,0 +1,10 @@
+class InventoryReadError(Exception):
+    """Exception raised for errors in reading the folder inventory."""
+
+    pass
+
+
+class InventoryWriteError(Exception):
+    """Exception raised for errors in writing the folder inventory."""
+
+    pass
@@ -2,3 +2,15 @@ class JobCreationError(Exception):
     """Exception raised for errors in the job creation process."""
 
     pass
+
+
+class JobMonitoringError(Exception):
+    """Exception raised for errors in the job monitoring process."""
+
+    pass
+
+
+class JobLedgerError(Exception):
+    """Exception raised for errors reading or writing the copy job ledger."""
+
+    pass
@@ -14,3 +14,9 @@ class SharePointSubfolderFetchError(Exception):
     """Exception raised for errors in fetching the SharePoint subfolders."""
 
     pass
+
+
+class FolderProvisioningError(Exception):
+    """Exception raised for errors in creating the destination folders."""
+
+    pass
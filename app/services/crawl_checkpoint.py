@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from app.exceptions import InventoryReadError, InventoryWriteError
+
+
+class CrawlCheckpoint:
+    """
+    A checkpoint file holding the state of an interrupted crawl, so that a resumed
+    run continues where it stopped without listing finished folders again.
+
+    The state is saved periodically and when the crawl fails. It holds the crawl
+    frontier (the folders still to be listed, including the ones whose request was
+    in flight) or the next page of a list enumeration, and the number of records the
+    partial inventory held when the state was saved. The sink is flushed before the
+    file is written, so the inventory and the checkpoint always agree.
+
+    Attributes:
+        path (str): The path to the checkpoint file.
+        interval (float): Seconds between periodic checkpoints.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, interval: float = 60.0) -> None:
+        self.path = path
+        self.interval = interval
+
+    def save(self, state: Dict[str, Any]) -> None:
+        """
+        Writes the crawl state to a temporary file and moves it in place, so a crash
+        while saving leaves the previous checkpoint intact.
+
+        Args:
+            state (Dict[str, Any]): The crawl state.
+
+        Raises:
+            InventoryWriteError: If the checkpoint cannot be written.
+        """
+        temporary_path = f"{self.path}.tmp"
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                json.dump(
+                    {"version": self.VERSION, "saved_at": time.time(), **state}, file
+                )
+            os.replace(temporary_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            logging.error(f"Failed to save crawl checkpoint {self.path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to save crawl checkpoint {self.path}: {e}"
+            )
+        logging.info(
+            f"Crawl checkpoint saved: {state.get('records', 0)} records, "
+            f"{len(state.get('frontier', []))} folders pending"
+        )
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        Reads the saved crawl state.
+
+        Returns:
+            Optional[Dict[str, Any]]: The crawl state, or None if there is no checkpoint.
+
+        Raises:
+            InventoryReadError: If the checkpoint cannot be read.
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                state = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to read crawl checkpoint {self.path}: {e}")
+            raise InventoryReadError(
+                f"Failed to read crawl checkpoint {self.path}: {e}"
+            )
+        if state.get("version") != self.VERSION:
+            raise InventoryReadError(
+                f"Unsupported crawl checkpoint version in {self.path}"
+            )
+        return state
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List
+
+from app.exceptions import InventoryReadError, InventoryWriteError
+from app.services.folder_crawler import CrawlItem
+
+
+class CrawlQuarantine:
+    """
+    A JSON Lines file of the folders a crawl could not list, so a few bad folders do
+    not fail a long crawl. Each line holds the folder as a crawl frontier item with
+    the last error and the number of attempts.
+
+    A folder is appended as soon as it is quarantined, so the file survives a crash.
+    The quarantined folders are retried on their own with `python main.py
+    --retry-quarantine`, which crawls their subtrees into the existing inventory.
+    While a retry crawl runs, the folders it retries are kept aside in a second file,
+    removed once its inventory is committed, so a retry interrupted before its first
+    checkpoint can still be retried; folders failing again go to a new quarantine.
+
+    Attributes:
+        path (str): The path to the quarantine file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.retry_path = f"{path}.retrying"
+
+    def add(self, item: CrawlItem, error: Exception, attempts: int) -> None:
+        """
+        Appends a folder to the quarantine.
+
+        Args:
+            item (CrawlItem): The folder that could not be listed.
+            error (Exception): The last error.
+            attempts (int): The number of times the folder was tried.
+
+        Raises:
+            InventoryWriteError: If the quarantine cannot be written.
+        """
+        entry = {
+            "server_relative_url": item.server_relative_url,
+            "path": item.path,
+            "level": item.level,
+            "error": str(error),
+            "attempts": attempts,
+            "quarantined_at": time.time(),
+        }
+        try:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            logging.error(f"Failed to write crawl quarantine {self.path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to write crawl quarantine {self.path}: {e}"
+            )
+
+    def load(self) -> List[Dict[str, Any]]:
+        """
+        Reads the quarantined folders, with the ones set aside by an unfinished
+        retry crawl.
+
+        Returns:
+            List[Dict[str, Any]]: The quarantine entries, empty if there is no file.
+
+        Raises:
+            InventoryReadError: If the quarantine cannot be read.
+        """
+        entries: List[Dict[str, Any]] = []
+        for path in (self.retry_path, self.path):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, encoding="utf-8") as file:
+                    entries.extend(json.loads(line) for line in file if line.strip())
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to read crawl quarantine {path}: {e}")
+                raise InventoryReadError(f"Failed to read crawl quarantine {path}: {e}")
+        return entries
+
+    def resume_state(self) -> Dict[str, Any]:
+        """
+        Builds a crawl state whose frontier is the quarantined folders, so resuming it
+        lists their subtrees again.
+
+        Returns:
+            Dict[str, Any]: The crawl state, in the format of the crawl checkpoint.
+        """
+        frontier = {}
+        for entry in self.load():
+            frontier[entry["path"]] = [
+                entry["server_relative_url"],
+                entry["path"],
+                entry["level"],
+            ]
+        return {"enumeration": "folders", "frontier": list(frontier.values())}
+
+    def begin_retry(self) -> None:
+        """
+        Sets the quarantined folders aside for a retry crawl, appending them to the
+        folders an unfinished retry crawl set aside, so the folders failing again
+        start a new quarantine.
+
+        Raises:
+            InventoryWriteError: If the quarantine cannot be set aside.
+        """
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as source, open(self.retry_path, "ab") as target:
+                target.write(source.read())
+                target.flush()
+                os.fsync(target.fileno())
+            os.remove(self.path)
+        except OSError as e:
+            logging.error(f"Failed to set aside crawl quarantine {self.path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to set aside crawl quarantine {self.path}: {e}"
+            )
+
+    def end_retry(self) -> None:
+        """
+        Drops the folders set aside by a retry crawl, once its inventory is committed.
+        """
+        if os.path.exists(self.retry_path):
+            os.remove(self.retry_path)
+
+    def remove(self) -> None:
+        for path in (self.path, self.retry_path):
+            if os.path.exists(path):
+                os.remove(path)
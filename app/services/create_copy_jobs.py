@@ -1,22 +1,53 @@
 import asyncio
+import collections
 import logging
+import time
 import urllib.parse
-from typing import Any, Dict, List
+from typing import (
+    Any,
+    Awaitable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 import aiohttp
-import pandas as pd
 
+from app.auth.token_provider import TokenProvider
 from app.exceptions import (
-    ExcelReadError,
     JobCreationError,
     SharePointAPIError,
 )
+from app.services.folder_provisioner import FolderProvisioner
+from app.services.folder_selector import FolderSelector
+from app.services.inventory_store import ExcelInventoryStore, InventoryStore
+from app.services.job_ledger import JobLedger
+from app.services.job_partitioner import JobPartitioner
+from app.utils import odata
+from app.utils.http_session import PooledSession
+from app.utils.log_handlers import request_log
+from app.utils.rate_governor import Governor, RateGovernor
+
+
+class CopyJobBatch(NamedTuple):
+    """The origin URLs submitted together in one CreateCopyJobs call."""
+
+    destination_uri: str
+    exclude_children: bool
+    origin_urls: List[str]
 
 
 class CopyJobsCreator:
+    # Seconds between the progress reports of the job creation.
+    PROGRESS_INTERVAL = 30.0
+
     def __init__(
         self,
-        access_token: str,
+        token_provider: TokenProvider,
         level: int,
         destination_url: str,
         base_url: str,
@@ -30,22 +61,55 @@ class CopyJobsCreator:
         bypass_shared_lock: bool,
         move_but_keep_source: bool,
         exclude_children: bool,
+        inventory_store: Optional[InventoryStore] = None,
+        batch_size: int = 1,
+        batch_max_items: int = 0,
+        rate_governor: Optional[Governor] = None,
+        tenant_url: Optional[str] = None,
+        job_ledger: Optional[JobLedger] = None,
+        partitioner: Optional[JobPartitioner] = None,
+        odata_metadata: str = "nometadata",
+        selector: Optional[FolderSelector] = None,
+        provisioner: Optional[FolderProvisioner] = None,
     ) -> None:
         """
         Initializes the CopyJobsCreator instance.
 
         Args:
             settings (Settings): The settings instance containing configuration.
-            access_token (str): The access token for authentication.
+            token_provider (TokenProvider): The provider of the current access token.
             level (int): The level of items to create copy jobs for.
             destination_url (str): The destination URL for the copy jobs.
+            inventory_store (Optional[InventoryStore]): The folder inventory to read,
+                defaults to the Excel file written by earlier versions.
+            batch_size (int): The maximum number of folders per CreateCopyJobs call.
+            batch_max_items (int): The maximum total ItemCount per call, 0 for no limit.
+            rate_governor (Optional[Governor]): The shared governor of SharePoint requests.
+            tenant_url (Optional[str]): The root URL of the tenant, defaults to
+                https://{tenant_name}.sharepoint.com.
+            job_ledger (Optional[JobLedger]): The ledger of the jobs already submitted;
+                when given, folders with a created or completed job are skipped.
+            partitioner (Optional[JobPartitioner]): Plans jobs of bounded size across
+                levels instead of taking every folder at the given level. Each job is
+                then copied below the destination path of its parent folder.
+            odata_metadata (str): The OData metadata level of the responses.
+            selector (Optional[FolderSelector]): Narrows down the folders copied by
+                name, modification date and ItemCount; defaults to every folder at
+                the given level. With a partitioner, it is applied to the planned jobs
+                regardless of their level.
+            provisioner (Optional[FolderProvisioner]): Creates the destination
+                folders of the jobs copied below the path of their parent folder
+                before the jobs are submitted. With level partitioning, it also keeps
+                the parent hierarchy of the folders at the given level: each is
+                copied below the destination path of its parent folder.
         """
-        self.access_token = access_token
+        self.token_provider = token_provider
         self.level = level
         self.destination_url = destination_url
         self.base_url = base_url
         self.aiohttp_limit = aiohttp_limit
         self.tenant_name = tenant_name
+        self.tenant_url = tenant_url or f"https://{tenant_name}.sharepoint.com"
         self.is_move_mode = is_move_mode
         self.ignore_version_history = ignore_version_history
         self.allow_schema_mismatch = allow_schema_mismatch
@@ -56,124 +120,371 @@ class CopyJobsCreator:
         self.bypass_shared_lock = bypass_shared_lock
         self.move_but_keep_source = move_but_keep_source
         self.exclude_children = exclude_children
+        self.inventory_store = inventory_store or ExcelInventoryStore(
+            "app/data/sharepoint_folder_structure.xlsx"
+        )
+        self.batch_size = max(1, batch_size)
+        self.batch_max_items = batch_max_items
+        self.rate_governor = rate_governor or RateGovernor(aiohttp_limit)
+        self.job_ledger = job_ledger
+        self.partitioner = partitioner
+        self.odata_metadata = odata_metadata
+        self.selector = selector or FolderSelector(level)
+        self.provisioner = provisioner
+        self._created = 0
+        self._next_report = time.monotonic() + self.PROGRESS_INTERVAL
 
     async def create_copy_jobs(self) -> List[Dict[str, Any]]:
         """
-        Create copy jobs in SharePoint for items with the specified level.
+        Create copy jobs in SharePoint for items with the specified level, or for the
+        folders planned by the partitioner.
+
+        With a job ledger, folders whose job was already created by a previous run are
+        not submitted again, and their jobs are returned with the new ones so they can
+        still be monitored.
 
         Returns:
-            List[Dict[str, Any]]: A list of responses from the job creation requests.
+            List[Dict[str, Any]]: The job created for each origin URL.
 
         Raises:
-            ExcelReadError: If there is an error reading the Excel file.
+            InventoryReadError: If there is an error reading the folder inventory.
+            JobLedgerError: If there is an error reading or writing the job ledger.
             SharePointAPIError: If there is an error with the SharePoint API request.
             JobCreationError: If there is an error creating the copy jobs.
+            FolderProvisioningError: If the destination folders cannot be created.
         """
-        logging.info(f"Starting job creation process for items with Level {self.level}")
-        headers = self._get_headers()
         jobs = []
-
-        # Load data from Excel
-        try:
-            df = pd.read_excel(
-                "app/data/sharepoint_folder_structure.xlsx", sheet_name="Folders"
+        if self.partitioner is not None:
+            logging.info("Starting job creation process for the planned folders")
+            df = self.partitioner.plan(self.inventory_store, self.selector.columns)
+            df = self.selector.select_frame(df, by_level=False)
+            df["Destination"] = self._destinations(df["ParentFolder"])
+        else:
+            logging.info(
+                f"Starting job creation process for items with {self.selector.describe()}"
             )
-        except Exception as e:
-            logging.error(f"Failed to read Excel file: {e}")
-            raise ExcelReadError(f"Failed to read Excel file: {e}")
+            # Load the selected folders from the inventory
+            columns = ["ServerRelativeUrl", "ItemCount"]
+            if self.provisioner is not None:
+                columns.append("ParentFolder")
+            df = self.selector.select(self.inventory_store, columns)
+            if self.provisioner is None:
+                df["Destination"] = self.destination_url
+            else:
+                df["Destination"] = self._destinations(
+                    df["ParentFolder"].fillna("").astype(str)
+                )
+            df["ExcludeChildren"] = self.exclude_children
 
-        origin_urls = [
-            urllib.parse.quote(f"{self.base_url}{row['ServerRelativeUrl']}", safe=":/%")
-            for _, row in df.iterrows()
-            if row["Level"] == self.level
-        ]
+        batches: List[CopyJobBatch] = []
+        batch_items: List[int] = []
+        parents: List[str] = []
+        folders = 0
+        for (destination, exclude_children), group in df.groupby(
+            ["Destination", "ExcludeChildren"], sort=False
+        ):
+            destination_uri = urllib.parse.quote(destination, safe=":/%")
+            origin_urls = self._origin_urls(group["ServerRelativeUrl"])
+            item_counts = group["ItemCount"].tolist()
+            if self.job_ledger is not None:
+                origin_urls, item_counts, active_jobs = self._skip_submitted(
+                    destination_uri, origin_urls, item_counts
+                )
+                jobs.extend(active_jobs)
+            folders += len(origin_urls)
+            if origin_urls and destination != self.destination_url:
+                parents.append(destination[len(self.destination_url) + 1 :])
+            for batch, items in self._build_batches(origin_urls, item_counts):
+                batches.append(
+                    CopyJobBatch(destination_uri, bool(exclude_children), batch)
+                )
+                batch_items.append(items)
+
+        # The destination folders of the jobs must exist before they are copied into
+        if self.provisioner is not None and parents:
+            await self.provisioner.provision(parents)
 
-        async with aiohttp.ClientSession(
-            connector=aiohttp.TCPConnector(limit=self.aiohttp_limit)
+        # Submit the largest batches first, so the longest jobs start first.
+        order = sorted(range(len(batches)), key=lambda i: -batch_items[i])
+        batches = [batches[i] for i in order]
+        logging.info(
+            f"Submitting {folders} folders in {len(batches)} CreateCopyJobs calls"
+        )
+
+        async with PooledSession(
+            max(self.aiohttp_limit, self.rate_governor.max_concurrency)
         ) as session:
-            tasks = [
-                self._create_job(session, headers, origin_url)
-                for origin_url in origin_urls
-            ]
+            tasks = [self._submit_batch(session, batch) for batch in batches]
             job_responses = await asyncio.gather(*tasks, return_exceptions=True)
 
+        # The created jobs are already in the ledger, so a rerun only submits the
+        # batches that failed.
+        failures = [r for r in job_responses if isinstance(r, Exception)]
+        if failures:
+            logging.error(
+                f"Job creation failed for {len(failures)} of {len(batches)} batches: {failures[0]}"
+            )
+            raise JobCreationError(f"Job creation failed: {failures[0]}")
+        created = 0
         for response in job_responses:
-            if isinstance(response, Exception):
-                logging.error(f"Job creation failed: {response}")
-                raise JobCreationError(f"Job creation failed: {response}")
-            jobs.append(response)
+            jobs.extend(response)
+            created += len(response)
+
+        logging.info(f"Created {created} copy jobs")
+        return jobs
+
+    def _destinations(self, parent_folders: Iterable[str]) -> List[str]:
+        """
+        Returns the destination URL of each folder copied below the destination path
+        of its parent folder.
+        """
+        return [
+            f"{self.destination_url}/{parent}" if parent else self.destination_url
+            for parent in parent_folders
+        ]
+
+    def _origin_url(self, server_relative_url: str) -> str:
+        return urllib.parse.quote(f"{self.base_url}{server_relative_url}", safe=":/%")
+
+    def _origin_urls(self, server_relative_urls: Iterable[str]) -> List[str]:
+        """
+        Quotes the origin URLs of many folders. The quoted URL of each parent folder
+        is cached, since the folders of a level share few parents, so only the last
+        segment of most URLs is quoted.
+        """
+        parents: Dict[str, str] = {}
+        origin_urls = []
+        for server_relative_url in server_relative_urls:
+            parent, _, name = server_relative_url.rpartition("/")
+            quoted_parent = parents.get(parent)
+            if quoted_parent is None:
+                quoted_parent = parents[parent] = self._origin_url(parent)
+            origin_urls.append(f"{quoted_parent}/{urllib.parse.quote(name, safe=':%')}")
+        return origin_urls
+
+    def _skip_submitted(
+        self, destination_uri: str, origin_urls: List[str], item_counts: List[int]
+    ) -> Tuple[List[str], List[int], List[Dict[str, Any]]]:
+        """
+        Removes the folders whose job the ledger holds as created or completed.
+
+        Args:
+            destination_uri (str): The destination URI of the copy jobs.
+            origin_urls (List[str]): The origin URLs of the copy jobs.
+            item_counts (List[int]): The ItemCount of each origin folder.
+
+        Returns:
+            Tuple[List[str], List[int], List[Dict[str, Any]]]: The origin URLs and
+                ItemCounts still to submit, and the jobs created by previous runs that
+                have not completed yet.
+        """
+        recorded = self.job_ledger.lookup(destination_uri)
+        pending_urls: List[str] = []
+        pending_counts: List[int] = []
+        active_jobs: List[Dict[str, Any]] = []
+        for origin_url, item_count in zip(origin_urls, item_counts):
+            job = recorded.get(origin_url)
+            if job is None or job["State"] not in JobLedger.SUBMITTED_STATES:
+                pending_urls.append(origin_url)
+                pending_counts.append(item_count)
+            elif job["State"] == JobLedger.CREATED:
+                active_jobs.append(job)
+        skipped = len(origin_urls) - len(pending_urls)
+        if skipped:
+            logging.info(
+                f"Job ledger {self.job_ledger.db_path}: skipping {skipped} folders "
+                f"already submitted to {destination_uri}, {len(active_jobs)} of them "
+                f"not completed yet"
+            )
+        return pending_urls, pending_counts, active_jobs
+
+    async def _submit_batch(
+        self, session: aiohttp.ClientSession, batch: CopyJobBatch
+    ) -> List[Dict[str, Any]]:
+        """
+        Creates the copy jobs of a batch and records the outcome in the job ledger.
+
+        Args:
+            session (aiohttp.ClientSession): The aiohttp session to use for the request.
+            batch (CopyJobBatch): The origin URLs and options of the call.
 
-        logging.info(f"Created {len(jobs)} copy jobs for level {self.level}")
+        Returns:
+            List[Dict[str, Any]]: The job of each origin URL.
+
+        Raises:
+            SharePointAPIError: If there is an error with the SharePoint API request.
+            JobLedgerError: If the outcome cannot be recorded.
+        """
+        try:
+            jobs = await self._create_job(session, batch)
+        except SharePointAPIError as e:
+            if self.job_ledger is not None:
+                self.job_ledger.record_failed(
+                    batch.destination_uri, batch.origin_urls, str(e)
+                )
+            raise
+        if self.job_ledger is not None:
+            self.job_ledger.record_created(batch.destination_uri, jobs)
+        self._created += len(jobs)
+        if time.monotonic() >= self._next_report:
+            logging.info(f"Copy job creation progress: {self._created} jobs created")
+            self._next_report = time.monotonic() + self.PROGRESS_INTERVAL
         return jobs
 
+    def _build_batches(
+        self, origin_urls: List[str], item_counts: List[int]
+    ) -> List[Tuple[List[str], int]]:
+        """
+        Packs the origin URLs into batches of at most batch_size URIs whose total
+        ItemCount stays within batch_max_items. A folder larger than batch_max_items
+        gets a batch of its own.
+
+        Args:
+            origin_urls (List[str]): The origin URLs of the copy jobs.
+            item_counts (List[int]): The ItemCount of each origin folder.
+
+        Returns:
+            List[Tuple[List[str], int]]: The batches of origin URLs with their total
+                ItemCount.
+        """
+        batches: List[Tuple[List[str], int]] = []
+        batch: List[str] = []
+        batch_items = 0
+        for origin_url, item_count in zip(origin_urls, item_counts):
+            item_count = int(item_count or 0)
+            if batch and (
+                len(batch) >= self.batch_size
+                or (
+                    self.batch_max_items
+                    and batch_items + item_count > self.batch_max_items
+                )
+            ):
+                batches.append((batch, batch_items))
+                batch, batch_items = [], 0
+            batch.append(origin_url)
+            batch_items += item_count
+        if batch:
+            batches.append((batch, batch_items))
+        return batches
+
     async def _create_job(
-        self, session: aiohttp.ClientSession, headers: Dict[str, str], origin_url: str
-    ) -> Dict[str, Any]:
+        self,
+        session: aiohttp.ClientSession,
+        batch: CopyJobBatch,
+    ) -> List[Dict[str, Any]]:
         """
-        Create a single copy job in SharePoint.
+        Create copy jobs in SharePoint for a batch of origin URLs with a single request.
 
         Args:
             session (aiohttp.ClientSession): The aiohttp session to use for the request.
-            headers (Dict[str, str]): The headers for the request.
-            origin_url (str): The origin URL for the copy job.
+            batch (CopyJobBatch): The origin URLs and options of the call.
 
         Returns:
-            Dict[str, Any]: The response from the job creation request.
+            List[Dict[str, Any]]: The job of each origin URL, with its SourceUri, JobId,
+                JobQueueUri and EncryptionKey.
 
         Raises:
             SharePointAPIError: If there is an error with the SharePoint API request.
         """
-        payload = self._get_payload(origin_url, self.destination_url)
+        origin_urls = batch.origin_urls
+        payload = self._get_payload(
+            origin_urls, batch.destination_uri, batch.exclude_children
+        )
         try:
-            async with session.post(
-                f"https://{self.tenant_name}.sharepoint.com/_api/site/CreateCopyJobs",
-                headers=headers,
+            response = await self.rate_governor.request(
+                session,
+                "POST",
+                f"{self.tenant_url}/_api/site/CreateCopyJobs",
+                headers=await self._get_headers(),
                 json=payload,
-            ) as response:
-                response_text = await response.text()
-                if response.status == 200:
-                    logging.info(f"Job creation successful for {origin_url}")
-                    return await response.json()
-                else:
-                    logging.error(
-                        f"Failed to create copy job for {origin_url}: {response.status} - {response_text}"
-                    )
-                    raise SharePointAPIError(
-                        f"Failed to create copy job for {origin_url}: {response.status} - {response_text}"
-                    )
-        except aiohttp.ClientError as e:
+            )
+            if response.status == 200:
+                request_log.debug(
+                    "Job creation successful for %d folders", len(origin_urls)
+                )
+                return self._map_jobs(origin_urls, response.json())
+            else:
+                logging.error(
+                    f"Failed to create copy jobs for {origin_urls}: {response.status} - {response.text()}"
+                )
+                raise SharePointAPIError(
+                    f"Failed to create copy jobs for {origin_urls}: {response.status} - {response.text()}"
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logging.error(f"HTTP request failed: {e}")
             raise SharePointAPIError(f"HTTP request failed: {e}")
+        except SharePointAPIError:
+            raise
         except Exception as e:
             logging.error(f"Unexpected error: {e}")
             raise SharePointAPIError(f"Unexpected error: {e}")
 
-    def _get_headers(self) -> Dict[str, str]:
+    @staticmethod
+    def _map_jobs(
+        origin_urls: List[str], response_json: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
         """
-        Get headers for the request.
+        Maps each origin URL of a batch to the job SharePoint created for it. The
+        CreateCopyJobs results are returned in the order of exportObjectUris.
+
+        Args:
+            origin_urls (List[str]): The origin URLs sent in the request.
+            response_json (Dict[str, Any]): The CreateCopyJobs response.
+
+        Returns:
+            List[Dict[str, Any]]: The job of each origin URL.
+
+        Raises:
+            SharePointAPIError: If the results cannot be matched to the origin URLs.
+        """
+        results = response_json.get("d", {}).get("CreateCopyJobs", {}).get("results")
+        if results is None:
+            results = response_json.get("value", [])
+        if len(results) == 1:
+            results = results * len(origin_urls)
+        if len(results) != len(origin_urls):
+            raise SharePointAPIError(
+                f"CreateCopyJobs returned {len(results)} jobs for {len(origin_urls)} folders"
+            )
+        return [
+            {
+                "SourceUri": origin_url,
+                "JobId": result.get("JobId"),
+                "JobQueueUri": result.get("JobQueueUri"),
+                "EncryptionKey": result.get("EncryptionKey"),
+            }
+            for origin_url, result in zip(origin_urls, results)
+        ]
+
+    async def _get_headers(self) -> Dict[str, str]:
+        """
+        Get headers for the request, with the current access token.
 
         Returns:
             Dict[str, str]: The headers for the request.
         """
         return {
-            "Authorization": f"Bearer {self.access_token}",
-            "Accept": "application/json;odata=verbose",
+            **await self.token_provider.get_headers(),
+            "Accept": odata.accept_header(self.odata_metadata),
             "Content-Type": "application/json",
         }
 
-    def _get_payload(self, origin_url: str, destination_url: str) -> Dict[str, Any]:
+    def _get_payload(
+        self, origin_urls: List[str], destination_url: str, exclude_children: bool
+    ) -> Dict[str, Any]:
         """
         Get payload for the request.
 
         Args:
-            origin_url (str): The origin URL for the copy job.
+            origin_urls (List[str]): The origin URLs for the copy jobs.
             destination_url (str): The destination URL for the copy job.
+            exclude_children (bool): Whether to copy the folders without their subfolders.
 
         Returns:
             Dict[str, Any]: The payload for the request.
         """
         return {
-            "exportObjectUris": [origin_url],
+            "exportObjectUris": origin_urls,
             "destinationUri": urllib.parse.quote(destination_url, safe=":/%"),
             "options": {
                 "IsMoveMode": self.is_move_mode,
@@ -183,6 +494,207 @@ class CopyJobsCreator:
                 "IncludeItemPermissions": self.include_item_permissions,
                 "BypassSharedLock": self.bypass_shared_lock,
                 "MoveButKeepSource": self.move_but_keep_source,
-                "ExcludeChildren": self.exclude_children,
+                "ExcludeChildren": exclude_children,
             },
         }
+
+
+class JobPipeline:
+    """
+    Submits copy jobs for the folders the creator selects while the crawl that
+    discovers them is still running, so copying starts long before the inventory is
+    complete.
+
+    The crawl offers every folder record; the selected ones wait in a
+    bounded queue. The crawl awaits wait_for_room before each request, so when job
+    creation falls behind, the crawl pauses instead of the queue growing; a single
+    listing may still add a page of folders over max_pending. Queued folders are
+    submitted in batches of the creator's batch_size and batch_max_items, with at
+    most max_in_flight CreateCopyJobs calls at a time: while all calls are busy, the
+    queue fills and the next batches are full ones.
+
+    Only level partitioning into the destination folder itself can be pipelined,
+    since the partitioner needs the size of complete subtrees and the folders that
+    keep their hierarchy need their destination folders provisioned first.
+
+    Attributes:
+        creator (CopyJobsCreator): The creator whose selector, options, ledger and rate
+            governor are used.
+        max_pending (int): The number of queued folders above which the crawl waits.
+        max_in_flight (int): The maximum number of concurrent CreateCopyJobs calls.
+    """
+
+    def __init__(
+        self,
+        creator: CopyJobsCreator,
+        max_pending: int = 1000,
+        max_in_flight: Optional[int] = None,
+    ) -> None:
+        """
+        Initializes the JobPipeline instance and loads the ledger of submitted jobs.
+
+        Raises:
+            JobCreationError: If the creator uses a partitioner or a provisioner.
+            JobLedgerError: If the job ledger cannot be read.
+        """
+        if creator.partitioner is not None:
+            raise JobCreationError("Planned copy jobs cannot be created by a pipeline")
+        if creator.provisioner is not None:
+            raise JobCreationError(
+                "Copy jobs keeping the folder hierarchy cannot be created by a pipeline"
+            )
+        self.creator = creator
+        self.max_pending = max(1, max_pending)
+        self.max_in_flight = max(
+            1, max_in_flight or creator.rate_governor.max_concurrency
+        )
+        self._destination_uri = urllib.parse.quote(creator.destination_url, safe=":/%")
+        self._recorded: Dict[str, Dict[str, Any]] = {}
+        if creator.job_ledger is not None:
+            self._recorded = creator.job_ledger.lookup(self._destination_uri)
+        self._pending: Deque[Tuple[str, int]] = collections.deque()
+        self._jobs: List[Dict[str, Any]] = []
+        self._failures: List[Exception] = []
+        self._closed = False
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+
+    def offer(self, record: Dict[str, Any]) -> None:
+        """
+        Queues a folder record discovered by the crawl if the creator's selector
+        matches it and it has no job in the ledger.
+
+        Args:
+            record (Dict[str, Any]): The folder record.
+        """
+        if not self.creator.selector.matches(record):
+            return
+        origin_url = self.creator._origin_url(record["ServerRelativeUrl"])
+        job = self._recorded.get(origin_url)
+        if job is not None and job["State"] in JobLedger.SUBMITTED_STATES:
+            if job["State"] == JobLedger.CREATED:
+                self._jobs.append(job)
+            return
+        self._pending.append((origin_url, int(record["ItemCount"] or 0)))
+        self._wakeup.set()
+
+    async def wait_for_room(self) -> None:
+        """
+        Waits while the queue of folders to submit is full.
+        """
+        while len(self._pending) >= self.max_pending and not self._closed:
+            self._room.clear()
+            await self._room.wait()
+
+    async def run(self, crawl: Awaitable[Any]) -> List[Dict[str, Any]]:
+        """
+        Runs the crawl and submits the offered folders while it runs. Once the crawl
+        finishes, the remaining folders are submitted; if it fails, the queued folders
+        are dropped and only the calls in flight complete.
+
+        Args:
+            crawl (Awaitable[Any]): The crawl offering folder records.
+
+        Returns:
+            List[Dict[str, Any]]: The job created for each origin URL, with the jobs
+                of the ledger that have not completed yet.
+
+        Raises:
+            JobLedgerError: If there is an error writing the job ledger.
+            JobCreationError: If there is an error creating the copy jobs.
+        """
+        consumer = asyncio.create_task(self._consume())
+        try:
+            await crawl
+        except BaseException:
+            self._close(drain=False)
+            await asyncio.gather(consumer, return_exceptions=True)
+            raise
+        self._close(drain=True)
+        return await consumer
+
+    def _close(self, drain: bool) -> None:
+        if not drain:
+            self._pending.clear()
+        self._closed = True
+        self._wakeup.set()
+        self._room.set()
+
+    async def _consume(self) -> List[Dict[str, Any]]:
+        """
+        Submits the queued folders in batches until the pipeline is closed and empty.
+        """
+        creator = self.creator
+        submitted = 0
+        in_flight = set()
+        async with PooledSession(
+            max(creator.aiohttp_limit, creator.rate_governor.max_concurrency)
+        ) as session:
+            while True:
+                if not self._pending:
+                    if self._closed:
+                        break
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                await self._slots.acquire()
+                if not self._pending:
+                    self._slots.release()
+                    continue
+                batch = self._take_batch()
+                submitted += len(batch)
+                task = asyncio.create_task(
+                    self._submit(
+                        session,
+                        CopyJobBatch(
+                            self._destination_uri, creator.exclude_children, batch
+                        ),
+                    )
+                )
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            await asyncio.gather(*in_flight)
+
+        if self._failures:
+            logging.error(
+                f"Pipelined job creation failed for {len(self._failures)} batches: {self._failures[0]}"
+            )
+            raise JobCreationError(f"Job creation failed: {self._failures[0]}")
+        logging.info(
+            f"Pipelined job creation submitted {submitted} folders with {creator.selector.describe()}"
+        )
+        return self._jobs
+
+    def _take_batch(self) -> List[str]:
+        """
+        Takes the next batch of origin URLs from the queue, within batch_size and
+        batch_max_items.
+        """
+        creator = self.creator
+        batch: List[str] = []
+        batch_items = 0
+        while self._pending and len(batch) < creator.batch_size:
+            origin_url, item_count = self._pending[0]
+            if (
+                batch
+                and creator.batch_max_items
+                and batch_items + item_count > creator.batch_max_items
+            ):
+                break
+            self._pending.popleft()
+            batch.append(origin_url)
+            batch_items += item_count
+        if len(self._pending) < self.max_pending:
+            self._room.set()
+        return batch
+
+    async def _submit(
+        self, session: aiohttp.ClientSession, batch: CopyJobBatch
+    ) -> None:
+        try:
+            self._jobs.extend(await self.creator._submit_batch(session, batch))
+        except Exception as e:
+            self._failures.append(e)
+        finally:
+            self._slots.release()
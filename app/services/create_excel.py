@@ -6,6 +6,11 @@ from typing import Any, Dict, List
 import pandas as pd
 
 from app.exceptions import ExcelWriteError
+from app.services.folder_inventory import FolderInventory
+from app.services.inventory_store import InventoryStore
+
+# An Excel sheet holds 1,048,576 rows, one of which is the header.
+EXCEL_MAX_ROWS = 1048575
 
 
 class ExcelExporter:
@@ -16,6 +21,8 @@ class ExcelExporter:
     -------
     save_structure_to_excel(structure: Dict[str, Any], file_path: str) -> None:
         Saves the SharePoint folder structure to an Excel file.
+    export_store_to_excel(store: InventoryStore, file_path: str) -> None:
+        Exports a folder inventory store to an Excel file.
     """
 
     @staticmethod
@@ -23,7 +30,8 @@ class ExcelExporter:
         structure: Dict[str, Any], file_path: str
     ) -> None:
         """
-        Saves the SharePoint folder structure to an Excel file.
+        Saves the SharePoint folder structure to an Excel file. A FolderInventory is
+        turned into a DataFrame column by column, without a dict per folder.
 
         Args:
             structure (Dict[str, Any]): The folder structure.
@@ -35,9 +43,11 @@ class ExcelExporter:
         logging.info(f"Starting to save SharePoint structure to {file_path}")
         try:
             folders = structure.get("d", {}).get("Folders", {}).get("results", [])
-            all_folders_data = ExcelExporter._extract_folders_for_excel(folders)
-
-            all_folders_df = pd.DataFrame(all_folders_data)
+            if isinstance(folders, FolderInventory):
+                all_folders_df = folders.to_frame()
+            else:
+                all_folders_data = ExcelExporter._extract_folders_for_excel(folders)
+                all_folders_df = pd.DataFrame(all_folders_data)
 
             loop = asyncio.get_event_loop()
             with ThreadPoolExecutor() as pool:
@@ -52,6 +62,38 @@ class ExcelExporter:
                 f"Failed to save SharePoint structure to {file_path}: {e}"
             )
 
+    @staticmethod
+    async def export_store_to_excel(store: InventoryStore, file_path: str) -> None:
+        """
+        Exports a folder inventory store to an Excel file.
+
+        Args:
+            store (InventoryStore): The inventory store to export.
+            file_path (str): The path to the Excel file.
+
+        Raises:
+            ExcelWriteError: If the inventory does not fit in a sheet or there is an
+                error writing the Excel file.
+        """
+        logging.info(f"Starting to export inventory {store.path} to {file_path}")
+        try:
+            df = store.read()
+            if len(df) > EXCEL_MAX_ROWS:
+                raise ExcelWriteError(
+                    f"Inventory has {len(df)} folders, more than the {EXCEL_MAX_ROWS} rows an Excel sheet can hold"
+                )
+
+            loop = asyncio.get_event_loop()
+            with ThreadPoolExecutor() as pool:
+                await loop.run_in_executor(
+                    pool, ExcelExporter._write_to_excel, df, file_path
+                )
+
+            logging.info(f"Successfully exported inventory to {file_path}")
+        except Exception as e:
+            logging.error(f"Failed to export inventory to {file_path}: {e}")
+            raise ExcelWriteError(f"Failed to export inventory to {file_path}: {e}")
+
     @staticmethod
     def _write_to_excel(df: pd.DataFrame, file_path: str) -> None:
         """
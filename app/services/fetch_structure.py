@@ -1,13 +1,26 @@
 import asyncio
 import logging
-from typing import Any, Dict, List
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 import aiohttp
 
+from app.auth.token_provider import TokenProvider
 from app.exceptions import (
     SharePointStructureFetchError,
     SharePointSubfolderFetchError,
 )
+from app.services.crawl_checkpoint import CrawlCheckpoint
+from app.services.crawl_quarantine import CrawlQuarantine
+from app.services.folder_crawler import CrawlItem, FolderCrawler
+from app.services.folder_filter import FolderFilter
+from app.services.folder_inventory import FolderInventory
+from app.services.inventory_delta import PreviousInventory
+from app.services.inventory_sink import InventorySink
+from app.services.list_enumerator import ListFolderEnumerator
+from app.utils import odata
+from app.utils.http_session import PooledSession
+from app.utils.log_handlers import request_log
+from app.utils.rate_governor import Governor, RateGovernor
 
 
 class SharePointStructureFetcher:
@@ -15,30 +28,110 @@ class SharePointStructureFetcher:
     A class to fetch the folder structure from a SharePoint site using REST API.
 
     Attributes:
-        access_token (str): The access token for SharePoint API.
+        token_provider (TokenProvider): The provider of the current access token.
         origin_url (str): The origin URL of the SharePoint site.
         partial_origin_url (str): The partial URL of the SharePoint site.
         aiohttp_limit (int): The connection limit for aiohttp.
+        keepalive_timeout (float): Seconds an idle pooled connection is kept open.
+        dns_cache_ttl (int): Seconds a resolved host is kept in the DNS cache.
+        crawl_workers (int): The number of crawl worker tasks.
+        crawl_queue_size (int): The maximum number of pending folders kept in memory.
+        progress_interval (float): Seconds between crawl progress reports.
+        rate_governor (Governor): The shared governor of SharePoint requests.
+        enumeration (str): "folders" to list the subfolders of each folder, or "list"
+            to page through the folders of the document library with list item queries.
+        list_page_size (int): The number of list items per page in "list" enumeration.
+        list_server_side_filter (bool): Whether "list" enumeration filters folders on
+            the server.
+        previous_inventory (Optional[PreviousInventory]): The inventory of a previous
+            crawl; when given, unchanged folders without subfolders are not listed again.
+        checkpoint (Optional[CrawlCheckpoint]): The checkpoint file a streamed crawl
+            saves its state to, so it can be resumed.
+        odata_metadata (str): The OData metadata level of the responses; nometadata
+            responses are several times smaller than verbose ones. Folder requests only
+            $select the fields the records are built from.
+        folder_filter (Optional[FolderFilter]): Include and exclude rules applied during
+            the crawl; excluded subtrees are not requested, and neither are the folders
+            below which nothing can be included.
+        folder_retries (int): The number of times a folder whose listing failed is
+            retried before it is quarantined.
+        folder_retry_delay (float): The base delay in seconds before retrying a folder.
+        quarantine (Optional[CrawlQuarantine]): Receives the folders that still fail
+            after their retries, so the crawl goes on without them. Without it, the
+            first such folder fails the crawl.
+        max_quarantined (int): The number of quarantined folders above which the
+            crawl fails anyway.
     """
 
+    ENUMERATIONS = ("folders", "list")
+
     def __init__(
         self,
-        access_token: str,
+        token_provider: TokenProvider,
         origin_url: str,
         partial_origin_url: str,
         aiohttp_limit: int,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        crawl_workers: Optional[int] = None,
+        crawl_queue_size: int = 10000,
+        progress_interval: float = 30.0,
+        rate_governor: Optional[Governor] = None,
+        enumeration: str = "folders",
+        list_page_size: int = 5000,
+        list_server_side_filter: bool = True,
+        previous_inventory: Optional[PreviousInventory] = None,
+        checkpoint: Optional[CrawlCheckpoint] = None,
+        odata_metadata: str = "nometadata",
+        folder_filter: Optional[FolderFilter] = None,
+        folder_retries: int = 2,
+        folder_retry_delay: float = 5.0,
+        quarantine: Optional[CrawlQuarantine] = None,
+        max_quarantined: int = 100,
     ) -> None:
         """
-        Initializes the SharePointStructureFetcher instance with access token and origin URL.
+        Initializes the SharePointStructureFetcher instance with token provider and origin URL.
+
+        Raises:
+            SharePointStructureFetchError: If the enumeration or the OData metadata
+                level is not supported.
         """
-        self.access_token = access_token
+        if enumeration not in self.ENUMERATIONS:
+            raise SharePointStructureFetchError(
+                f"Unsupported enumeration: {enumeration}"
+            )
+        if odata_metadata not in odata.METADATA_LEVELS:
+            raise SharePointStructureFetchError(
+                f"Unsupported OData metadata level: {odata_metadata}"
+            )
+        self.token_provider = token_provider
         self.origin_url = origin_url
         self.partial_origin_url = partial_origin_url
         self.aiohttp_limit = aiohttp_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.rate_governor = rate_governor or RateGovernor(aiohttp_limit)
+        self.crawl_workers = crawl_workers or self.rate_governor.max_concurrency
+        self.crawl_queue_size = crawl_queue_size
+        self.progress_interval = progress_interval
+        self.enumeration = enumeration
+        self.list_page_size = list_page_size
+        self.list_server_side_filter = list_server_side_filter
+        self.previous_inventory = previous_inventory
+        self.checkpoint = checkpoint
+        self.odata_metadata = odata_metadata
+        self.folder_filter = folder_filter or None
+        self.folder_retries = folder_retries
+        self.folder_retry_delay = folder_retry_delay
+        self.quarantine = quarantine
+        self.max_quarantined = max_quarantined
 
     async def fetch_structure(self) -> Dict[str, Any]:
         """
-        Fetches the folder structure from the SharePoint site.
+        Fetches the folder structure from the SharePoint site. A single pooled session
+        is shared by the root request and every subfolder request, and the tree is
+        crawled breadth first by a fixed pool of workers. The folders are kept in a
+        compact FolderInventory, which reads as a sequence of folder records.
 
         Returns:
             Dict[str, Any]: The folder structure.
@@ -46,133 +139,313 @@ class SharePointStructureFetcher:
         Raises:
             SharePointStructureFetchError: If there is an error fetching the folder structure.
         """
-        url = f"{self.origin_url}/_api/web/GetFolderByServerRelativeUrl('{self.partial_origin_url}')?$expand=Folders"
+        inventory = FolderInventory()
+        structure = await self._crawl(inventory.append)
+        # The structure keeps the verbose layout whatever the metadata level.
+        root = structure.get("d", structure)
+        return {"d": {**root, "Folders": {"results": inventory}}}
+
+    async def stream_structure(
+        self,
+        sink: InventorySink,
+        resume_state: Optional[Dict[str, Any]] = None,
+        on_folder: Optional[Callable[[Dict[str, Any]], None]] = None,
+        wait_for_room: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> int:
+        """
+        Fetches the folder structure and writes each folder record to the sink as soon
+        as it is parsed, without keeping the tree in memory. With a checkpoint, the
+        crawl state is saved periodically and when the crawl fails.
+
+        Args:
+            sink (InventorySink): The sink receiving the folder records.
+            resume_state (Optional[Dict[str, Any]]): The checkpointed state of an
+                interrupted crawl to continue; the sink must already hold its records.
+            on_folder (Optional[Callable[[Dict[str, Any]], None]]): Also called with
+                each folder record, e.g. to submit copy jobs while the crawl runs.
+            wait_for_room (Optional[Callable[[], Awaitable[None]]]): Awaited before each
+                request, so a slower consumer of the records holds the crawl back.
+
+        Returns:
+            int: The number of folder records written.
+
+        Raises:
+            SharePointStructureFetchError: If there is an error fetching the folder structure.
+        """
+        save_state: Optional[Callable[[Dict[str, Any]], None]]
+        if self.checkpoint is not None:
+            checkpoint = self.checkpoint
+
+            def save_checkpoint(state: Dict[str, Any]) -> None:
+                # Flush first so the inventory holds every record the state accounts for.
+                sink.flush()
+                checkpoint.save({**state, "records": sink.count})
+
+            save_state = save_checkpoint
+        else:
+            save_state = None
+
+        write: Callable[[Dict[str, Any]], None]
+        if on_folder is not None:
+
+            def write_and_offer(record: Dict[str, Any]) -> None:
+                sink.write(record)
+                on_folder(record)
+
+            write = write_and_offer
+        else:
+            write = sink.write
+
+        try:
+            await self._crawl(write, save_state, resume_state, wait_for_room)
+        finally:
+            sink.flush()
+        logging.info(f"Streamed {sink.count} folder records")
+        return sink.count
+
+    async def _crawl(
+        self,
+        on_folder: Callable[[Dict[str, Any]], None],
+        save_state: Optional[Callable[[Dict[str, Any]], None]] = None,
+        resume_state: Optional[Dict[str, Any]] = None,
+        wait_for_room: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Fetches the root folder and crawls the tree below it, folder by folder or with
+        paged list item queries depending on the enumeration.
+
+        Args:
+            on_folder (Callable[[Dict[str, Any]], None]): Called with each folder record.
+            save_state (Optional[Callable[[Dict[str, Any]], None]]): Saves the crawl state.
+            resume_state (Optional[Dict[str, Any]]): The state of an interrupted crawl.
+            wait_for_room (Optional[Callable[[], Awaitable[None]]]): Awaited before each
+                request of the crawl.
+
+        Returns:
+            Dict[str, Any]: The raw response of the root folder request.
+
+        Raises:
+            SharePointStructureFetchError: If there is an error fetching the root folder
+                or the resumed crawl used another enumeration.
+        """
+        if resume_state is not None and resume_state.get("enumeration") != (
+            self.enumeration
+        ):
+            raise SharePointStructureFetchError(
+                f"Cannot resume a {resume_state.get('enumeration')} crawl with {self.enumeration} enumeration"
+            )
+        checkpoint_interval = self.checkpoint.interval if self.checkpoint else 60.0
+        fields = FolderCrawler.FOLDER_FIELDS
+        url = (
+            f"{self.origin_url}/_api/web/GetFolderByServerRelativeUrl('{self.partial_origin_url}')"
+            f"?$select={odata.select(fields)},{odata.select(fields, 'Folders')}&$expand=Folders"
+        )
         logging.info(f"Fetching structure from {url}")
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Accept": "application/json;odata=verbose",
-        }
 
-        async with aiohttp.ClientSession(
-            connector=aiohttp.TCPConnector(limit=self.aiohttp_limit)
+        async with PooledSession(
+            max(self.aiohttp_limit, self.rate_governor.max_concurrency),
+            self.keepalive_timeout,
+            self.dns_cache_ttl,
         ) as session:
             try:
-                async with session.get(url, headers=headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logging.error(
-                            f"Failed to fetch structure: {response.status} - {error_text}"
-                        )
-                        raise SharePointStructureFetchError(
-                            f"Failed to fetch structure: {response.status} - {error_text}"
-                        )
-                    structure = await response.json()
-            except aiohttp.ClientError as e:
+                response = await self.rate_governor.request(
+                    session, "GET", url, headers=await self._get_headers()
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 logging.error(f"HTTP request failed: {e}")
                 raise SharePointStructureFetchError(f"HTTP request failed: {e}")
+            if response.status != 200:
+                error_text = response.text()
+                logging.error(
+                    f"Failed to fetch structure: {response.status} - {error_text}"
+                )
+                raise SharePointStructureFetchError(
+                    f"Failed to fetch structure: {response.status} - {error_text}"
+                )
+            structure = response.json()
 
-        folders = structure.get("d", {}).get("Folders", {}).get("results", [])
-        structure["d"]["Folders"]["results"] = await self._extract_folders_from_api(
-            folders
-        )
+            async def fetch_list_page(
+                page_url: str,
+            ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+                if wait_for_room is not None:
+                    await wait_for_room()
+                return await self._fetch_list_page(session, page_url)
+
+            async def fetch_subfolders(folder_url: str) -> List[Dict[str, Any]]:
+                if wait_for_room is not None:
+                    await wait_for_room()
+                return await self._fetch_subfolders(session, folder_url)
+
+            if self.enumeration == "list":
+                enumerator = ListFolderEnumerator(
+                    fetch_list_page,
+                    self.partial_origin_url,
+                    self.list_page_size,
+                    self.list_server_side_filter,
+                    self.progress_interval,
+                    save_state,
+                    checkpoint_interval,
+                    self.folder_filter,
+                )
+                if self.previous_inventory is not None:
+                    logging.info(
+                        "List enumeration pages through every folder; the previous inventory is only used for the changeset"
+                    )
+                items_url = await self._get_list_items_url(session)
+                await enumerator.enumerate(items_url, on_folder, resume_state)
+            else:
+                folders = odata.results(structure, "Folders")
+                skip_folder: Optional[Callable[[Dict[str, Any]], bool]] = None
+                if self.previous_inventory is not None:
+                    skip_folder = self.previous_inventory.skip_if_unchanged
+                crawler = FolderCrawler(
+                    fetch_subfolders,
+                    self.crawl_workers,
+                    self.crawl_queue_size,
+                    self.progress_interval,
+                    skip_folder,
+                    save_state,
+                    checkpoint_interval,
+                    self.folder_filter,
+                    self.folder_retries,
+                    self.folder_retry_delay,
+                    self._quarantine_folder if self.quarantine else None,
+                    self.max_quarantined,
+                )
+                await crawler.crawl(folders, on_folder, resume_state)
+                if self.previous_inventory is not None:
+                    logging.info(
+                        f"Incremental crawl skipped {self.previous_inventory.skipped} "
+                        "unchanged folders without subfolders"
+                    )
 
         return structure
 
-    async def _extract_folders_from_api(
-        self, folders: List[Dict[str, Any]], parent_path: str = "", level: int = 0
+    def _quarantine_folder(
+        self, item: CrawlItem, error: Exception, attempts: int
+    ) -> None:
+        """
+        Records a folder the crawl could not list in the quarantine and the metrics.
+        """
+        self.quarantine.add(item, error, attempts)
+        self.rate_governor.metrics.quarantined_folders += 1
+
+    async def _fetch_subfolders(
+        self, session: aiohttp.ClientSession, folder_url: str
     ) -> List[Dict[str, Any]]:
         """
-        Recursively extracts folder information from the API response.
+        Fetches the subfolders from a given folder URL.
 
         Args:
-            folders (List[Dict[str, Any]]): The list of folders to extract.
-            parent_path (str): The parent path for the current folders.
-            level (int): The level of the current folders.
+            session (aiohttp.ClientSession): The shared aiohttp session.
+            folder_url (str): The URL of the folder to fetch subfolders from.
 
         Returns:
-            List[Dict[str, Any]]: The extracted folder information.
-        """
-        data = []
-        tasks = []
-        for folder in folders:
-            folder_path = f"{parent_path}/{folder['Name']}".strip("/")
-            folder_info = {
-                "Name": folder["Name"],
-                "Path": folder_path,
-                "ParentFolder": parent_path,
-                "Level": level,
-                "TimeCreated": folder["TimeCreated"],
-                "TimeLastModified": folder["TimeLastModified"],
-                "ItemCount": folder["ItemCount"],
-                "ServerRelativeUrl": folder["ServerRelativeUrl"],
-                "UniqueId": folder["UniqueId"],
-            }
-            data.append(folder_info)
-            tasks.append(
-                self._fetch_and_extract_subfolders(
-                    folder["ServerRelativeUrl"], folder_path, level + 1
-                )
-            )
+            List[Dict[str, Any]]: The list of subfolders.
 
-        subfolders_data = await asyncio.gather(*tasks)
-        for subfolder in subfolders_data:
-            data.extend(subfolder)
+        Raises:
+            SharePointSubfolderFetchError: If there is an error fetching the subfolders.
+        """
+        url = (
+            f"{self.origin_url}/_api/web/GetFolderByServerRelativeUrl('{folder_url}')/Folders"
+            f"?$select={odata.select(FolderCrawler.FOLDER_FIELDS)}"
+        )
+        request_log.debug("Fetching subfolders from %s", url)
 
-        return data
+        try:
+            response = await self.rate_governor.request(
+                session, "GET", url, headers=await self._get_headers()
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            request_log.error("HTTP request failed: %s", e)
+            raise SharePointSubfolderFetchError(f"HTTP request failed: {e}")
+        if response.status != 200:
+            error_text = response.text()
+            request_log.error(
+                "Failed to fetch subfolders: %d - %s", response.status, error_text
+            )
+            raise SharePointSubfolderFetchError(
+                f"Failed to fetch subfolders: {response.status} - {error_text}"
+            )
+        return odata.results(response.json())
 
-    async def _fetch_and_extract_subfolders(
-        self, folder_url: str, parent_path: str, level: int
-    ) -> List[Dict[str, Any]]:
+    async def _get_list_items_url(self, session: aiohttp.ClientSession) -> str:
         """
-        Fetches and extracts subfolders from a given folder URL.
+        Finds the document library of the root folder from its vti_listname property.
 
         Args:
-            folder_url (str): The URL of the folder to fetch subfolders from.
-            parent_path (str): The parent path for the current folders.
-            level (int): The level of the current folders.
+            session (aiohttp.ClientSession): The shared aiohttp session.
 
         Returns:
-            List[Dict[str, Any]]: The extracted subfolder information.
+            str: The URL of the items endpoint of the library.
+
+        Raises:
+            SharePointStructureFetchError: If the library cannot be found.
         """
-        subfolders = await self._fetch_subfolders(folder_url)
-        return await self._extract_folders_from_api(subfolders, parent_path, level)
+        url = f"{self.origin_url}/_api/web/GetFolderByServerRelativeUrl('{self.partial_origin_url}')/Properties?$select=vti_x005f_listname"
+        response_json = await self._get_json(session, url)
+        properties = response_json.get("d", response_json)
+        list_id = (properties.get("vti_x005f_listname") or "").strip("{}")
+        if not list_id:
+            logging.error(f"{self.partial_origin_url} is not in a document library")
+            raise SharePointStructureFetchError(
+                f"{self.partial_origin_url} is not in a document library"
+            )
+        return f"{self.origin_url}/_api/web/lists(guid'{list_id}')/items"
 
-    async def _fetch_subfolders(self, folder_url: str) -> List[Dict[str, Any]]:
+    async def _fetch_list_page(
+        self, session: aiohttp.ClientSession, page_url: str
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
         """
-        Fetches the subfolders from a given folder URL.
+        Fetches a page of list items.
 
         Args:
-            folder_url (str): The URL of the folder to fetch subfolders from.
+            session (aiohttp.ClientSession): The shared aiohttp session.
+            page_url (str): The URL of the page.
 
         Returns:
-            List[Dict[str, Any]]: The list of subfolders.
+            Tuple[List[Dict[str, Any]], Optional[str]]: The items of the page and the
+                URL of the next page, or None for the last page.
 
         Raises:
-            SharePointSubfolderFetchError: If there is an error fetching the subfolders.
+            SharePointStructureFetchError: If there is an error fetching the page.
         """
-        url = f"{self.origin_url}/_api/web/GetFolderByServerRelativeUrl('{folder_url}')/Folders"
-        logging.info(f"Fetching subfolders from {url}")
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Accept": "application/json;odata=verbose",
-        }
+        request_log.debug("Fetching list items from %s", page_url)
+        response_json = await self._get_json(session, page_url)
+        if "d" in response_json:
+            return odata.results(response_json), response_json["d"].get("__next")
+        return odata.results(response_json), response_json.get("odata.nextLink")
 
-        async with aiohttp.ClientSession(
-            connector=aiohttp.TCPConnector(limit=self.aiohttp_limit)
-        ) as session:
-            try:
-                async with session.get(url, headers=headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logging.error(
-                            f"Failed to fetch subfolders: {response.status} - {error_text}"
-                        )
-                        raise SharePointSubfolderFetchError(
-                            f"Failed to fetch subfolders: {response.status} - {error_text}"
-                        )
-                    subfolders = await response.json()
-            except aiohttp.ClientError as e:
-                logging.error(f"HTTP request failed: {e}")
-                raise SharePointSubfolderFetchError(f"HTTP request failed: {e}")
+    async def _get_json(self, session: aiohttp.ClientSession, url: str) -> Any:
+        """
+        Sends a GET request and decodes the JSON response.
 
-        return subfolders.get("d", {}).get("results", [])
+        Raises:
+            SharePointStructureFetchError: If the request fails.
+        """
+        try:
+            response = await self.rate_governor.request(
+                session, "GET", url, headers=await self._get_headers()
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"HTTP request failed: {e}")
+            raise SharePointStructureFetchError(f"HTTP request failed: {e}")
+        if response.status != 200:
+            error_text = response.text()
+            logging.error(f"Failed to fetch {url}: {response.status} - {error_text}")
+            raise SharePointStructureFetchError(
+                f"Failed to fetch {url}: {response.status} - {error_text}"
+            )
+        return response.json()
+
+    async def _get_headers(self) -> Dict[str, str]:
+        """
+        Get headers for the request, with the current access token.
+
+        Returns:
+            Dict[str, str]: The headers for the request.
+        """
+        return {
+            **await self.token_provider.get_headers(),
+            "Accept": odata.accept_header(self.odata_metadata),
+        }
@@ -0,0 +1,458 @@
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import IO, Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from app.services.folder_filter import FolderFilter
+from app.utils.log_handlers import request_log
+
+
+class CrawlItem(NamedTuple):
+    """A discovered folder whose subfolders still have to be listed."""
+
+    server_relative_url: str
+    path: str
+    level: int
+
+
+class FolderCrawler:
+    """
+    A breadth-first crawl engine that lists SharePoint folders with a fixed pool of
+    worker tasks reading from a bounded asyncio.Queue of folder URLs.
+
+    The number of in-flight requests never exceeds the worker count, and the queue
+    never holds more than max_queue_size items in memory; the rest of the frontier
+    is spilled to a temporary file and read back in FIFO order.
+
+    Failures are isolated per folder. A folder whose listing fails is retried
+    folder_retries times with exponential backoff, while the workers go on with the
+    rest of the frontier. A folder that keeps failing is handed to quarantine and the
+    crawl continues without its subtree; the crawl only fails when more than
+    max_quarantined folders are quarantined, or on the first failure without a
+    quarantine.
+
+    Attributes:
+        fetch_subfolders (Callable[[str], Awaitable[List[Dict[str, Any]]]]): Lists the
+            subfolders of a folder given its server relative URL.
+        workers (int): The number of worker tasks.
+        max_queue_size (int): The maximum number of frontier items kept in memory.
+        progress_interval (float): Seconds between progress reports.
+        skip_folder (Optional[Callable[[Dict[str, Any]], bool]]): Called with the record
+            of each folder that has children; when it returns True the folder is not
+            listed, e.g. because it is unchanged since a previous inventory.
+        checkpoint (Optional[Callable[[Dict[str, Any]], None]]): Called with the crawl
+            state every checkpoint_interval seconds and when the crawl stops early.
+        checkpoint_interval (float): Seconds between checkpoints.
+        folder_filter (Optional[FolderFilter]): Prunes the crawl: an excluded folder is
+            neither recorded nor listed, and a folder below which no folder can be
+            included is recorded but not listed.
+        folder_retries (int): The number of times a failed folder is retried.
+        retry_delay (float): The base delay in seconds before retrying a folder.
+        quarantine (Optional[Callable[[CrawlItem, Exception, int], None]]): Called with
+            each folder that still fails after its retries, the last error and the
+            number of attempts.
+        max_quarantined (int): The number of quarantined folders above which the
+            crawl fails.
+    """
+
+    # The fields of a folder entity the records are built from.
+    FOLDER_FIELDS = (
+        "Name",
+        "ServerRelativeUrl",
+        "TimeCreated",
+        "TimeLastModified",
+        "ItemCount",
+        "UniqueId",
+    )
+
+    def __init__(
+        self,
+        fetch_subfolders: Callable[[str], Awaitable[List[Dict[str, Any]]]],
+        workers: int,
+        max_queue_size: int,
+        progress_interval: float = 30.0,
+        skip_folder: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        checkpoint: Optional[Callable[[Dict[str, Any]], None]] = None,
+        checkpoint_interval: float = 60.0,
+        folder_filter: Optional[FolderFilter] = None,
+        folder_retries: int = 2,
+        retry_delay: float = 5.0,
+        quarantine: Optional[Callable[[CrawlItem, Exception, int], None]] = None,
+        max_quarantined: int = 100,
+    ) -> None:
+        """
+        Initializes the FolderCrawler instance with its fetch function and limits.
+        """
+        self.fetch_subfolders = fetch_subfolders
+        self.workers = max(1, workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.progress_interval = progress_interval
+        self.skip_folder = skip_folder
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.folder_filter = folder_filter or None
+        self.folder_retries = max(0, folder_retries)
+        self.retry_delay = retry_delay
+        self.quarantine = quarantine
+        self.max_quarantined = max_quarantined
+        self._queue: "asyncio.Queue[CrawlItem]" = asyncio.Queue(self.max_queue_size)
+        self._spill_file: Optional[IO[bytes]] = None
+        self._spill_read_pos = 0
+        self._spill_write_pos = 0
+        self._spilled = 0
+        self._discovered: Dict[int, int] = defaultdict(int)
+        self._listed: Dict[int, int] = defaultdict(int)
+        self._excluded = 0
+        self._completed_levels = -1
+        self._on_folder: Callable[[Dict[str, Any]], None] = lambda record: None
+        self._error: Optional[Exception] = None
+        self._error_event = asyncio.Event()
+        self._in_flight: Dict[int, CrawlItem] = {}
+        self._failed: List[CrawlItem] = []
+        self._attempts: Dict[str, int] = defaultdict(int)
+        self._retrying: Dict["asyncio.Task[None]", CrawlItem] = {}
+        self._quarantined: List[CrawlItem] = []
+
+    async def crawl(
+        self,
+        root_folders: List[Dict[str, Any]],
+        on_folder: Callable[[Dict[str, Any]], None],
+        resume_state: Optional[Dict[str, Any]] = None,
+    ) -> int:
+        """
+        Crawls the tree below the given root folders breadth first.
+
+        Args:
+            root_folders (List[Dict[str, Any]]): The level 0 folders, as returned by the API.
+            on_folder (Callable[[Dict[str, Any]], None]): Called with each folder record
+                as soon as it is parsed.
+            resume_state (Optional[Dict[str, Any]]): The state of an interrupted crawl
+                to continue instead of starting from the root folders.
+
+        Returns:
+            int: The number of folder records emitted.
+
+        Raises:
+            Exception: The first error raised while listing a folder or emitting the
+                records of its subfolders.
+        """
+        self._on_folder = on_folder
+        start = time.monotonic()
+        if resume_state is not None:
+            self._restore(resume_state)
+        else:
+            self._emit_folders(root_folders, "", 0)
+        self._check_completed_levels()
+
+        tasks = [
+            asyncio.create_task(self._worker(index)) for index in range(self.workers)
+        ]
+        reporter = asyncio.create_task(self._report_progress())
+        checkpointer = asyncio.create_task(self._save_checkpoints())
+        join_task = asyncio.create_task(self._queue.join())
+        error_task = asyncio.create_task(self._error_event.wait())
+        completed = False
+        try:
+            await asyncio.wait(
+                {join_task, error_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            completed = self._error is None
+        finally:
+            pending = tasks + [reporter, checkpointer, join_task, error_task]
+            pending += list(self._retrying)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if not completed and self.checkpoint is not None:
+                self.checkpoint(self.snapshot())
+            self._close_spill_file()
+
+        if self._error is not None:
+            raise self._error
+
+        total = sum(self._discovered.values())
+        logging.info(
+            f"Crawl finished: {total} folders in {time.monotonic() - start:.1f}s"
+        )
+        if self._quarantined:
+            paths = ", ".join(item.path for item in self._quarantined[:10])
+            more = len(self._quarantined) - 10
+            logging.warning(
+                f"{len(self._quarantined)} folders could not be listed and were "
+                f"quarantined: {paths}{f' and {more} more' if more > 0 else ''}"
+            )
+        if self._excluded:
+            logging.info(
+                f"Excluded {self._excluded} folders and their subfolders without "
+                f"listing them ({self.folder_filter.describe()})"
+            )
+        return total
+
+    @staticmethod
+    def build_folder_info(
+        folder: Dict[str, Any], parent_path: str, level: int
+    ) -> Dict[str, Any]:
+        """
+        Builds the inventory record of a folder returned by the API.
+
+        Args:
+            folder (Dict[str, Any]): The folder entity.
+            parent_path (str): The path of the parent folder.
+            level (int): The level of the folder.
+
+        Returns:
+            Dict[str, Any]: The folder record.
+        """
+        return {
+            "Name": folder["Name"],
+            "Path": f"{parent_path}/{folder['Name']}".strip("/"),
+            "ParentFolder": parent_path,
+            "Level": level,
+            "TimeCreated": folder["TimeCreated"],
+            "TimeLastModified": folder["TimeLastModified"],
+            "ItemCount": folder["ItemCount"],
+            "ServerRelativeUrl": folder["ServerRelativeUrl"],
+            "UniqueId": folder["UniqueId"],
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the crawl state: every folder still to be listed, including the ones
+        whose request is in flight or failed, and the progress counters. It is taken
+        without awaiting, so it matches the records emitted so far.
+
+        Returns:
+            Dict[str, Any]: The JSON serializable crawl state.
+        """
+        frontier = self._failed + list(self._in_flight.values())
+        frontier.extend(self._retrying.values())
+        # asyncio.Queue keeps its items in a deque.
+        frontier.extend(self._queue._queue)  # type: ignore[attr-defined]
+        if self._spilled:
+            self._spill_file.seek(self._spill_read_pos)
+            for _ in range(self._spilled):
+                frontier.append(CrawlItem(*json.loads(self._spill_file.readline())))
+        return {
+            "enumeration": "folders",
+            "frontier": [list(item) for item in frontier],
+            "discovered": dict(self._discovered),
+            "listed": dict(self._listed),
+        }
+
+    def _restore(self, state: Dict[str, Any]) -> None:
+        """
+        Restores the progress counters and the frontier of an interrupted crawl.
+        """
+        for level, count in state.get("discovered", {}).items():
+            self._discovered[int(level)] = count
+        for level, count in state.get("listed", {}).items():
+            self._listed[int(level)] = count
+        for item in state.get("frontier", []):
+            self._enqueue(CrawlItem(*item))
+        logging.info(
+            f"Resuming crawl with {len(state.get('frontier', []))} folders pending"
+        )
+
+    async def _save_checkpoints(self) -> None:
+        """
+        Periodically saves the crawl state.
+        """
+        if self.checkpoint is None:
+            return
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            self.checkpoint(self.snapshot())
+
+    async def _worker(self, index: int) -> None:
+        """
+        Takes folders from the queue, lists their subfolders and enqueues them.
+
+        Args:
+            index (int): The index of the worker, keying its in-flight folder.
+        """
+        while True:
+            item = await self._queue.get()
+            self._in_flight[index] = item
+            retrying = False
+            try:
+                subfolders = await self.fetch_subfolders(item.server_relative_url)
+            except Exception as e:
+                self._in_flight.pop(index, None)
+                retrying = self._handle_failure(item, e)
+            else:
+                del self._in_flight[index]
+                self._attempts.pop(item.path, None)
+                try:
+                    self._emit_folders(subfolders, item.path, item.level + 1)
+                    self._listed[item.level] += 1
+                except Exception as e:
+                    # Only listings are retried: listing the folder again would emit
+                    # the records already written, so a sink or pipeline error fails
+                    # the crawl.
+                    self._fail(item, e)
+            finally:
+                self._refill_queue()
+                # A folder waiting for its retry stays unfinished, so the queue is
+                # not joined before it is listed.
+                if not retrying:
+                    self._queue.task_done()
+                self._check_completed_levels()
+
+    def _handle_failure(self, item: CrawlItem, error: Exception) -> bool:
+        """
+        Schedules the retry of a folder whose listing failed, or quarantines it once
+        its retries are exhausted. The crawl fails when the folder cannot be
+        quarantined.
+
+        Returns:
+            bool: Whether a retry was scheduled.
+        """
+        self._attempts[item.path] += 1
+        attempts = self._attempts[item.path]
+        if attempts <= self.folder_retries:
+            delay = random.uniform(0.5, 1.0) * self.retry_delay * 2 ** (attempts - 1)
+            request_log.warning(
+                "Listing %s failed (%s), retrying in %.1fs", item.path, error, delay
+            )
+            task = asyncio.create_task(self._retry_later(item, delay))
+            self._retrying[task] = item
+            return True
+        del self._attempts[item.path]
+        if (
+            self.quarantine is not None
+            and len(self._quarantined) < self.max_quarantined
+        ):
+            try:
+                self.quarantine(item, error, attempts)
+            except Exception as e:
+                error = e
+            else:
+                logging.error(
+                    f"Quarantined {item.path} after {attempts} attempts: {error}"
+                )
+                self._quarantined.append(item)
+                # The folder counts as listed, so its level can complete.
+                self._listed[item.level] += 1
+                return False
+        self._fail(item, error)
+        return False
+
+    def _fail(self, item: CrawlItem, error: Exception) -> None:
+        """
+        Fails the crawl, keeping the folder in the frontier of its checkpoint.
+        """
+        self._failed.append(item)
+        if self._error is None:
+            self._error = error
+        self._error_event.set()
+
+    async def _retry_later(self, item: CrawlItem, delay: float) -> None:
+        """
+        Puts a failed folder back into the queue after a delay, then marks its failed
+        attempt done.
+        """
+        await asyncio.sleep(delay)
+        del self._retrying[asyncio.current_task()]
+        self._enqueue(item)
+        self._refill_queue()
+        self._queue.task_done()
+
+    def _emit_folders(
+        self, folders: List[Dict[str, Any]], parent_path: str, level: int
+    ) -> None:
+        """
+        Emits the records of the given folders and enqueues the ones with children.
+        This runs without awaiting, so a folder and its children are recorded atomically.
+        """
+        folder_filter = self.folder_filter
+        for folder in folders:
+            folder_info = self.build_folder_info(folder, parent_path, level)
+            if folder_filter is not None and folder_filter.excludes(folder_info):
+                # An excluded subtree is dropped before any of it is requested.
+                self._excluded += 1
+                continue
+            self._on_folder(folder_info)
+            self._discovered[level] += 1
+            if (
+                folder_info["ItemCount"]
+                and (
+                    folder_filter is None
+                    or folder_filter.may_include_below(folder_info)
+                )
+                and not (self.skip_folder and self.skip_folder(folder_info))
+            ):
+                self._enqueue(
+                    CrawlItem(
+                        folder_info["ServerRelativeUrl"], folder_info["Path"], level
+                    )
+                )
+            else:
+                # An empty, pruned or skipped folder is not listed.
+                self._listed[level] += 1
+
+    def _enqueue(self, item: CrawlItem) -> None:
+        """
+        Adds an item to the queue, spilling it to disk if the queue is full.
+        """
+        if self._spilled == 0 and not self._queue.full():
+            self._queue.put_nowait(item)
+            return
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile()
+        self._spill_file.seek(self._spill_write_pos)
+        self._spill_file.write(json.dumps(list(item)).encode("utf-8") + b"\n")
+        self._spill_write_pos = self._spill_file.tell()
+        self._spilled += 1
+
+    def _refill_queue(self) -> None:
+        """
+        Moves spilled items back into the queue while it has room.
+        """
+        while self._spilled and not self._queue.full():
+            self._spill_file.seek(self._spill_read_pos)
+            line = self._spill_file.readline()
+            self._spill_read_pos = self._spill_file.tell()
+            self._spilled -= 1
+            self._queue.put_nowait(CrawlItem(*json.loads(line)))
+        if self._spill_file is not None and self._spilled == 0:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spill_read_pos = self._spill_write_pos = 0
+
+    def _close_spill_file(self) -> None:
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def _check_completed_levels(self) -> None:
+        """
+        Logs each level once all of its folders have been listed.
+        """
+        level = self._completed_levels + 1
+        while (
+            level in self._discovered and self._listed[level] == self._discovered[level]
+        ):
+            logging.info(
+                f"Level {level} complete: {self._discovered[level]} folders listed"
+            )
+            self._completed_levels = level
+            level += 1
+
+    async def _report_progress(self) -> None:
+        """
+        Periodically logs the crawl progress per level.
+        """
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            levels = ", ".join(
+                f"L{level}: {self._listed[level]}/{count}"
+                for level, count in sorted(self._discovered.items())
+            )
+            logging.info(
+                f"Crawl progress: {sum(self._discovered.values())} folders discovered, "
+                f"{self._queue.qsize()} queued, {self._spilled} spilled ({levels})"
+            )
@@ -0,0 +1,486 @@
+import operator
+import re
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from app.exceptions import FilterRuleError
+
+# The fields a rule can test, and the inventory column each one reads.
+RULE_FIELDS = {
+    "path": "Path",
+    "name": "Name",
+    "level": "Level",
+    "items": "ItemCount",
+    "modified": "TimeLastModified",
+}
+TEXT_FIELDS = ("path", "name")
+COMPARISONS: Dict[str, Callable[[Any, Any], Any]] = {
+    "<=": operator.le,
+    ">=": operator.ge,
+    "<": operator.lt,
+    ">": operator.gt,
+    "=": operator.eq,
+}
+RULE_PATTERN = re.compile(
+    r"^\s*([a-z]+)\s*(:|~|<=|>=|<|>|=)\s*(.*?)\s*$", re.IGNORECASE
+)
+
+# The format of the timestamps of the SharePoint REST API.
+SHAREPOINT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class FilterRule(NamedTuple):
+    """
+    A parsed filter rule: a glob (":") or regular expression ("~") on path or name,
+    or a comparison on level, items or modified.
+    """
+
+    field: str
+    operator: str
+    value: Any
+    text: str
+
+
+def parse_rule(text: str) -> FilterRule:
+    """
+    Parses a filter rule such as "name:Forms", "path~^Archive/", "level>4",
+    "items>=100000" or "modified<2020-01-01".
+
+    Args:
+        text (str): The rule.
+
+    Returns:
+        FilterRule: The parsed rule. The value of a glob or regular expression rule
+            is a regular expression, and the value of a modified rule a timestamp.
+
+    Raises:
+        FilterRuleError: If the rule cannot be parsed.
+    """
+    match = RULE_PATTERN.match(text)
+    if match is None:
+        raise FilterRuleError(f"Invalid filter rule {text!r}")
+    field, op, value = match.group(1).lower(), match.group(2), match.group(3)
+    if field not in RULE_FIELDS:
+        raise FilterRuleError(
+            f"Invalid filter rule {text!r}: unknown field {field!r}, expected one of "
+            f"{', '.join(RULE_FIELDS)}"
+        )
+    if field in TEXT_FIELDS:
+        if op == ":":
+            return FilterRule(field, op, f"^{glob_to_regex(value)}$", text)
+        if op == "~":
+            try:
+                re.compile(value)
+            except re.error as e:
+                raise FilterRuleError(f"Invalid regular expression in {text!r}: {e}")
+            return FilterRule(field, op, f"(?:{value})", text)
+    elif op in COMPARISONS:
+        if field == "modified":
+            parsed = parse_time(value)
+            if parsed is None:
+                raise FilterRuleError(f"Invalid date in filter rule {text!r}")
+            return FilterRule(field, op, parsed, text)
+        try:
+            return FilterRule(field, op, int(value), text)
+        except ValueError:
+            raise FilterRuleError(f"Invalid number in filter rule {text!r}")
+    raise FilterRuleError(
+        f"Invalid operator {op!r} for {field} in filter rule {text!r}"
+    )
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translates a glob pattern (*, ? and [...] classes) into a regular expression
+    that Python and RE2 both accept, to be matched against the whole string.
+
+    Args:
+        pattern (str): The glob pattern.
+
+    Returns:
+        str: The regular expression, without anchors.
+    """
+    regex = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        index += 1
+        if char == "*":
+            regex.append(".*")
+        elif char == "?":
+            regex.append(".")
+        elif char == "[" and "]" in pattern[index + 1 :]:
+            end = pattern.index("]", index + 1)
+            members = pattern[index:end]
+            index = end + 1
+            negated = members.startswith("!")
+            members = members[1:] if negated else members
+            escaped = "".join(
+                member if member == "-" else re.escape(member) for member in members
+            )
+            regex.append(f"[{'^' if negated else ''}{escaped}]")
+        else:
+            regex.append(re.escape(char))
+    return f"(?:{''.join(regex)})"
+
+
+def parse_time(value: Any) -> Optional[np.datetime64]:
+    """
+    Parses a timestamp into a UTC datetime64, assuming UTC when it has no offset.
+
+    Returns:
+        Optional[np.datetime64]: The timestamp, or None if it cannot be parsed.
+    """
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        try:
+            parsed = pd.Timestamp(value).to_pydatetime()
+        except (ValueError, TypeError):
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(parsed, "us")
+
+
+def parse_times(values: pd.Series) -> np.ndarray:
+    """
+    Parses a column of timestamps into UTC datetime64 values, NaT where they cannot
+    be parsed. The timestamps SharePoint returns are parsed by an Arrow kernel; the
+    few in another format fall back to pandas.
+    """
+    parsed = pc.strptime(
+        to_arrow_strings(values),
+        format=SHAREPOINT_TIME_FORMAT,
+        unit="us",
+        error_is_null=True,
+    )
+    times = parsed.to_numpy(zero_copy_only=False).astype("datetime64[us]")
+    unparsed = np.isnat(times)
+    if unparsed.any():
+        fallback = pd.to_datetime(
+            values[unparsed], utc=True, format="ISO8601", errors="coerce"
+        )
+        times[unparsed] = fallback.dt.tz_localize(None).to_numpy(dtype="datetime64[us]")
+    return times
+
+
+def to_arrow_strings(values: pd.Series) -> pa.Array:
+    """
+    Converts a column to an Arrow string array, converting values that are not
+    strings, e.g. folder names read as numbers from Excel, first.
+    """
+    try:
+        return pa.array(values, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(values.astype(str), type=pa.string())
+
+
+class CompiledRules:
+    """
+    A list of rules compiled into one matcher: the globs and regular expressions on
+    each text field are merged into a single case-insensitive regular expression,
+    so a value is scanned once whatever the number of rules, and the comparisons
+    are bound to their operator functions.
+
+    The same rules are evaluated on one record or, vectorized, on whole columns.
+
+    Attributes:
+        rules (List[FilterRule]): The rules, a value matching if any rule matches.
+    """
+
+    def __init__(self, rules: List[FilterRule]) -> None:
+        self.rules = rules
+        self.patterns: Dict[str, str] = {}
+        for field in TEXT_FIELDS:
+            parts = [rule.value for rule in rules if rule.field == field]
+            if parts:
+                self.patterns[RULE_FIELDS[field]] = "|".join(parts)
+        self._regexes = {
+            column: re.compile(pattern, re.IGNORECASE)
+            for column, pattern in self.patterns.items()
+        }
+        self._comparisons = [
+            (RULE_FIELDS[rule.field], COMPARISONS[rule.operator], rule.value)
+            for rule in rules
+            if rule.field not in TEXT_FIELDS
+        ]
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    @property
+    def columns(self) -> List[str]:
+        """
+        The inventory columns the rules read.
+        """
+        return list(dict.fromkeys(RULE_FIELDS[rule.field] for rule in self.rules))
+
+    def match(self, record: Dict[str, Any]) -> bool:
+        """
+        Evaluates the rules on a record; a field missing from it matches no rule.
+        """
+        for column, regex in self._regexes.items():
+            value = record.get(column)
+            if value is not None and regex.search(str(value)):
+                return True
+        for column, compare, expected in self._comparisons:
+            value = record.get(column)
+            if value is None:
+                continue
+            if column == "TimeLastModified":
+                value = parse_time(value)
+                if value is None:
+                    continue
+            if compare(value, expected):
+                return True
+        return False
+
+    def match_columns(self, columns: Dict[str, Any], rows: int) -> np.ndarray:
+        """
+        Evaluates the rules on whole columns; a column missing from them matches no
+        rule.
+
+        Args:
+            columns (Dict[str, Any]): Arrow string arrays for the text columns, and
+                numpy arrays for the others (datetime64 for TimeLastModified).
+            rows (int): The number of rows.
+
+        Returns:
+            np.ndarray: Whether each row matches any rule.
+        """
+        matched = np.zeros(rows, dtype=bool)
+        for column, pattern in self.patterns.items():
+            if column in columns:
+                matched |= _search(columns[column], pattern)
+        for column, compare, expected in self._comparisons:
+            if column in columns:
+                with np.errstate(invalid="ignore"):
+                    matched |= np.asarray(
+                        compare(columns[column], expected), dtype=bool
+                    )
+        return matched
+
+
+class FolderFilter:
+    """
+    Include and exclude rules deciding which folders are crawled and copied.
+
+    A rule tests one field of a folder: "path:<glob>" and "name:<glob>" match the
+    whole Path or Name against a glob, "path~<regex>" and "name~<regex>" search
+    them with a regular expression (both case-insensitive, like SharePoint), and
+    "level", "items" (ItemCount) and "modified" (TimeLastModified) are compared with
+    <, <=, >, >= or =, e.g. "level>4", "items>=100000" or "modified<2020-01-01".
+
+    A folder matching any exclude rule is dropped with its whole subtree: the crawl
+    neither records nor lists it, so an excluded subtree costs no request. When
+    include rules are given, only folders matching one of them are copied, and the
+    crawl does not list folders below which no folder can match an include rule on
+    path or level, e.g. everything outside "path:Projects/*" or below "level<=3".
+
+    Each rule list is compiled into a single matcher evaluated on records during
+    the crawl and vectorized over inventory columns during job selection.
+
+    Attributes:
+        include (CompiledRules): The include rules.
+        exclude (CompiledRules): The exclude rules.
+    """
+
+    def __init__(
+        self,
+        include: Optional[Iterable[str]] = None,
+        exclude: Optional[Iterable[str]] = None,
+    ) -> None:
+        """
+        Initializes the FolderFilter instance and compiles its rules.
+
+        Raises:
+            FilterRuleError: If a rule cannot be parsed.
+        """
+        self.include = CompiledRules(
+            [parse_rule(rule) for rule in include or [] if rule.strip()]
+        )
+        self.exclude = CompiledRules(
+            [parse_rule(rule) for rule in exclude or [] if rule.strip()]
+        )
+        # The fixed start of each include glob on path, up to its first wildcard.
+        self._include_prefixes: List[Optional[str]] = []
+        for rule in self.include.rules:
+            if rule.field == "path" and rule.operator == ":":
+                glob = rule.text.split(":", 1)[1].strip().strip("/").lower()
+                self._include_prefixes.append(re.split(r"[*?\[]", glob, 1)[0])
+
+    def __bool__(self) -> bool:
+        return bool(self.include or self.exclude)
+
+    @property
+    def columns(self) -> List[str]:
+        """
+        The inventory columns the rules read.
+        """
+        columns = self.include.columns + self.exclude.columns
+        if self.exclude:
+            # Exclusions of ancestors are found from the Path.
+            columns += ["Path", "Level"]
+        return list(dict.fromkeys(columns))
+
+    def excludes(self, record: Dict[str, Any], ancestors: bool = False) -> bool:
+        """
+        Checks whether a folder is excluded.
+
+        Args:
+            record (Dict[str, Any]): The folder record.
+            ancestors (bool): Whether to also check the path, name and level of its
+                ancestors, for records that were not reached through their parents.
+
+        Returns:
+            bool: Whether the folder or, when checked, one of its ancestors matches
+                an exclude rule.
+        """
+        if not self.exclude:
+            return False
+        if self.exclude.match(record):
+            return True
+        if ancestors:
+            parts = str(record.get("Path") or "").split("/")
+            for depth in range(1, len(parts)):
+                ancestor = {
+                    "Path": "/".join(parts[:depth]),
+                    "Name": parts[depth - 1],
+                    "Level": depth - 1,
+                }
+                if self.exclude.match(ancestor):
+                    return True
+        return False
+
+    def includes(self, record: Dict[str, Any]) -> bool:
+        """
+        Checks whether a folder matches the include rules, if there are any.
+        """
+        return not self.include or self.include.match(record)
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        """
+        Checks whether a folder is to be copied: included and not excluded, itself or
+        through an ancestor.
+        """
+        return self.includes(record) and not self.excludes(record, ancestors=True)
+
+    def may_include_below(self, record: Dict[str, Any]) -> bool:
+        """
+        Checks whether a folder below the given one can match an include rule, i.e.
+        whether the folder has to be listed.
+        """
+        if not self.include:
+            return True
+        path = f"{str(record['Path']).lower()}/"
+        child_level = int(record["Level"]) + 1
+        prefixes = iter(self._include_prefixes)
+        for rule in self.include.rules:
+            if rule.field == "path" and rule.operator == ":":
+                prefix = next(prefixes)
+                if prefix.startswith(path) or path.startswith(prefix):
+                    return True
+            elif rule.field == "level":
+                if rule.operator in ("<", "<=", "="):
+                    limit = rule.value - 1 if rule.operator == "<" else rule.value
+                    if child_level <= limit:
+                        return True
+                else:
+                    return True
+            else:
+                return True
+        return False
+
+    def mask(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Evaluates matches() over the rows of a DataFrame holding the rule columns.
+
+        Args:
+            df (pd.DataFrame): The folder records.
+
+        Returns:
+            np.ndarray: Whether each folder is to be copied.
+        """
+        rows = len(df)
+        selected = np.ones(rows, dtype=bool)
+        if not self or rows == 0:
+            return selected
+        columns = self._frame_columns(df)
+        if self.include:
+            selected &= self.include.match_columns(columns, rows)
+        if self.exclude:
+            selected &= ~self.exclude.match_columns(columns, rows)
+            selected &= ~self._ancestor_excluded(columns["Path"], rows)
+        return selected
+
+    def describe(self) -> str:
+        """
+        Describes the rules for log messages.
+        """
+        parts = []
+        if self.include:
+            parts.append(f"include {'; '.join(r.text for r in self.include.rules)}")
+        if self.exclude:
+            parts.append(f"exclude {'; '.join(r.text for r in self.exclude.rules)}")
+        return ", ".join(parts) or "no rules"
+
+    def _frame_columns(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """
+        Converts the rule columns of a DataFrame for CompiledRules.match_columns.
+        """
+        columns: Dict[str, Any] = {}
+        for column in self.columns:
+            if column not in df.columns:
+                continue
+            if column in ("Path", "Name"):
+                columns[column] = to_arrow_strings(df[column])
+            elif column == "TimeLastModified":
+                columns[column] = parse_times(df[column])
+            else:
+                columns[column] = pd.to_numeric(df[column], errors="coerce").to_numpy(
+                    dtype="float64"
+                )
+        return columns
+
+    def _ancestor_excluded(self, paths: pa.Array, rows: int) -> np.ndarray:
+        """
+        Evaluates the exclude rules on the path, name and level of the ancestors of
+        every row, one depth at a time.
+        """
+        excluded = np.zeros(rows, dtype=bool)
+        parts = pc.split_pattern(pc.fill_null(paths, ""), "/")
+        lengths = pc.list_value_length(parts).to_numpy(zero_copy_only=False)
+        for depth in range(1, int(lengths.max()) if rows else 0):
+            ancestors = {
+                "Path": pc.binary_join(pc.list_slice(parts, 0, depth), "/"),
+                "Name": pc.binary_join(pc.list_slice(parts, depth - 1, depth), "/"),
+                "Level": np.full(rows, depth - 1, dtype="float64"),
+            }
+            matched = self.exclude.match_columns(ancestors, rows)
+            excluded |= matched & (lengths > depth)
+        return excluded
+
+
+def _search(values: pa.Array, pattern: str) -> np.ndarray:
+    """
+    Searches a regular expression in every value of an Arrow string array,
+    case-insensitively. Patterns RE2 does not support fall back to Python.
+    """
+    try:
+        matched = pc.match_substring_regex(values, pattern, ignore_case=True)
+    except (pa.ArrowInvalid, NotImplementedError):
+        regex = re.compile(pattern, re.IGNORECASE)
+        return np.array(
+            [
+                value is not None and bool(regex.search(value))
+                for value in values.to_pylist()
+            ],
+            dtype=bool,
+        )
+    return pc.fill_null(matched, False).to_numpy(zero_copy_only=False)
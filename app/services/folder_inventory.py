@@ -0,0 +1,306 @@
+import sys
+from array import array
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.services.inventory_sink import SQLiteSink
+
+
+class FolderInventory:
+    """
+    A compact in-memory folder inventory stored as columns instead of one dict per
+    folder.
+
+    Each folder keeps its Name and the index of its parent folder; Path and
+    ParentFolder are rebuilt from the parent chain on demand instead of repeating the
+    parent prefix at every level, and ServerRelativeUrl is the library URL followed by
+    the Path. Level and ItemCount live in typed arrays, UniqueId is stored as its 16
+    bytes, and names and timestamps are interned so repeated values are kept once.
+    A value that does not fit this encoding, e.g. a ServerRelativeUrl that is not
+    below the library URL, is kept as is for that folder, so every record reads back
+    exactly as it was appended.
+
+    The inventory is a sequence of folder records: indexing and iterating return
+    dicts built on the fly, and to_frame() builds a DataFrame straight from the
+    columns.
+
+    Attributes:
+        base_url (Optional[str]): The server relative URL of the library root, taken
+            from the first folder.
+    """
+
+    COLUMNS = SQLiteSink.COLUMNS
+
+    # The parent index of a top level folder.
+    ROOT = -1
+
+    def __init__(self) -> None:
+        self.base_url: Optional[str] = None
+        self._names: List[str] = []
+        self._parents = array("q")
+        self._levels = array("h")
+        self._item_counts = array("q")
+        self._created: List[Any] = []
+        self._modified: List[Any] = []
+        self._unique_ids = bytearray()
+        self._children: Dict[int, Dict[str, int]] = {}
+        self._overrides: Dict[int, Dict[str, Any]] = {}
+        self._last_parent = ("", self.ROOT)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return self.record(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """
+        Appends a folder record. The parent folder should be appended first; a folder
+        whose parent is unknown keeps its ParentFolder as is.
+
+        Args:
+            record (Dict[str, Any]): The folder record, with the inventory columns.
+        """
+        index = len(self._names)
+        overrides: Dict[str, Any] = {}
+        name = _intern(record["Name"])
+        path = record["Path"]
+        parent_path = record["ParentFolder"] or ""
+
+        parent = self.find(parent_path) if parent_path else self.ROOT
+        if parent is None:
+            parent = self.ROOT
+            overrides["ParentFolder"] = parent_path
+        if path != f"{parent_path}/{name}".strip("/"):
+            overrides["Path"] = path
+        else:
+            self._children.setdefault(parent, {})[name] = index
+
+        url = record["ServerRelativeUrl"]
+        if self.base_url is None and url.endswith(f"/{path}"):
+            self.base_url = url[: -len(path) - 1]
+        if url != f"{self.base_url}/{path}":
+            overrides["ServerRelativeUrl"] = url
+
+        unique_id = record["UniqueId"]
+        packed = _pack_uuid(unique_id)
+        if packed is None:
+            packed = bytes(16)
+            overrides["UniqueId"] = unique_id
+
+        item_count = record["ItemCount"]
+        if not isinstance(item_count, (int, np.integer)):
+            overrides["ItemCount"] = item_count
+            item_count = 0
+
+        self._names.append(name)
+        self._parents.append(parent)
+        self._levels.append(int(record["Level"]))
+        self._item_counts.append(int(item_count))
+        self._created.append(_intern(record["TimeCreated"]))
+        self._modified.append(_intern(record["TimeLastModified"]))
+        self._unique_ids += packed
+        if overrides:
+            self._overrides[index] = overrides
+
+    def extend(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Appends folder records in order.
+        """
+        for record in records:
+            self.append(record)
+
+    def extend_frame(self, df: pd.DataFrame) -> None:
+        """
+        Appends the rows of a DataFrame holding the inventory columns, without
+        building a dict per row first.
+        """
+        record: Dict[str, Any] = {}
+        for values in zip(*(df[column].to_numpy() for column in self.COLUMNS)):
+            record.update(zip(self.COLUMNS, values))
+            self.append(record)
+
+    def find(self, path: str) -> Optional[int]:
+        """
+        Returns the index of the folder at the given path, if any.
+        """
+        if self._last_parent[0] == path:
+            return self._last_parent[1]
+        index = self.ROOT
+        for name in path.split("/"):
+            index = self._children.get(index, {}).get(name)
+            if index is None:
+                return None
+        self._last_parent = (path, index)
+        return index
+
+    def path(self, index: int) -> str:
+        """
+        Rebuilds the Path of a folder from its parent chain.
+        """
+        overrides = self._overrides.get(index)
+        if overrides is not None and "Path" in overrides:
+            return overrides["Path"]
+        parent_path = self.parent_path(index)
+        return (
+            f"{parent_path}/{self._names[index]}" if parent_path else self._names[index]
+        )
+
+    def parent_path(self, index: int) -> str:
+        """
+        Rebuilds the ParentFolder of a folder from its parent chain.
+        """
+        overrides = self._overrides.get(index)
+        if overrides is not None and "ParentFolder" in overrides:
+            return overrides["ParentFolder"]
+        parent = self._parents[index]
+        return "" if parent == self.ROOT else self.path(parent)
+
+    def children(self, index: int) -> List[int]:
+        """
+        Returns the indexes of the direct subfolders of a folder.
+        """
+        return list(self._children.get(index, {}).values())
+
+    def descendants(self, index: int) -> Iterator[int]:
+        """
+        Yields the indexes of every folder below a folder, breadth first.
+        """
+        pending = deque(self.children(index))
+        while pending:
+            child = pending.popleft()
+            yield child
+            pending.extend(self.children(child))
+
+    def record(self, index: int) -> Dict[str, Any]:
+        """
+        Builds the record of a folder.
+
+        Args:
+            index (int): The index of the folder.
+
+        Returns:
+            Dict[str, Any]: The folder record, with the inventory columns.
+        """
+        path = self.path(index)
+        record = {
+            "Name": self._names[index],
+            "Path": path,
+            "ParentFolder": self.parent_path(index),
+            "Level": self._levels[index],
+            "TimeCreated": self._created[index],
+            "TimeLastModified": self._modified[index],
+            "ItemCount": self._item_counts[index],
+            "ServerRelativeUrl": f"{self.base_url}/{path}",
+            "UniqueId": _format_uuid(
+                self._unique_ids[index * 16 : index * 16 + 16].hex()
+            ),
+        }
+        record.update(self._overrides.get(index, {}))
+        return record
+
+    def to_frame(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Builds a DataFrame of the inventory column by column. Names and timestamps
+        are shared with the inventory rather than copied.
+
+        Args:
+            columns (Optional[List[str]]): The columns to build, or None for all.
+
+        Returns:
+            pd.DataFrame: The folder records.
+        """
+        columns = columns or self.COLUMNS
+        paths = (
+            self._paths()
+            if {"Path", "ParentFolder", "ServerRelativeUrl"} & set(columns)
+            else []
+        )
+        builders = {
+            "Name": lambda: self._names,
+            "Path": lambda: paths,
+            "ParentFolder": lambda: [
+                "" if parent == self.ROOT else paths[parent] for parent in self._parents
+            ],
+            "Level": lambda: np.array(self._levels, dtype="int64"),
+            "TimeCreated": lambda: self._created,
+            "TimeLastModified": lambda: self._modified,
+            "ItemCount": lambda: np.array(self._item_counts, dtype="int64"),
+            "ServerRelativeUrl": lambda: [f"{self.base_url}/{path}" for path in paths],
+            "UniqueId": self._unique_id_column,
+        }
+        df = pd.DataFrame({column: builders[column]() for column in columns})
+        for index, overrides in self._overrides.items():
+            for column, value in overrides.items():
+                if column in df.columns:
+                    if df[column].dtype != object:
+                        df[column] = df[column].astype(object)
+                    df.at[index, column] = value
+        return df
+
+    def _unique_id_column(self) -> List[str]:
+        """
+        Formats the UniqueId of every folder from one hex dump of the packed bytes.
+        """
+        digits = self._unique_ids.hex()
+        return [
+            _format_uuid(digits[start : start + 32])
+            for start in range(0, len(digits), 32)
+        ]
+
+    def _paths(self) -> List[str]:
+        """
+        Rebuilds the Path of every folder, reusing the path of each parent.
+        """
+        paths: List[str] = [""] * len(self)
+        for index in range(len(self)):
+            overrides = self._overrides.get(index, {})
+            if "Path" in overrides:
+                paths[index] = overrides["Path"]
+                continue
+            # A parent is always appended before its subfolders.
+            parent = self._parents[index]
+            if parent == self.ROOT:
+                parent_path = overrides.get("ParentFolder", "")
+            else:
+                parent_path = paths[parent]
+            name = self._names[index]
+            paths[index] = f"{parent_path}/{name}" if parent_path else name
+        return paths
+
+
+def _pack_uuid(value: Any) -> Optional[bytes]:
+    """
+    Packs a lowercase GUID string into its 16 bytes, or returns None if the value
+    would not read back identically.
+    """
+    if type(value) is not str or len(value) != 36:
+        return None
+    try:
+        packed = bytes.fromhex(value.replace("-", ""))
+    except ValueError:
+        return None
+    if len(packed) != 16 or _format_uuid(packed.hex()) != value:
+        return None
+    return packed
+
+
+def _format_uuid(digits: str) -> str:
+    """
+    Formats 32 hex digits as a GUID string.
+    """
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+
+def _intern(value: Any) -> Any:
+    """
+    Interns a string so equal values share one object.
+    """
+    return sys.intern(value) if type(value) is str else value
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import re
+import time
+import urllib.parse
+import uuid
+from typing import Dict, Iterable, List, Optional, Set
+
+import aiohttp
+
+from app.auth.token_provider import TokenProvider
+from app.exceptions import FolderProvisioningError
+from app.utils import odata
+from app.utils.http_session import PooledSession
+from app.utils.log_handlers import request_log
+from app.utils.rate_governor import Governor, RateGovernor
+
+# The status line of each response of a $batch response.
+BATCH_STATUS_PATTERN = re.compile(rb"^HTTP/1\.1 (\d{3})", re.MULTILINE)
+
+
+class FolderTrie:
+    """
+    A trie of folder paths, relative to the destination folder. Adding a path adds
+    all its ancestors, and paths sharing ancestors share their nodes, so the trie
+    holds every folder to create exactly once however many paths lead through it.
+    Segments are compared case-insensitively, as SharePoint does; a folder keeps the
+    name it was first added with.
+    """
+
+    __slots__ = ("name", "children")
+
+    def __init__(self, name: str = "") -> None:
+        self.name = name
+        self.children: Dict[str, "FolderTrie"] = {}
+
+    def add(self, path: str) -> None:
+        """
+        Adds a folder path and its ancestors.
+
+        Args:
+            path (str): The folder path, with "/" separated segments.
+        """
+        node = self
+        for segment in path.split("/"):
+            if not segment:
+                continue
+            child = node.children.get(segment.casefold())
+            if child is None:
+                child = node.children[segment.casefold()] = FolderTrie(segment)
+            node = child
+
+    def levels(self) -> List[List[str]]:
+        """
+        Returns the paths of the folders of the trie, one list per depth from the top
+        folders down, so that each list can be created once the previous one exists.
+
+        Returns:
+            List[List[str]]: The folder paths of each depth.
+        """
+        levels: List[List[str]] = []
+        current = [("", self)]
+        while True:
+            current = [
+                (f"{path}/{child.name}" if path else child.name, child)
+                for path, node in current
+                for child in node.children.values()
+            ]
+            if not current:
+                return levels
+            levels.append([path for path, _ in current])
+
+    def __len__(self) -> int:
+        return sum(1 + len(child) for child in self.children.values())
+
+
+class FolderProvisioner:
+    """
+    Creates the folders of the destination that copy jobs are copied into, so that a
+    folder copied from deep in the source keeps its parent hierarchy, and a planned
+    job does not start before the folder its parent's job copies exists.
+
+    The paths of the destination folders are gathered in a FolderTrie, which keeps
+    each ancestor once, and created one depth at a time: the folders of a depth are
+    sent in $batch requests of batch_size folders, all in flight at once through the
+    rate governor, and the next depth starts when they exist. Folders.Add returns an
+    existing folder unchanged, so no existence checks are needed and provisioning
+    again is harmless. Folders provisioned by this instance are not sent again.
+
+    Attributes:
+        token_provider (TokenProvider): The provider of the current access token.
+        site_url (str): The URL of the destination site.
+        root_path (str): The server-relative path of the destination folder.
+        rate_governor (Governor): The shared governor of SharePoint requests.
+        aiohttp_limit (int): The maximum number of connections.
+        batch_size (int): The maximum number of folders per $batch request.
+        odata_metadata (str): The OData metadata level of the responses.
+    """
+
+    def __init__(
+        self,
+        token_provider: TokenProvider,
+        site_url: str,
+        root_path: str,
+        rate_governor: Optional[Governor] = None,
+        aiohttp_limit: int = 100,
+        batch_size: int = 100,
+        odata_metadata: str = "nometadata",
+    ) -> None:
+        self.token_provider = token_provider
+        self.site_url = site_url.rstrip("/")
+        self.root_path = root_path.rstrip("/")
+        self.rate_governor = rate_governor or RateGovernor(aiohttp_limit)
+        self.aiohttp_limit = aiohttp_limit
+        self.batch_size = max(1, batch_size)
+        self.odata_metadata = odata_metadata
+        self._provisioned: Set[str] = set()
+
+    async def provision(self, paths: Iterable[str]) -> int:
+        """
+        Creates the folders at the given paths below the destination folder, with
+        their ancestors.
+
+        Args:
+            paths (Iterable[str]): The folder paths, relative to the destination folder.
+
+        Returns:
+            int: The number of folders sent to SharePoint.
+
+        Raises:
+            FolderProvisioningError: If a folder cannot be created.
+        """
+        trie = FolderTrie()
+        for path in paths:
+            trie.add(path)
+        levels = [
+            [path for path in level if path.casefold() not in self._provisioned]
+            for level in trie.levels()
+        ]
+        total = sum(len(level) for level in levels)
+        if not total:
+            return 0
+        logging.info(
+            f"Provisioning {total} destination folders across {len(levels)} levels"
+        )
+        start = time.monotonic()
+        async with PooledSession(
+            max(self.aiohttp_limit, self.rate_governor.max_concurrency)
+        ) as session:
+            for level in levels:
+                batches = [
+                    level[i : i + self.batch_size]
+                    for i in range(0, len(level), self.batch_size)
+                ]
+                results = await asyncio.gather(
+                    *(self._create_folders(session, batch) for batch in batches),
+                    return_exceptions=True,
+                )
+                failures = [r for r in results if isinstance(r, Exception)]
+                if failures:
+                    # Their subfolders cannot be created, nor jobs copied into them
+                    logging.error(
+                        f"Failed to provision {len(failures)} of {len(batches)} folder "
+                        f"batches: {failures[0]}"
+                    )
+                    raise FolderProvisioningError(
+                        f"Failed to provision destination folders: {failures[0]}"
+                    )
+                self._provisioned.update(path.casefold() for path in level)
+        logging.info(
+            f"Provisioned {total} destination folders in "
+            f"{time.monotonic() - start:.1f}s"
+        )
+        return total
+
+    async def _create_folders(
+        self, session: aiohttp.ClientSession, paths: List[str]
+    ) -> None:
+        """
+        Creates a batch of folders of the same depth with a single $batch request.
+
+        Args:
+            session (aiohttp.ClientSession): The aiohttp session to use for the request.
+            paths (List[str]): The folder paths, relative to the destination folder.
+
+        Raises:
+            FolderProvisioningError: If the request or the creation of a folder fails.
+        """
+        boundary = f"batch_{uuid.uuid4()}"
+        try:
+            response = await self.rate_governor.request(
+                session,
+                "POST",
+                f"{self.site_url}/_api/$batch",
+                headers={
+                    **await self.token_provider.get_headers(),
+                    "Accept": odata.accept_header(self.odata_metadata),
+                    "Content-Type": f"multipart/mixed; boundary={boundary}",
+                },
+                data=self._get_batch_body(boundary, paths).encode("utf-8"),
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            request_log.error("HTTP request failed: %s", e)
+            raise FolderProvisioningError(f"HTTP request failed: {e}")
+        if response.status != 200:
+            raise FolderProvisioningError(
+                f"Failed to create folders {paths}: {response.status} - {response.text()}"
+            )
+        statuses = [
+            int(status) for status in BATCH_STATUS_PATTERN.findall(response.body)
+        ]
+        if len(statuses) != len(paths):
+            raise FolderProvisioningError(
+                f"$batch returned {len(statuses)} responses for {len(paths)} folders"
+            )
+        failed = [path for path, status in zip(paths, statuses) if status >= 300]
+        if failed:
+            raise FolderProvisioningError(
+                f"Failed to create {len(failed)} folders, e.g. {failed[0]}"
+            )
+        request_log.debug("Created %d destination folders", len(paths))
+
+    def _get_batch_body(self, boundary: str, paths: List[str]) -> str:
+        """
+        Builds the body of a $batch request with one Folders.Add request per folder,
+        in a single change set.
+
+        Args:
+            boundary (str): The boundary of the batch.
+            paths (List[str]): The folder paths, relative to the destination folder.
+
+        Returns:
+            str: The multipart body.
+        """
+        changeset = f"changeset_{uuid.uuid4()}"
+        accept = odata.accept_header(self.odata_metadata)
+        lines = [
+            f"--{boundary}",
+            f"Content-Type: multipart/mixed; boundary={changeset}",
+            "",
+        ]
+        for path in paths:
+            server_relative_url = f"{self.root_path}/{path}".replace("'", "''")
+            url = (
+                f"{self.site_url}/_api/web/folders/add("
+                f"'{urllib.parse.quote(server_relative_url, safe='/')}')"
+            )
+            lines += [
+                f"--{changeset}",
+                "Content-Type: application/http",
+                "Content-Transfer-Encoding: binary",
+                "",
+                f"POST {url} HTTP/1.1",
+                f"Accept: {accept}",
+                "",
+            ]
+        lines += [f"--{changeset}--", f"--{boundary}--", ""]
+        return "\r\n".join(lines)
@@ -0,0 +1,220 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+
+from app.exceptions import JobCreationError
+from app.services.folder_filter import (
+    FolderFilter,
+    glob_to_regex,
+    parse_times,
+    to_arrow_strings,
+)
+from app.services.inventory_store import InventoryStore
+
+
+class FolderSelector:
+    """
+    Selects the folders to create copy jobs for: the folders at a level, optionally
+    narrowed down by name patterns, a last modification date, a range of ItemCount
+    and the include and exclude rules of a FolderFilter.
+
+    The selection is vectorized. The level filter is pushed down to the inventory
+    store, which answers it from its Level index (SQLite) or row group statistics
+    (Parquet), only the columns the criteria need are read, and the other criteria
+    are evaluated as boolean masks over whole columns with Arrow compute kernels.
+    matches() applies the same criteria to a single record, e.g. one discovered by
+    the crawl.
+
+    Attributes:
+        level (Optional[int]): The level of the folders to select, or None for all.
+        name_patterns (List[str]): Glob patterns matched case-insensitively against
+            the folder Name; a folder is selected if any pattern matches. Empty to
+            select every name.
+        modified_since (Optional[pd.Timestamp]): Only select folders modified at or
+            after this time.
+        min_item_count (int): The minimum ItemCount of a selected folder.
+        max_item_count (int): The maximum ItemCount of a selected folder, 0 for no limit.
+        folder_filter (Optional[FolderFilter]): Include and exclude rules the selected
+            folders must pass.
+    """
+
+    def __init__(
+        self,
+        level: Optional[int] = None,
+        name_patterns: Optional[Sequence[str]] = None,
+        modified_since: Optional[str] = None,
+        min_item_count: int = 0,
+        max_item_count: int = 0,
+        folder_filter: Optional[FolderFilter] = None,
+    ) -> None:
+        """
+        Initializes the FolderSelector instance and compiles its name patterns.
+
+        Raises:
+            JobCreationError: If modified_since is not a valid date.
+        """
+        self.level = level
+        self.name_patterns = [pattern for pattern in name_patterns or [] if pattern]
+        self.modified_since = None
+        if modified_since:
+            try:
+                self.modified_since = pd.Timestamp(modified_since)
+            except ValueError as e:
+                raise JobCreationError(
+                    f"Invalid modification date {modified_since}: {e}"
+                )
+            if self.modified_since.tzinfo is None:
+                self.modified_since = self.modified_since.tz_localize("UTC")
+        self.min_item_count = min_item_count
+        self.max_item_count = max_item_count
+        self.folder_filter = folder_filter or None
+        # One regular expression for all the patterns, so names are scanned once. It
+        # is written for both Python and RE2, the engine of the Arrow kernels.
+        self._name_pattern = None
+        self._name_regex = None
+        if self.name_patterns:
+            self._name_pattern = "|".join(map(glob_to_regex, self.name_patterns))
+            self._name_regex = re.compile(self._name_pattern, re.IGNORECASE)
+
+    @property
+    def columns(self) -> List[str]:
+        """
+        The inventory columns the criteria are evaluated on.
+        """
+        columns = ["Level"]
+        if self._name_regex is not None:
+            columns.append("Name")
+        if self.modified_since is not None:
+            columns.append("TimeLastModified")
+        if self.min_item_count or self.max_item_count:
+            columns.append("ItemCount")
+        if self.folder_filter is not None:
+            columns += self.folder_filter.columns
+        return list(dict.fromkeys(columns))
+
+    def select(self, store: InventoryStore, columns: List[str]) -> pd.DataFrame:
+        """
+        Reads the selected folders from an inventory.
+
+        Args:
+            store (InventoryStore): The folder inventory.
+            columns (List[str]): The columns to return.
+
+        Returns:
+            pd.DataFrame: The selected folders, with the given columns.
+
+        Raises:
+            InventoryReadError: If the inventory cannot be read.
+        """
+        read_columns = list(dict.fromkeys(columns + self.columns))
+        df = store.read(columns=read_columns, level=self.level)
+        return self.select_frame(df)[columns].reset_index(drop=True)
+
+    def select_frame(self, df: pd.DataFrame, by_level: bool = True) -> pd.DataFrame:
+        """
+        Selects the rows of a DataFrame of folders.
+
+        Args:
+            df (pd.DataFrame): Folder records holding the columns of the criteria.
+            by_level (bool): Whether to also filter by level.
+
+        Returns:
+            pd.DataFrame: The selected rows.
+        """
+        selected = df[self.mask(df, by_level)]
+        if len(selected) < len(df):
+            logging.info(
+                f"Selected {len(selected)} of {len(df)} folders matching "
+                f"{self.describe(by_level)}"
+            )
+        return selected
+
+    def mask(self, df: pd.DataFrame, by_level: bool = True) -> np.ndarray:
+        """
+        Evaluates the criteria over the rows of a DataFrame.
+
+        Args:
+            df (pd.DataFrame): Folder records holding the columns of the criteria.
+            by_level (bool): Whether to also filter by level.
+
+        Returns:
+            np.ndarray: Whether each row is selected.
+        """
+        mask = np.ones(len(df), dtype=bool)
+        if by_level and self.level is not None:
+            mask &= df["Level"].to_numpy() == self.level
+        if self._name_regex is not None:
+            names = to_arrow_strings(df["Name"])
+            matched = pc.match_substring_regex(
+                names, f"^(?:{self._name_pattern})$", ignore_case=True
+            )
+            mask &= pc.fill_null(matched, False).to_numpy(zero_copy_only=False)
+        if self.modified_since is not None:
+            mask &= self._modified_mask(df["TimeLastModified"])
+        if self.min_item_count or self.max_item_count:
+            item_counts = df["ItemCount"].fillna(0).to_numpy(dtype="int64")
+            mask &= item_counts >= self.min_item_count
+            if self.max_item_count:
+                mask &= item_counts <= self.max_item_count
+        if self.folder_filter is not None:
+            mask &= self.folder_filter.mask(df)
+        return mask
+
+    def matches(self, record: Dict[str, Any], by_level: bool = True) -> bool:
+        """
+        Evaluates the criteria on a single folder record.
+
+        Args:
+            record (Dict[str, Any]): The folder record.
+            by_level (bool): Whether to also filter by level.
+
+        Returns:
+            bool: Whether the folder is selected.
+        """
+        if by_level and self.level is not None and record["Level"] != self.level:
+            return False
+        if self._name_regex is not None and not self._name_regex.fullmatch(
+            str(record["Name"])
+        ):
+            return False
+        if self.modified_since is not None:
+            modified = pd.to_datetime(
+                record["TimeLastModified"], utc=True, format="ISO8601", errors="coerce"
+            )
+            if pd.isna(modified) or modified < self.modified_since:
+                return False
+        item_count = int(record["ItemCount"] or 0)
+        if item_count < self.min_item_count:
+            return False
+        if self.max_item_count and item_count > self.max_item_count:
+            return False
+        return self.folder_filter is None or self.folder_filter.matches(record)
+
+    def _modified_mask(self, times: pd.Series) -> np.ndarray:
+        """
+        Compares the TimeLastModified of every row with modified_since.
+        """
+        since = self.modified_since.tz_convert("UTC").tz_localize(None)
+        return parse_times(times) >= since.to_datetime64()
+
+    def describe(self, by_level: bool = True) -> str:
+        """
+        Describes the criteria for log messages.
+        """
+        criteria = []
+        if by_level and self.level is not None:
+            criteria.append(f"Level {self.level}")
+        if self.name_patterns:
+            criteria.append(f"names {', '.join(self.name_patterns)}")
+        if self.modified_since is not None:
+            criteria.append(f"modified since {self.modified_since.isoformat()}")
+        if self.min_item_count or self.max_item_count:
+            upper = self.max_item_count or "any"
+            criteria.append(f"ItemCount {self.min_item_count} to {upper}")
+        if self.folder_filter is not None:
+            criteria.append(self.folder_filter.describe())
+        return ", ".join(criteria) or "all folders"
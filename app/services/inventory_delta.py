@@ -0,0 +1,169 @@
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+
+from app.exceptions import InventoryWriteError
+from app.services.folder_inventory import FolderInventory
+from app.services.inventory_sink import SQLiteSink
+from app.services.inventory_store import InventoryStore
+
+
+class PreviousInventory:
+    """
+    The inventory of a previous crawl, used by an incremental crawl to skip the
+    folders that did not change.
+
+    SharePoint updates the TimeLastModified and ItemCount of a folder only when its
+    direct children are added, removed or renamed, so an unchanged folder says
+    nothing about the folders deeper in its subtree. An unchanged folder is therefore
+    only left unlisted when it had no subfolders: its subfolders are still none, and
+    it is its own whole subtree. A folder with subfolders is listed again, and each
+    of them is checked in turn with its fresh record, so the subtree is only reused
+    where it matches at every level.
+
+    The previous records are kept in a compact FolderInventory, loaded in Level
+    order so parents come before their subfolders.
+
+    Attributes:
+        store (InventoryStore): The previous inventory.
+        skipped (int): The number of unchanged folders not listed again.
+    """
+
+    def __init__(self, store: InventoryStore, unlisted: Iterable[str] = ()) -> None:
+        """
+        Initializes the PreviousInventory instance by loading the previous inventory.
+
+        Args:
+            store (InventoryStore): The previous inventory.
+            unlisted (Iterable[str]): The paths of the folders the previous crawl
+                could not list, e.g. quarantined ones, whose subfolders are unknown.
+
+        Raises:
+            InventoryReadError: If the previous inventory cannot be read.
+        """
+        self.store = store
+        self._unlisted = set(unlisted)
+        df = store.read(columns=SQLiteSink.COLUMNS)
+        df["Path"] = df["Path"].astype(str)
+        df["ParentFolder"] = df["ParentFolder"].fillna("").astype(str)
+        self._inventory = FolderInventory()
+        self._inventory.extend_frame(df.sort_values("Level", kind="stable"))
+        self.skipped = 0
+        logging.info(
+            f"Loaded previous inventory {store.path} with {len(self._inventory)} folders"
+        )
+
+    def find(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the previous record of the folder at the given path, if any.
+        """
+        index = self._inventory.find(path)
+        return None if index is None else self._inventory.record(index)
+
+    def is_unchanged(self, record: Dict[str, Any]) -> bool:
+        """
+        Checks whether a folder is the same as in the previous inventory.
+        """
+        previous = self.find(record["Path"])
+        return (
+            previous is not None
+            and str(previous["UniqueId"]) == str(record["UniqueId"])
+            and str(previous["TimeLastModified"]) == str(record["TimeLastModified"])
+            and int(previous["ItemCount"]) == int(record["ItemCount"])
+        )
+
+    def skip_if_unchanged(self, record: Dict[str, Any]) -> bool:
+        """
+        Checks whether a folder can be left unlisted: it is unchanged and had no
+        subfolders in the previous inventory.
+
+        Args:
+            record (Dict[str, Any]): The freshly fetched record of the folder.
+
+        Returns:
+            bool: Whether the folder does not need to be listed.
+        """
+        index = self._inventory.find(record["Path"])
+        if (
+            index is None
+            or self._inventory.children(index)
+            or record["Path"] in self._unlisted
+            or not self.is_unchanged(record)
+        ):
+            return False
+        self.skipped += 1
+        return True
+
+
+def write_changeset(
+    previous: InventoryStore, current: InventoryStore, file_path: str
+) -> Dict[str, int]:
+    """
+    Compares two inventories by UniqueId and writes the added, removed and modified
+    folders to a JSON Lines file. A folder is modified when its Path (it was renamed
+    or moved), TimeLastModified or ItemCount changed.
+
+    Args:
+        previous (InventoryStore): The inventory of the previous crawl.
+        current (InventoryStore): The inventory of the new crawl.
+        file_path (str): The path to the changeset file.
+
+    Returns:
+        Dict[str, int]: The number of added, removed and modified folders.
+
+    Raises:
+        InventoryReadError: If an inventory cannot be read.
+        InventoryWriteError: If the changeset cannot be written.
+    """
+    columns = [
+        "UniqueId",
+        "Path",
+        "ServerRelativeUrl",
+        "Level",
+        "TimeLastModified",
+        "ItemCount",
+    ]
+    types = {"UniqueId": str, "Level": "Int64", "ItemCount": "Int64"}
+    old = previous.read(columns=columns).astype(types)
+    new = current.read(columns=columns).astype(types)
+    merged = new.merge(
+        old, on="UniqueId", how="outer", suffixes=("", "Previous"), indicator=True
+    )
+
+    compared = ["Path", "TimeLastModified", "ItemCount"]
+    both = merged["_merge"] == "both"
+    modified = both & np.logical_or.reduce(
+        [
+            merged[column].astype(str) != merged[f"{column}Previous"].astype(str)
+            for column in compared
+        ]
+    )
+    merged["Change"] = None
+    merged.loc[merged["_merge"] == "left_only", "Change"] = "added"
+    merged.loc[merged["_merge"] == "right_only", "Change"] = "removed"
+    merged.loc[modified, "Change"] = "modified"
+
+    changes = merged[merged["Change"].notna()].drop(columns="_merge")
+    removed = changes["Change"] == "removed"
+    for column in columns[1:]:
+        changes.loc[removed, column] = changes.loc[removed, f"{column}Previous"]
+    changes = changes[
+        ["Change"] + columns + [f"{column}Previous" for column in compared]
+    ]
+
+    try:
+        changes.to_json(file_path, orient="records", lines=True, force_ascii=False)
+    except Exception as e:
+        logging.error(f"Failed to write changeset {file_path}: {e}")
+        raise InventoryWriteError(f"Failed to write changeset {file_path}: {e}")
+
+    summary = {
+        change: int((changes["Change"] == change).sum())
+        for change in ("added", "removed", "modified")
+    }
+    logging.info(
+        f"Changeset written to {file_path}: {summary['added']} added, "
+        f"{summary['removed']} removed, {summary['modified']} modified"
+    )
+    return summary
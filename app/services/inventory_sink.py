@@ -0,0 +1,281 @@
+import glob
+import json
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, TextIO
+
+import pandas as pd
+
+from app.exceptions import InventoryWriteError
+
+
+class InventorySink(ABC):
+    """
+    Base class of the append-only sinks that receive folder records while the crawl runs.
+
+    Attributes:
+        count (int): The number of records written so far.
+
+    Methods
+    -------
+    write(record: Dict[str, Any]) -> None:
+        Appends a folder record to the sink.
+    flush() -> None:
+        Makes the records written so far durable.
+    close() -> None:
+        Flushes and releases the sink.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    @abstractmethod
+    def write(self, record: Dict[str, Any]) -> None:
+        """
+        Appends a folder record to the sink.
+        """
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "InventorySink":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class JsonLinesSink(InventorySink):
+    """
+    A sink that appends one JSON object per folder to a JSON Lines file. The file is
+    flushed every flush_every records, so an interrupted crawl leaves usable output.
+
+    Attributes:
+        file_path (str): The path to the JSON Lines file.
+        flush_every (int): The number of records between flushes.
+    """
+
+    def __init__(self, file_path: str, flush_every: int = 1000) -> None:
+        """
+        Initializes the JsonLinesSink instance and opens the file for appending.
+
+        Raises:
+            InventoryWriteError: If the file cannot be opened.
+        """
+        super().__init__()
+        self.file_path = file_path
+        self.flush_every = max(1, flush_every)
+        try:
+            self._file: Optional[TextIO] = open(file_path, "a", encoding="utf-8")
+        except OSError as e:
+            logging.error(f"Failed to open inventory file {file_path}: {e}")
+            raise InventoryWriteError(f"Failed to open inventory file {file_path}: {e}")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetSink(InventorySink):
+    """
+    A sink that writes folder records to a directory of Parquet part files, one per
+    chunk. Each part is written to a temporary name and renamed when complete, so an
+    interrupted crawl leaves only readable parts behind.
+
+    Attributes:
+        directory (str): The directory holding the part files.
+        chunk_size (int): The number of records per part file.
+    """
+
+    def __init__(self, directory: str, chunk_size: int = 50000) -> None:
+        """
+        Initializes the ParquetSink instance and creates the output directory.
+
+        Raises:
+            InventoryWriteError: If the directory cannot be created.
+        """
+        super().__init__()
+        self.directory = directory
+        self.chunk_size = max(1, chunk_size)
+        self._buffer: List[Dict[str, Any]] = []
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            logging.error(f"Failed to create inventory directory {directory}: {e}")
+            raise InventoryWriteError(
+                f"Failed to create inventory directory {directory}: {e}"
+            )
+        self._part = len(glob.glob(os.path.join(directory, "part-*.parquet")))
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._buffer.append(record)
+        self.count += 1
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the buffered records as a new part file.
+
+        Raises:
+            InventoryWriteError: If the part file cannot be written.
+        """
+        if not self._buffer:
+            return
+        part_path = os.path.join(self.directory, f"part-{self._part:05d}.parquet")
+        try:
+            pd.DataFrame(self._buffer).to_parquet(f"{part_path}.tmp", index=False)
+            os.replace(f"{part_path}.tmp", part_path)
+        except Exception as e:
+            logging.error(f"Failed to write inventory part {part_path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to write inventory part {part_path}: {e}"
+            )
+        self._part += 1
+        self._buffer = []
+
+
+class SQLiteSink(InventorySink):
+    """
+    A sink that inserts folder records into the folders table of a SQLite database in
+    batches, committing each batch so an interrupted crawl leaves usable output. The
+    Level, ParentFolder and ServerRelativeUrl indexes are built when the sink closes.
+
+    Attributes:
+        db_path (str): The path to the SQLite database.
+        batch_size (int): The number of records inserted per transaction.
+    """
+
+    COLUMNS = [
+        "Name",
+        "Path",
+        "ParentFolder",
+        "Level",
+        "TimeCreated",
+        "TimeLastModified",
+        "ItemCount",
+        "ServerRelativeUrl",
+        "UniqueId",
+    ]
+
+    def __init__(self, db_path: str, batch_size: int = 10000) -> None:
+        """
+        Initializes the SQLiteSink instance and creates the folders table.
+
+        Raises:
+            InventoryWriteError: If the database cannot be opened.
+        """
+        super().__init__()
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self._buffer: List[tuple] = []
+        try:
+            self._connection: Optional[sqlite3.Connection] = sqlite3.connect(db_path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS folders ("
+                "Name TEXT, Path TEXT, ParentFolder TEXT, Level INTEGER, "
+                "TimeCreated TEXT, TimeLastModified TEXT, ItemCount INTEGER, "
+                "ServerRelativeUrl TEXT, UniqueId TEXT)"
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Failed to open inventory database {db_path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to open inventory database {db_path}: {e}"
+            )
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._buffer.append(tuple(record[column] for column in self.COLUMNS))
+        self.count += 1
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Inserts the buffered records in one transaction.
+
+        Raises:
+            InventoryWriteError: If the records cannot be inserted.
+        """
+        if not self._buffer or self._connection is None:
+            return
+        try:
+            with self._connection:
+                self._connection.executemany(
+                    f"INSERT INTO folders VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                    self._buffer,
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write inventory database {self.db_path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to write inventory database {self.db_path}: {e}"
+            )
+        self._buffer = []
+
+    def close(self) -> None:
+        if self._connection is None:
+            return
+        self.flush()
+        with self._connection:
+            for column in ("Level", "ParentFolder", "ServerRelativeUrl"):
+                self._connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_folders_{column.lower()} "
+                    f"ON folders ({column})"
+                )
+        self._connection.close()
+        self._connection = None
+
+
+class ExcelSink(InventorySink):
+    """
+    A sink that buffers folder records and writes them to an Excel file when closed.
+    It exists for compatibility with Excel inventories and does not stream.
+
+    Attributes:
+        file_path (str): The path to the Excel file.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        super().__init__()
+        self.file_path = file_path
+        self._buffer: List[Dict[str, Any]] = []
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._buffer.append(record)
+        self.count += 1
+
+    def close(self) -> None:
+        """
+        Writes the buffered records to the Excel file.
+
+        Raises:
+            InventoryWriteError: If the Excel file cannot be written.
+        """
+        try:
+            with pd.ExcelWriter(self.file_path, engine="openpyxl") as writer:
+                pd.DataFrame(self._buffer).to_excel(
+                    writer, index=False, sheet_name="Folders"
+                )
+        except Exception as e:
+            logging.error(f"Failed to write inventory file {self.file_path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to write inventory file {self.file_path}: {e}"
+            )
+        self._buffer = []
@@ -0,0 +1,391 @@
+import glob
+import logging
+import os
+import shutil
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from app.exceptions import InventoryReadError, InventoryWriteError
+from app.services.inventory_sink import (
+    ExcelSink,
+    InventorySink,
+    JsonLinesSink,
+    ParquetSink,
+    SQLiteSink,
+)
+
+
+class InventoryStore(ABC):
+    """
+    Base class of the pluggable folder inventory backends.
+
+    A crawl writes into a partial copy of the inventory, which replaces the final one
+    only when commit() is called, so an interrupted crawl never looks complete.
+
+    Attributes:
+        path (str): The path to the inventory file or directory.
+
+    Methods
+    -------
+    exists() -> bool:
+        Returns whether a complete inventory exists.
+    open_writer(resume_records: Optional[int] = None) -> InventorySink:
+        Returns a sink writing a new partial inventory, or appending to the partial
+        inventory of an interrupted crawl.
+    commit() -> None:
+        Replaces the inventory with the partial one.
+    reopen() -> int:
+        Turns the inventory back into a partial one a crawl can append to.
+    read(columns: Optional[List[str]] = None, level: Optional[int] = None) -> pd.DataFrame:
+        Reads the inventory, optionally projected to some columns and filtered by level.
+    read_batches(columns: Optional[List[str]] = None, batch_size: int = 100000) -> Iterator[pd.DataFrame]:
+        Reads the inventory in batches of records, so memory stays bounded.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @property
+    def partial_path(self) -> str:
+        root, extension = os.path.splitext(self.path)
+        return f"{root}.partial{extension}"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def open_writer(self, resume_records: Optional[int] = None) -> InventorySink:
+        """
+        Removes any previous partial inventory and returns a sink writing a new one.
+        When resuming, the partial inventory is kept instead, truncated to the records
+        accounted for by the crawl checkpoint, and the sink appends to it.
+
+        Args:
+            resume_records (Optional[int]): The number of records of the checkpoint to
+                resume from, or None to start a new inventory.
+
+        Returns:
+            InventorySink: The sink receiving the folder records.
+
+        Raises:
+            InventoryWriteError: If the partial inventory cannot be resumed.
+        """
+        if resume_records is None:
+            self._remove(self.partial_path)
+            return self._create_sink(self.partial_path)
+
+        try:
+            kept = self._truncate(self.partial_path, resume_records)
+        except InventoryWriteError:
+            raise
+        except Exception as e:
+            logging.error(f"Failed to resume inventory {self.partial_path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to resume inventory {self.partial_path}: {e}"
+            )
+        if kept != resume_records:
+            raise InventoryWriteError(
+                f"Partial inventory {self.partial_path} holds {kept} records, "
+                f"the crawl checkpoint expects {resume_records}"
+            )
+        sink = self._create_sink(self.partial_path)
+        sink.count = resume_records
+        logging.info(
+            f"Resuming inventory {self.partial_path} after {resume_records} records"
+        )
+        return sink
+
+    def commit(self) -> None:
+        """
+        Replaces the inventory with the partial one written by the last writer.
+
+        Raises:
+            InventoryWriteError: If the partial inventory cannot be moved in place.
+        """
+        try:
+            self._remove(self.path)
+            os.replace(self.partial_path, self.path)
+        except OSError as e:
+            logging.error(f"Failed to commit inventory {self.path}: {e}")
+            raise InventoryWriteError(f"Failed to commit inventory {self.path}: {e}")
+        logging.info(f"Inventory committed to {self.path}")
+
+    def reopen(self) -> int:
+        """
+        Moves the inventory back to the partial path, so a crawl can append to it with
+        open_writer(), e.g. to list the quarantined folders again. The inventory is
+        committed again when that crawl finishes.
+
+        Returns:
+            int: The number of records of the inventory, to pass to open_writer().
+
+        Raises:
+            InventoryReadError: If the inventory cannot be read.
+            InventoryWriteError: If the backend cannot append to an inventory or the
+                inventory cannot be moved.
+        """
+        records = len(self.read(columns=["Level"]))
+        # Truncating to every record changes nothing, but fails before the move for
+        # the backends that cannot append.
+        self._truncate(self.path, records)
+        try:
+            self._remove(self.partial_path)
+            os.replace(self.path, self.partial_path)
+        except OSError as e:
+            logging.error(f"Failed to reopen inventory {self.path}: {e}")
+            raise InventoryWriteError(f"Failed to reopen inventory {self.path}: {e}")
+        logging.info(f"Inventory {self.path} reopened with {records} records")
+        return records
+
+    def read(
+        self, columns: Optional[List[str]] = None, level: Optional[int] = None
+    ) -> pd.DataFrame:
+        """
+        Reads the inventory.
+
+        Args:
+            columns (Optional[List[str]]): The columns to read, or None for all.
+            level (Optional[int]): Only read folders at this level, or None for all.
+
+        Returns:
+            pd.DataFrame: The folder records.
+
+        Raises:
+            InventoryReadError: If the inventory cannot be read.
+        """
+        try:
+            return self._read(columns, level)
+        except Exception as e:
+            logging.error(f"Failed to read inventory {self.path}: {e}")
+            raise InventoryReadError(f"Failed to read inventory {self.path}: {e}")
+
+    def read_batches(
+        self, columns: Optional[List[str]] = None, batch_size: int = 100000
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Reads the inventory in batches of about batch_size records.
+
+        Args:
+            columns (Optional[List[str]]): The columns to read, or None for all.
+            batch_size (int): The number of records per batch.
+
+        Yields:
+            pd.DataFrame: The folder records of each batch.
+
+        Raises:
+            InventoryReadError: If the inventory cannot be read.
+        """
+        try:
+            yield from self._read_batches(columns, batch_size)
+        except Exception as e:
+            logging.error(f"Failed to read inventory {self.path}: {e}")
+            raise InventoryReadError(f"Failed to read inventory {self.path}: {e}")
+
+    @abstractmethod
+    def _create_sink(self, path: str) -> InventorySink:
+        """
+        Creates the sink writing the records of a crawl to the given path.
+        """
+
+    @abstractmethod
+    def _read(self, columns: Optional[List[str]], level: Optional[int]) -> pd.DataFrame:
+        """
+        Reads the folder records of the inventory, see read().
+        """
+
+    def _read_batches(
+        self, columns: Optional[List[str]], batch_size: int
+    ) -> Iterator[pd.DataFrame]:
+        yield self._read(columns, None)
+
+    def _truncate(self, path: str, records: int) -> int:
+        """
+        Drops the records written after the first ones of a partial inventory.
+
+        Returns:
+            int: The number of records kept.
+        """
+        raise InventoryWriteError(
+            f"The {type(self).__name__} backend cannot resume an interrupted crawl"
+        )
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def _filter(
+        df: pd.DataFrame, columns: Optional[List[str]], level: Optional[int]
+    ) -> pd.DataFrame:
+        if level is not None:
+            df = df[df["Level"] == level]
+        return df[columns] if columns else df
+
+
+class SQLiteInventoryStore(InventoryStore):
+    """
+    An inventory stored in a SQLite database, indexed on Level, ParentFolder and
+    ServerRelativeUrl. Reads only fetch the requested columns and rows.
+    """
+
+    def _create_sink(self, path: str) -> InventorySink:
+        return SQLiteSink(path)
+
+    def _read(self, columns: Optional[List[str]], level: Optional[int]) -> pd.DataFrame:
+        projection = ", ".join(columns) if columns else "*"
+        query = f"SELECT {projection} FROM folders"
+        params: tuple = ()
+        if level is not None:
+            query += " WHERE Level = ?"
+            params = (level,)
+        with sqlite3.connect(self.path) as connection:
+            return pd.read_sql_query(query, connection, params=params)
+
+    def _read_batches(
+        self, columns: Optional[List[str]], batch_size: int
+    ) -> Iterator[pd.DataFrame]:
+        projection = ", ".join(columns) if columns else "*"
+        connection = sqlite3.connect(self.path)
+        try:
+            yield from pd.read_sql_query(
+                f"SELECT {projection} FROM folders", connection, chunksize=batch_size
+            )
+        finally:
+            connection.close()
+
+    def _truncate(self, path: str, records: int) -> int:
+        if not os.path.exists(path):
+            return 0
+        connection = sqlite3.connect(path)
+        try:
+            with connection:
+                # Rows are only ever appended, so rowids follow the write order.
+                connection.execute("DELETE FROM folders WHERE rowid > ?", (records,))
+            return connection.execute("SELECT COUNT(*) FROM folders").fetchone()[0]
+        finally:
+            connection.close()
+
+
+class ParquetInventoryStore(InventoryStore):
+    """
+    An inventory stored as a directory of Parquet part files. Reads only decode the
+    requested columns, and level filters are pushed down to the row group statistics;
+    the breadth-first crawl writes folders roughly in Level order, so most row groups
+    are skipped.
+    """
+
+    def _create_sink(self, path: str) -> InventorySink:
+        return ParquetSink(path)
+
+    def _read(self, columns: Optional[List[str]], level: Optional[int]) -> pd.DataFrame:
+        filters = [("Level", "==", level)] if level is not None else None
+        return pd.read_parquet(self.path, columns=columns, filters=filters)
+
+    def _read_batches(
+        self, columns: Optional[List[str]], batch_size: int
+    ) -> Iterator[pd.DataFrame]:
+        for part_path in sorted(glob.glob(os.path.join(self.path, "part-*.parquet"))):
+            for batch in pq.ParquetFile(part_path).iter_batches(
+                batch_size, columns=columns
+            ):
+                yield batch.to_pandas()
+
+    def _truncate(self, path: str, records: int) -> int:
+        kept = 0
+        for part_path in sorted(glob.glob(os.path.join(path, "part-*.parquet"))):
+            rows = pq.ParquetFile(part_path).metadata.num_rows
+            if kept + rows <= records:
+                kept += rows
+            elif kept < records:
+                pd.read_parquet(part_path).head(records - kept).to_parquet(
+                    part_path, index=False
+                )
+                kept = records
+            else:
+                os.remove(part_path)
+        for temporary_path in glob.glob(os.path.join(path, "*.tmp")):
+            os.remove(temporary_path)
+        return kept
+
+
+class JsonLinesInventoryStore(InventoryStore):
+    """
+    An inventory stored as a JSON Lines file.
+    """
+
+    def _create_sink(self, path: str) -> InventorySink:
+        return JsonLinesSink(path)
+
+    def _read(self, columns: Optional[List[str]], level: Optional[int]) -> pd.DataFrame:
+        df = pd.read_json(self.path, lines=True, dtype=False)
+        return self._filter(df, columns, level)
+
+    def _read_batches(
+        self, columns: Optional[List[str]], batch_size: int
+    ) -> Iterator[pd.DataFrame]:
+        with pd.read_json(
+            self.path, lines=True, dtype=False, chunksize=batch_size
+        ) as reader:
+            for df in reader:
+                yield self._filter(df, columns, None)
+
+    def _truncate(self, path: str, records: int) -> int:
+        if not os.path.exists(path):
+            return 0
+        kept = 0
+        with open(path, "r+b") as file:
+            while kept < records and file.readline().endswith(b"\n"):
+                kept += 1
+            if kept == records:
+                file.truncate()
+        return kept
+
+
+class ExcelInventoryStore(InventoryStore):
+    """
+    An inventory stored in the Folders sheet of an Excel file. It is kept to read
+    inventories produced by earlier versions and is limited to 1,048,575 folders.
+    """
+
+    def _create_sink(self, path: str) -> InventorySink:
+        return ExcelSink(path)
+
+    def _read(self, columns: Optional[List[str]], level: Optional[int]) -> pd.DataFrame:
+        usecols = columns
+        if columns and level is not None and "Level" not in columns:
+            usecols = columns + ["Level"]
+        df = pd.read_excel(self.path, sheet_name="Folders", usecols=usecols)
+        return self._filter(df, columns, level)
+
+
+INVENTORY_BACKENDS = {
+    "sqlite": SQLiteInventoryStore,
+    "parquet": ParquetInventoryStore,
+    "jsonl": JsonLinesInventoryStore,
+    "excel": ExcelInventoryStore,
+}
+
+
+def create_inventory_store(backend: str, path: str) -> InventoryStore:
+    """
+    Creates the inventory store for the given backend.
+
+    Args:
+        backend (str): One of "sqlite", "parquet", "jsonl" or "excel".
+        path (str): The path to the inventory file or directory.
+
+    Returns:
+        InventoryStore: The inventory store.
+
+    Raises:
+        InventoryReadError: If the backend is not supported.
+    """
+    if backend not in INVENTORY_BACKENDS:
+        raise InventoryReadError(f"Unsupported inventory backend: {backend}")
+    return INVENTORY_BACKENDS[backend](path)
@@ -0,0 +1,203 @@
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.exceptions import JobLedgerError
+
+
+class JobLedger:
+    """
+    A persistent ledger of the copy jobs submitted for each source folder, so that a
+    rerun only submits the folders whose job is missing or failed instead of creating
+    every job again.
+
+    Jobs are keyed by (destination_uri, source_uri). A job is recorded as created as
+    soon as its CreateCopyJobs call succeeds, as failed when the call fails, and as
+    completed or failed once it has been monitored to the end. Rows of a destination
+    are read with one query on the primary key, and the job_id index serves the
+    updates of the monitor.
+
+    Attributes:
+        db_path (str): The path to the SQLite database.
+    """
+
+    CREATED = "created"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    # States whose source folder must not be submitted again.
+    SUBMITTED_STATES = (CREATED, COMPLETED)
+
+    def __init__(self, db_path: str) -> None:
+        """
+        Initializes the JobLedger instance and creates the copy_jobs table.
+
+        Raises:
+            JobLedgerError: If the database cannot be opened.
+        """
+        self.db_path = db_path
+        try:
+            self._connection: Optional[sqlite3.Connection] = sqlite3.connect(db_path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS copy_jobs ("
+                "destination_uri TEXT NOT NULL, source_uri TEXT NOT NULL, "
+                "job_id TEXT, job_queue_uri TEXT, encryption_key TEXT, "
+                "state TEXT NOT NULL, error TEXT, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (destination_uri, source_uri)) WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_copy_jobs_job_id ON copy_jobs (job_id)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_copy_jobs_state "
+                "ON copy_jobs (destination_uri, state)"
+            )
+            self._connection.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to open job ledger {db_path}: {e}")
+            raise JobLedgerError(f"Failed to open job ledger {db_path}: {e}")
+
+    def lookup(self, destination_uri: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the recorded job of every source folder copied to a destination.
+
+        Args:
+            destination_uri (str): The destination URI of the copy jobs.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: The job of each source URI, with its SourceUri,
+                JobId, JobQueueUri, EncryptionKey and State.
+
+        Raises:
+            JobLedgerError: If the ledger cannot be read.
+        """
+        try:
+            rows = self._connection.execute(
+                "SELECT source_uri, job_id, job_queue_uri, encryption_key, state "
+                "FROM copy_jobs WHERE destination_uri = ?",
+                (destination_uri,),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read job ledger {self.db_path}: {e}")
+            raise JobLedgerError(f"Failed to read job ledger {self.db_path}: {e}")
+        return {
+            row[0]: {
+                "SourceUri": row[0],
+                "JobId": row[1],
+                "JobQueueUri": row[2],
+                "EncryptionKey": row[3],
+                "State": row[4],
+            }
+            for row in rows
+        }
+
+    def record_created(
+        self, destination_uri: str, jobs: Iterable[Dict[str, Any]]
+    ) -> None:
+        """
+        Records the jobs returned by a successful CreateCopyJobs call.
+
+        Args:
+            destination_uri (str): The destination URI of the copy jobs.
+            jobs (Iterable[Dict[str, Any]]): The jobs, as returned by CopyJobsCreator.
+
+        Raises:
+            JobLedgerError: If the ledger cannot be written.
+        """
+        now = time.time()
+        self._upsert(
+            [
+                (
+                    destination_uri,
+                    job["SourceUri"],
+                    job.get("JobId"),
+                    job.get("JobQueueUri"),
+                    job.get("EncryptionKey"),
+                    self.CREATED,
+                    None,
+                    now,
+                )
+                for job in jobs
+            ]
+        )
+
+    def record_failed(
+        self, destination_uri: str, source_uris: Iterable[str], error: str
+    ) -> None:
+        """
+        Records the source folders whose CreateCopyJobs call failed.
+
+        Args:
+            destination_uri (str): The destination URI of the copy jobs.
+            source_uris (Iterable[str]): The source URIs of the failed call.
+            error (str): The error of the call.
+
+        Raises:
+            JobLedgerError: If the ledger cannot be written.
+        """
+        now = time.time()
+        self._upsert(
+            [
+                (destination_uri, uri, None, None, None, self.FAILED, error, now)
+                for uri in source_uris
+            ]
+        )
+
+    def record_outcomes(self, outcomes: Dict[str, bool]) -> None:
+        """
+        Records the final state of monitored jobs.
+
+        Args:
+            outcomes (Dict[str, bool]): Whether each job ID ended in failure.
+
+        Raises:
+            JobLedgerError: If the ledger cannot be written.
+        """
+        now = time.time()
+        self._execute_many(
+            "UPDATE copy_jobs SET state = ?, updated_at = ? WHERE job_id = ?",
+            [
+                (self.FAILED if failed else self.COMPLETED, now, job_id)
+                for job_id, failed in outcomes.items()
+            ],
+        )
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self) -> "JobLedger":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def _upsert(self, rows: List[tuple]) -> None:
+        self._execute_many(
+            "INSERT INTO copy_jobs (destination_uri, source_uri, job_id, job_queue_uri, "
+            "encryption_key, state, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (destination_uri, source_uri) DO UPDATE SET "
+            "job_id = excluded.job_id, job_queue_uri = excluded.job_queue_uri, "
+            "encryption_key = excluded.encryption_key, state = excluded.state, "
+            "error = excluded.error, updated_at = excluded.updated_at",
+            rows,
+        )
+
+    def _execute_many(self, statement: str, rows: List[tuple]) -> None:
+        """
+        Runs a statement for each row in one transaction.
+
+        Raises:
+            JobLedgerError: If the ledger cannot be written.
+        """
+        if not rows:
+            return
+        try:
+            with self._connection:
+                self._connection.executemany(statement, rows)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write job ledger {self.db_path}: {e}")
+            raise JobLedgerError(f"Failed to write job ledger {self.db_path}: {e}")
@@ -0,0 +1,114 @@
+import logging
+from typing import List, Optional
+
+import pandas as pd
+
+from app.services.inventory_store import InventoryStore
+
+
+class JobPartitioner:
+    """
+    A planner that cuts the folder tree into copy jobs of bounded size instead of
+    taking every folder at a fixed level.
+
+    The size of a subtree is the sum of the ItemCount of its folders, i.e. the number
+    of files and folders below it. A folder whose subtree holds at most max_items
+    items becomes one job. A larger folder is split: it gets a job of its own with
+    ExcludeChildren for its files, and its subfolders are planned the same way one
+    level down. A folder without subfolders cannot be split and becomes one job even
+    above the limit.
+
+    Jobs are returned largest first, so the longest jobs start first and the parallel
+    migration finishes as early as possible.
+
+    Attributes:
+        max_items (int): The maximum number of items per job.
+    """
+
+    COLUMNS = ["Path", "ParentFolder", "Level", "ItemCount", "ServerRelativeUrl"]
+
+    def __init__(self, max_items: int) -> None:
+        self.max_items = max(1, max_items)
+
+    def plan(
+        self, store: InventoryStore, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """
+        Plans the copy jobs of an inventory.
+
+        Args:
+            store (InventoryStore): The folder inventory.
+            columns (Optional[List[str]]): Other columns of the folders to keep, e.g.
+                to select among the jobs.
+
+        Returns:
+            pd.DataFrame: One row per job with the Path, ParentFolder, Level and
+                ServerRelativeUrl of its folder and the other columns requested, its
+                ItemCount (the number of items the job copies) and whether it uses
+                ExcludeChildren.
+
+        Raises:
+            InventoryReadError: If the inventory cannot be read.
+        """
+        extra_columns = [
+            column for column in columns or [] if column not in self.COLUMNS
+        ]
+        df = store.read(columns=self.COLUMNS + extra_columns)
+        df["ParentFolder"] = df["ParentFolder"].fillna("").astype(str)
+        df["ItemCount"] = df["ItemCount"].fillna(0).astype("int64")
+        df.index = pd.Index(df["Path"].astype(str).to_numpy())
+        df["Subfolders"] = (
+            df.groupby("ParentFolder").size().reindex(df.index, fill_value=0)
+        )
+
+        # Roll the item counts up from the deepest level, so each folder holds the
+        # size of its subtree once all of its descendants have been added.
+        df["Subtree"] = df["ItemCount"]
+        for level in sorted(df["Level"].unique(), reverse=True)[:-1]:
+            sizes = (
+                df.loc[df["Level"] == level].groupby("ParentFolder")["Subtree"].sum()
+            )
+            sizes = sizes[sizes.index.isin(df.index)]
+            df.loc[sizes.index, "Subtree"] = df.loc[sizes.index, "Subtree"] + sizes
+
+        jobs = []
+        candidates = df[df["Level"] == df["Level"].min()] if len(df) else df
+        split_count = 0
+        while len(candidates):
+            whole = (candidates["Subtree"] <= self.max_items) | (
+                candidates["Subfolders"] == 0
+            )
+            jobs.append(
+                candidates[whole].assign(
+                    ItemCount=candidates.loc[whole, "Subtree"], ExcludeChildren=False
+                )
+            )
+            split = candidates[~whole]
+            # The job of a split folder copies its files, i.e. its items that are
+            # not subfolders.
+            jobs.append(
+                split.assign(
+                    ItemCount=(split["ItemCount"] - split["Subfolders"]).clip(lower=0),
+                    ExcludeChildren=True,
+                )
+            )
+            split_count += len(split)
+            candidates = df[df["ParentFolder"].isin(split.index)]
+
+        plan = pd.concat(jobs) if jobs else df.assign(ExcludeChildren=False)
+        plan = plan.sort_values("ItemCount", ascending=False, kind="stable")
+        plan = plan[self.COLUMNS + extra_columns + ["ExcludeChildren"]].reset_index(
+            drop=True
+        )
+
+        oversized = int((plan["ItemCount"] > self.max_items).sum())
+        if oversized:
+            logging.warning(
+                f"{oversized} copy jobs exceed {self.max_items} items because their "
+                f"folder holds more files than that directly"
+            )
+        logging.info(
+            f"Planned {len(plan)} copy jobs of at most {self.max_items} items "
+            f"from {len(df)} folders, splitting {split_count} folders"
+        )
+        return plan
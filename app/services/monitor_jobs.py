@@ -0,0 +1,367 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from app.auth.token_provider import TokenProvider
+from app.exceptions import JobMonitoringError
+from app.services.job_ledger import JobLedger
+from app.utils import odata
+from app.utils.http_session import PooledSession
+from app.utils.log_handlers import request_log
+from app.utils.rate_governor import Governor, RateGovernor
+
+
+class CopyJobStatus:
+    """
+    The progress of a single copy job, rolled up from its GetCopyJobProgress logs.
+
+    Attributes:
+        source_uri (str): The origin URL of the copy job.
+        job_id (str): The ID of the copy job.
+        job_queue_uri (str): The queue URI of the copy job.
+        encryption_key (Optional[str]): The encryption key returned with the job.
+        state (Optional[int]): The last JobState reported (0 once the job left the queue).
+        objects_processed (int): The number of objects processed so far.
+        bytes_processed (int): The number of bytes processed so far.
+        errors (int): The number of errors reported so far.
+        finished (bool): Whether the job has finished.
+        failed (bool): Whether the job ended with a fatal error or could not be polled.
+        interval (float): The current polling interval in seconds.
+        poll_failures (int): The number of consecutive failed polls.
+    """
+
+    def __init__(self, job: Dict[str, Any], interval: float) -> None:
+        self.source_uri = job.get("SourceUri", "")
+        self.job_id = job["JobId"]
+        self.job_queue_uri = job["JobQueueUri"]
+        self.encryption_key = job.get("EncryptionKey")
+        self.state: Optional[int] = None
+        self.objects_processed = 0
+        self.bytes_processed = 0
+        self.errors = 0
+        self.finished = False
+        self.failed = False
+        self.interval = interval
+        self.poll_failures = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "SourceUri": self.source_uri,
+            "JobId": self.job_id,
+            "JobState": self.state,
+            "ObjectsProcessed": self.objects_processed,
+            "BytesProcessed": self.bytes_processed,
+            "Errors": self.errors,
+            "Finished": self.finished,
+            "Failed": self.failed,
+        }
+
+
+class CopyJobsMonitor:
+    """
+    A class to monitor copy jobs through GetCopyJobProgress until they finish.
+
+    Jobs are polled from a schedule ordered by due time. A job whose progress changed
+    is polled again after min_interval; an idle job waits backoff_factor times longer
+    after every unchanged poll, up to max_interval. Due jobs are polled in batches of
+    at most batch_size requests, paced to max_requests_per_second and sent through
+    the shared rate governor.
+
+    Attributes:
+        token_provider (TokenProvider): The provider of the current access token.
+        tenant_name (str): The tenant name of the SharePoint site.
+        aiohttp_limit (int): The connection limit for aiohttp.
+        min_interval (float): Seconds between polls of an active job.
+        max_interval (float): Maximum seconds between polls of an idle job.
+        backoff_factor (float): The factor applied to the interval of an idle job.
+        batch_size (int): The maximum number of jobs polled per batch.
+        max_requests_per_second (float): The maximum polling rate.
+        progress_interval (float): Seconds between global progress reports.
+        rate_governor (Governor): The shared governor of SharePoint requests.
+        tenant_url (str): The root URL of the tenant.
+        job_ledger (Optional[JobLedger]): The ledger the final state of each finished
+            job is recorded in, so a rerun resubmits the folders of failed jobs.
+        odata_metadata (str): The OData metadata level of the responses.
+    """
+
+    FAILURE_EVENTS = ("JobFatalError", "JobCancelled")
+    MAX_POLL_FAILURES = 10
+
+    def __init__(
+        self,
+        token_provider: TokenProvider,
+        tenant_name: str,
+        aiohttp_limit: int,
+        min_interval: float = 5.0,
+        max_interval: float = 300.0,
+        backoff_factor: float = 2.0,
+        batch_size: int = 50,
+        max_requests_per_second: float = 10.0,
+        progress_interval: float = 60.0,
+        rate_governor: Optional[Governor] = None,
+        tenant_url: Optional[str] = None,
+        job_ledger: Optional[JobLedger] = None,
+        odata_metadata: str = "nometadata",
+    ) -> None:
+        """
+        Initializes the CopyJobsMonitor instance with its polling policy.
+        """
+        self.token_provider = token_provider
+        self.tenant_name = tenant_name
+        self.tenant_url = tenant_url or f"https://{tenant_name}.sharepoint.com"
+        self.aiohttp_limit = aiohttp_limit
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff_factor = backoff_factor
+        self.batch_size = max(1, batch_size)
+        self.max_requests_per_second = max_requests_per_second
+        self.progress_interval = progress_interval
+        self.rate_governor = rate_governor or RateGovernor(aiohttp_limit)
+        self.job_ledger = job_ledger
+        self.odata_metadata = odata_metadata
+
+    async def monitor(self, jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Polls the given copy jobs until all of them have finished.
+
+        Args:
+            jobs (List[Dict[str, Any]]): The jobs returned by CopyJobsCreator.create_copy_jobs.
+
+        Returns:
+            Dict[str, Any]: The global progress and the progress of each job.
+
+        Raises:
+            JobMonitoringError: If there is an unexpected error while monitoring.
+            JobLedgerError: If the final job states cannot be recorded.
+        """
+        statuses = self._unique_jobs(jobs)
+        logging.info(f"Monitoring {len(statuses)} copy jobs")
+        counter = itertools.count()
+        schedule: List[Tuple[float, int, CopyJobStatus]] = [
+            (time.monotonic(), next(counter), status) for status in statuses
+        ]
+        heapq.heapify(schedule)
+        next_report = time.monotonic() + self.progress_interval
+
+        try:
+            async with PooledSession(
+                max(self.aiohttp_limit, self.rate_governor.max_concurrency)
+            ) as session:
+                while schedule:
+                    delay = schedule[0][0] - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                    now = time.monotonic()
+                    batch = []
+                    while (
+                        schedule
+                        and schedule[0][0] <= now
+                        and len(batch) < self.batch_size
+                    ):
+                        batch.append(heapq.heappop(schedule)[2])
+
+                    started = time.monotonic()
+                    await asyncio.gather(
+                        *(self._poll(session, status) for status in batch)
+                    )
+                    for status in batch:
+                        if not status.finished:
+                            heapq.heappush(
+                                schedule,
+                                (
+                                    time.monotonic() + status.interval,
+                                    next(counter),
+                                    status,
+                                ),
+                            )
+
+                    if time.monotonic() >= next_report:
+                        self._log_progress(statuses)
+                        next_report = time.monotonic() + self.progress_interval
+
+                    # Pace the batches to the configured request rate.
+                    pacing = len(batch) / self.max_requests_per_second
+                    remaining = pacing - (time.monotonic() - started)
+                    if remaining > 0:
+                        await asyncio.sleep(remaining)
+        except Exception as e:
+            logging.error(f"Copy job monitoring failed: {e}")
+            raise JobMonitoringError(f"Copy job monitoring failed: {e}")
+        finally:
+            # A job given up after failed polls may still be running, so it stays
+            # created and is monitored again by the next run.
+            if self.job_ledger is not None:
+                self.job_ledger.record_outcomes(
+                    {s.job_id: s.failed for s in statuses if s.state == 0}
+                )
+
+        summary = self._summarize(statuses)
+        logging.info(
+            f"All copy jobs finished: {summary['Completed']} completed, "
+            f"{summary['Failed']} failed, {summary['ObjectsProcessed']} objects, "
+            f"{summary['BytesProcessed']} bytes, {summary['Errors']} errors"
+        )
+        return summary
+
+    def _unique_jobs(self, jobs: List[Dict[str, Any]]) -> List[CopyJobStatus]:
+        """
+        Builds one status per distinct job; batched folders may share a job.
+        """
+        statuses: Dict[str, CopyJobStatus] = {}
+        for job in jobs:
+            if job.get("JobId") and job["JobId"] not in statuses:
+                statuses[job["JobId"]] = CopyJobStatus(job, self.min_interval)
+        return list(statuses.values())
+
+    async def _poll(
+        self, session: aiohttp.ClientSession, status: CopyJobStatus
+    ) -> None:
+        """
+        Polls the progress of a job once and reschedules it according to its activity.
+
+        Args:
+            session (aiohttp.ClientSession): The aiohttp session to use for the request.
+            status (CopyJobStatus): The job to poll.
+        """
+        payload = {
+            "copyJobInfo": {
+                "EncryptionKey": status.encryption_key,
+                "JobId": status.job_id,
+                "JobQueueUri": status.job_queue_uri,
+            }
+        }
+        try:
+            response = await self.rate_governor.request(
+                session,
+                "POST",
+                f"{self.tenant_url}/_api/site/GetCopyJobProgress",
+                headers=await self._get_headers(),
+                json=payload,
+            )
+            if response.status != 200:
+                raise JobMonitoringError(f"{response.status} - {response.text()}")
+            changed = self._apply_progress(status, response.json())
+        except (
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+            JobMonitoringError,
+            ValueError,
+            TypeError,
+        ) as e:
+            # Malformed JSON or progress values count against this job only
+            status.poll_failures += 1
+            request_log.warning("Failed to poll copy job %s: %s", status.job_id, e)
+            if status.poll_failures >= self.MAX_POLL_FAILURES:
+                status.finished = status.failed = True
+                logging.error(
+                    f"Giving up on copy job {status.job_id} after {status.poll_failures} failed polls"
+                )
+            status.interval = min(
+                self.max_interval, status.interval * self.backoff_factor
+            )
+            return
+
+        status.poll_failures = 0
+        if changed:
+            status.interval = self.min_interval
+        else:
+            status.interval = min(
+                self.max_interval, status.interval * self.backoff_factor
+            )
+
+    def _apply_progress(
+        self, status: CopyJobStatus, response_json: Dict[str, Any]
+    ) -> bool:
+        """
+        Applies a GetCopyJobProgress response to the job status.
+
+        Args:
+            status (CopyJobStatus): The job status to update.
+            response_json (Dict[str, Any]): The GetCopyJobProgress response.
+
+        Returns:
+            bool: Whether the job reported any activity.
+        """
+        progress = response_json.get("d", {}).get("GetCopyJobProgress", response_json)
+        logs = progress.get("Logs") or []
+        if isinstance(logs, dict):
+            logs = logs.get("results", [])
+
+        changed = bool(logs) or progress.get("JobState") != status.state
+        status.state = progress.get("JobState")
+        for log in logs:
+            event = json.loads(log) if isinstance(log, str) else log
+            name = event.get("Event")
+            if "ObjectsProcessed" in event:
+                status.objects_processed = int(event["ObjectsProcessed"])
+            if "BytesProcessed" in event:
+                status.bytes_processed = int(event["BytesProcessed"])
+            if "TotalErrors" in event:
+                status.errors = max(status.errors, int(event["TotalErrors"]))
+            elif name in ("JobError", "JobFatalError"):
+                status.errors += 1
+            if name in self.FAILURE_EVENTS:
+                status.failed = True
+                logging.error(
+                    f"Copy job {status.job_id} for {status.source_uri} failed: {event.get('Message', name)}"
+                )
+
+        if status.state == 0:
+            status.finished = True
+            request_log.info(
+                "Copy job %s for %s finished: %d objects, %d errors",
+                status.job_id,
+                status.source_uri,
+                status.objects_processed,
+                status.errors,
+            )
+        return changed
+
+    def _log_progress(self, statuses: List[CopyJobStatus]) -> None:
+        summary = self._summarize(statuses)
+        logging.info(
+            f"Copy job progress: {summary['Completed'] + summary['Failed']}/{summary['Jobs']} finished, "
+            f"{summary['ObjectsProcessed']} objects, {summary['BytesProcessed']} bytes, "
+            f"{summary['Errors']} errors"
+        )
+
+    @staticmethod
+    def _summarize(statuses: List[CopyJobStatus]) -> Dict[str, Any]:
+        """
+        Rolls up the progress of all jobs.
+
+        Args:
+            statuses (List[CopyJobStatus]): The job statuses.
+
+        Returns:
+            Dict[str, Any]: The global totals and the progress of each job.
+        """
+        return {
+            "Jobs": len(statuses),
+            "Completed": sum(1 for s in statuses if s.finished and not s.failed),
+            "Failed": sum(1 for s in statuses if s.failed),
+            "ObjectsProcessed": sum(s.objects_processed for s in statuses),
+            "BytesProcessed": sum(s.bytes_processed for s in statuses),
+            "Errors": sum(s.errors for s in statuses),
+            "JobsProgress": [s.to_dict() for s in statuses],
+        }
+
+    async def _get_headers(self) -> Dict[str, str]:
+        """
+        Get headers for the request, with the current access token.
+
+        Returns:
+            Dict[str, str]: The headers for the request.
+        """
+        return {
+            **await self.token_provider.get_headers(),
+            "Accept": odata.accept_header(self.odata_metadata),
+            "Content-Type": "application/json",
+        }
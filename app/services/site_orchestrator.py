@@ -0,0 +1,517 @@
+import asyncio
+import csv
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.auth.token_provider import TokenProvider
+from app.config.log_settings import LogSettings
+from app.config.settings import Settings
+from app.exceptions import EnvironmentVariableError, SiteManifestError
+from app.utils.http_session import PooledSession
+from app.utils.metrics import RequestMetrics
+from app.utils.rate_governor import Governor, RateGovernor, SiteGovernor
+
+# Runs the phases of the migration of one site with its settings, the shared token
+# provider and its governor, and returns the copy jobs created.
+SiteRunner = Callable[
+    [Settings, TokenProvider, Governor, bool, bool],
+    Awaitable[List[Dict[str, Any]]],
+]
+
+# Creates the token provider of a process from the settings of the run.
+TokenProviderFactory = Callable[[Settings], TokenProvider]
+
+
+class SiteMigration:
+    """
+    The migration of one source site of a manifest to its destination, and its
+    progress as shown in the report.
+
+    Attributes:
+        name (str): The name of the site, which is also the name of its data directory.
+        settings (Settings): The settings of the site.
+        status (str): "pending", "running", "done" or "failed".
+        error (Optional[str]): The error the migration failed with.
+        started (Optional[float]): The time the migration started.
+        finished (Optional[float]): The time the migration finished.
+        phases (Dict[str, float]): The wall time in seconds of each phase.
+        requests (int): The number of SharePoint requests of the site.
+        quarantined_folders (int): The folders the crawl could not list.
+        copy_jobs (int): The number of copy jobs created.
+    """
+
+    def __init__(self, name: str, settings: Settings) -> None:
+        self.name = name
+        self.settings = settings
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.requests = 0
+        self.quarantined_folders = 0
+        self.copy_jobs = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the progress of the migration as shown in the report.
+
+        Returns:
+            Dict[str, Any]: The progress of the migration.
+        """
+        duration = None
+        if self.started is not None:
+            duration = round((self.finished or time.time()) - self.started, 3)
+        return {
+            "name": self.name,
+            "origin_url": self.settings.ORIGIN_URL,
+            "partial_origin_url": self.settings.PARTIAL_ORIGIN_URL,
+            "destination_url": self.settings.DESTINATION_URL,
+            "status": self.status,
+            "error": self.error,
+            "started": self.started,
+            "finished": self.finished,
+            "duration_seconds": duration,
+            "phases_seconds": {
+                name: round(seconds, 3) for name, seconds in self.phases.items()
+            },
+            "requests": self.requests,
+            "quarantined_folders": self.quarantined_folders,
+            "copy_jobs": self.copy_jobs,
+        }
+
+    def update(self, progress: Dict[str, Any]) -> None:
+        """
+        Applies the progress reported by a worker process.
+
+        Args:
+            progress (Dict[str, Any]): The progress, as returned by to_dict.
+        """
+        for name in (
+            "status",
+            "error",
+            "started",
+            "finished",
+            "requests",
+            "quarantined_folders",
+            "copy_jobs",
+        ):
+            setattr(self, name, progress[name])
+        self.phases = dict(progress["phases_seconds"])
+
+
+def load_manifest(path: str, data_dir: str) -> List[SiteMigration]:
+    """
+    Reads a manifest of the sites to migrate: a JSON list of objects or a CSV file
+    with a header row. Each entry sets ORIGIN_URL, PARTIAL_ORIGIN_URL and
+    DESTINATION_URL, and optionally a name and any other setting, written as in the
+    .env file; the other settings come from the environment.
+
+    Each site keeps its inventory, checkpoint and ledger in its own directory, named
+    after the site, under data_dir/sites, unless its entry sets DATA_DIR.
+
+    Args:
+        path (str): The path to the manifest.
+        data_dir (str): The data directory of the run.
+
+    Returns:
+        List[SiteMigration]: The migration of each site, in manifest order.
+
+    Raises:
+        SiteManifestError: If the manifest cannot be read or an entry is invalid.
+    """
+    try:
+        with open(path, newline="", encoding="utf-8") as file:
+            if path.lower().endswith(".csv"):
+                entries: Any = list(csv.DictReader(file))
+            else:
+                entries = json.load(file)
+    except (OSError, ValueError, csv.Error) as e:
+        logging.error(f"Failed to read site manifest {path}: {e}")
+        raise SiteManifestError(f"Failed to read site manifest {path}: {e}")
+    if not isinstance(entries, list) or not all(
+        isinstance(entry, dict) for entry in entries
+    ):
+        raise SiteManifestError(f"Site manifest {path} is not a list of sites")
+
+    known_settings = {
+        name for name in vars(Settings(require_site=False)) if name.isupper()
+    }
+    sites: List[SiteMigration] = []
+    names = set()
+    for number, entry in enumerate(entries, 1):
+        # Empty CSV cells leave the setting to the environment
+        entry = {key: value for key, value in entry.items() if value not in ("", None)}
+        missing = [name for name in Settings.SITE_SETTINGS if name not in entry]
+        if missing:
+            raise SiteManifestError(
+                f"Site {number} of {path} does not set {', '.join(missing)}"
+            )
+        name = str(entry.pop("name", "")) or re.sub(
+            r"[^A-Za-z0-9_.-]+", "_", str(entry["PARTIAL_ORIGIN_URL"]).strip("/")
+        )
+        unknown = sorted(set(entry) - known_settings)
+        if unknown:
+            raise SiteManifestError(
+                f"Site {name} of {path} sets unknown settings: {', '.join(unknown)}"
+            )
+        if name in names:
+            raise SiteManifestError(f"Site {name} appears twice in {path}")
+        names.add(name)
+        try:
+            settings = Settings(
+                {"DATA_DIR": os.path.join(data_dir, "sites", name), **entry}
+            )
+        except (EnvironmentVariableError, ValueError) as e:
+            raise SiteManifestError(f"Invalid settings of site {name} in {path}: {e}")
+        sites.append(SiteMigration(name, settings))
+    logging.info(f"Loaded {len(sites)} sites from {path}")
+    return sites
+
+
+class SiteOrchestrator:
+    """
+    Migrates the sites of a manifest concurrently, with a single token provider,
+    connection pool and rate governor, so hundreds of sites need neither hundreds of
+    processes nor as many authentications.
+
+    At most max_sites sites run at a time. Their requests share the global cap,
+    throttling pauses and circuit breaker of the rate governor, and each site is also
+    capped at its ORCHESTRATOR_SITE_CONCURRENCY requests in flight, so one large site
+    cannot starve the others. A failed site does not stop the others; it is marked
+    failed in the report and can be migrated again with the next run, which resumes
+    from its inventory and job ledger like a single-site run.
+
+    With processes > 1 the sites are dealt out across worker processes, so parsing
+    the responses and writing the inventories of different sites use separate cores.
+    Each process authenticates on its own, through the persisted token cache, and
+    runs its sites with its share of max_sites and of the global request cap. The
+    run_site and create_token_provider functions are then passed to the processes,
+    so they must be module-level functions.
+
+    The report is a JSON file with the status, phase times, requests and copy jobs of
+    every site, rewritten whenever a site starts or finishes; a summary is also
+    logged every progress_interval seconds.
+
+    Attributes:
+        settings (Settings): The settings of the run.
+        sites (List[SiteMigration]): The migrations of the sites.
+        run_site (SiteRunner): Runs the migration of one site.
+        create_token_provider (TokenProviderFactory): Creates the token provider of
+            a process.
+        max_sites (int): The number of sites migrated at the same time.
+        processes (int): The number of worker processes, 0 or 1 for none.
+        report_path (Optional[str]): The path to the report file.
+        progress_interval (float): Seconds between progress summaries.
+        resume (bool): Whether to resume the interrupted crawls of the sites.
+        retry_quarantine (bool): Whether to crawl the quarantined folders again.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        sites: List[SiteMigration],
+        run_site: SiteRunner,
+        create_token_provider: TokenProviderFactory,
+        resume: bool = False,
+        retry_quarantine: bool = False,
+    ) -> None:
+        """
+        Initializes the SiteOrchestrator instance with the settings of the run.
+        """
+        self.settings = settings
+        self.sites = sites
+        self.run_site = run_site
+        self.create_token_provider = create_token_provider
+        self.max_sites = max(1, settings.ORCHESTRATOR_MAX_SITES)
+        self.processes = min(settings.ORCHESTRATOR_PROCESSES, len(sites))
+        self.report_path = (
+            os.path.join(settings.DATA_DIR, settings.ORCHESTRATOR_REPORT_FILENAME)
+            if settings.ORCHESTRATOR_REPORT_FILENAME
+            else None
+        )
+        self.progress_interval = settings.ORCHESTRATOR_PROGRESS_INTERVAL
+        self.resume = resume
+        self.retry_quarantine = retry_quarantine
+        self._started = time.time()
+
+    async def run(self) -> List[SiteMigration]:
+        """
+        Migrates all sites and writes the final report.
+
+        Returns:
+            List[SiteMigration]: The migrations of the sites.
+        """
+        self._write_report()
+        progress_task = asyncio.create_task(self._report_progress())
+        try:
+            if self.processes > 1:
+                await self._run_processes()
+            else:
+                await self.run_sites(
+                    self.settings.RATE_MAX_CONCURRENCY,
+                    self.max_sites,
+                    self._write_report,
+                )
+        finally:
+            progress_task.cancel()
+            self._write_report()
+        logging.info(f"Migration of {len(self.sites)} sites finished: {self._counts()}")
+        return self.sites
+
+    async def run_sites(
+        self,
+        max_concurrency: int,
+        max_sites: int,
+        on_update: Callable[[SiteMigration], None],
+    ) -> None:
+        """
+        Migrates the sites in this process, sharing one token provider, connection
+        pool and rate governor, and writes the request metrics of the run.
+
+        Args:
+            max_concurrency (int): The global cap of requests in flight.
+            max_sites (int): The number of sites migrated at the same time.
+            on_update (Callable[[SiteMigration], None]): Called when a site starts
+                or finishes.
+        """
+        settings = self.settings
+        metrics = RequestMetrics()
+        rate_governor = RateGovernor(
+            min(settings.AIOHTTP_LIMIT, max_concurrency),
+            settings.RATE_MIN_CONCURRENCY,
+            max_concurrency,
+            settings.RATE_MAX_RETRIES,
+            latency_target=settings.RATE_LATENCY_TARGET,
+            metrics=metrics,
+            breaker_threshold=settings.RATE_BREAKER_THRESHOLD,
+            breaker_cooldown=settings.RATE_BREAKER_COOLDOWN,
+        )
+        slots = asyncio.Semaphore(max_sites)
+
+        async def run_one(site: SiteMigration) -> None:
+            async with slots:
+                await self._run_site(site, token_provider, rate_governor, on_update)
+
+        try:
+            with metrics.phase("sites"):
+                async with self.create_token_provider(
+                    settings
+                ) as token_provider, PooledSession(
+                    max_concurrency,
+                    settings.AIOHTTP_KEEPALIVE_TIMEOUT,
+                    settings.AIOHTTP_DNS_CACHE_TTL,
+                    shared=True,
+                ):
+                    await asyncio.gather(*(run_one(site) for site in self.sites))
+        finally:
+            metrics.write(
+                settings.METRICS_PROMETHEUS_PATH, settings.METRICS_SUMMARY_PATH
+            )
+
+    async def _run_site(
+        self,
+        site: SiteMigration,
+        token_provider: TokenProvider,
+        rate_governor: RateGovernor,
+        on_update: Callable[[SiteMigration], None],
+    ) -> None:
+        """
+        Migrates one site, recording its outcome rather than raising, so a failed
+        site does not stop the others.
+        """
+        site_governor = SiteGovernor(
+            rate_governor, site.settings.ORCHESTRATOR_SITE_CONCURRENCY
+        )
+        site.status = "running"
+        site.started = time.time()
+        on_update(site)
+        logging.info(
+            f"Migrating site {site.name}: {site.settings.PARTIAL_ORIGIN_URL} to "
+            f"{site.settings.DESTINATION_URL}"
+        )
+        try:
+            os.makedirs(site.settings.DATA_DIR, exist_ok=True)
+            jobs = await self.run_site(
+                site.settings,
+                token_provider,
+                site_governor,
+                self.resume,
+                self.retry_quarantine,
+            )
+            site.copy_jobs = len(jobs)
+            site.status = "done"
+            logging.info(f"Site {site.name} migrated: {site.copy_jobs} copy jobs")
+        except Exception as e:
+            site.status = "failed"
+            site.error = str(e)
+            logging.error(f"Migration of site {site.name} failed: {e}")
+        finally:
+            site.finished = time.time()
+            site.phases = dict(site_governor.metrics.phases)
+            site.requests = site_governor.requests
+            site.quarantined_folders = site_governor.metrics.quarantined_folders
+            rate_governor.metrics.quarantined_folders += site.quarantined_folders
+            on_update(site)
+
+    async def _run_processes(self) -> None:
+        """
+        Deals the sites out across worker processes and applies the progress they
+        report until all of them finish.
+        """
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+        groups = [
+            self.sites[index :: self.processes] for index in range(self.processes)
+        ]
+        max_concurrency = max(1, self.settings.RATE_MAX_CONCURRENCY // self.processes)
+        max_sites = math.ceil(self.max_sites / self.processes)
+        by_name = {site.name: site for site in self.sites}
+        logging.info(
+            f"Migrating {len(self.sites)} sites in {self.processes} processes, "
+            f"each with up to {max_sites} sites and {max_concurrency} requests at a time"
+        )
+
+        def apply(progress: Dict[str, Any]) -> None:
+            by_name[progress["name"]].update(progress)
+            self._write_report()
+
+        with context.Manager() as manager, ProcessPoolExecutor(
+            self.processes, mp_context=context
+        ) as executor:
+            updates = manager.Queue()
+            workers = asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        executor,
+                        _run_worker,
+                        self.settings,
+                        group,
+                        self.run_site,
+                        self.create_token_provider,
+                        self.resume,
+                        self.retry_quarantine,
+                        index,
+                        max_concurrency,
+                        max_sites,
+                        updates,
+                    )
+                    for index, group in enumerate(groups)
+                ),
+                return_exceptions=True,
+            )
+            while not workers.done():
+                try:
+                    apply(await loop.run_in_executor(None, updates.get, True, 1.0))
+                except queue.Empty:
+                    pass
+            while not updates.empty():
+                apply(updates.get())
+
+        # A worker that failed as a whole, e.g. to authenticate, leaves its
+        # unfinished sites failed with its error
+        for group, result in zip(groups, workers.result()):
+            if isinstance(result, BaseException):
+                logging.error(f"Migration worker process failed: {result}")
+                for site in group:
+                    if site.status in ("pending", "running"):
+                        site.status = "failed"
+                        site.error = str(result)
+
+    async def _report_progress(self) -> None:
+        """
+        Logs the number of sites in each state every progress_interval seconds.
+        """
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            running = [site.name for site in self.sites if site.status == "running"]
+            logging.info(
+                f"Migration progress: {self._counts()}"
+                + (f" (running: {', '.join(running[:10])})" if running else "")
+            )
+
+    def _counts(self) -> str:
+        counts = self._status_counts()
+        return ", ".join(f"{count} {status}" for status, count in counts.items())
+
+    def _status_counts(self) -> Dict[str, int]:
+        counts = {"done": 0, "failed": 0, "running": 0, "pending": 0}
+        for site in self.sites:
+            counts[site.status] += 1
+        return counts
+
+    def _write_report(self, site: Optional[SiteMigration] = None) -> None:
+        """
+        Writes the report to a temporary file and moves it in place, so it can be
+        read at any time during the run.
+        """
+        if not self.report_path:
+            return
+        report = {
+            "started": self._started,
+            "updated": time.time(),
+            "sites": self._status_counts(),
+            "requests": sum(site.requests for site in self.sites),
+            "copy_jobs": sum(site.copy_jobs for site in self.sites),
+            "quarantined_folders": sum(site.quarantined_folders for site in self.sites),
+            "migrations": [site.to_dict() for site in self.sites],
+        }
+        temporary_path = f"{self.report_path}.tmp"
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+            os.replace(temporary_path, self.report_path)
+        except OSError as e:
+            logging.warning(f"Failed to write migration report {self.report_path}: {e}")
+
+
+def _run_worker(
+    settings: Settings,
+    sites: List[SiteMigration],
+    run_site: SiteRunner,
+    create_token_provider: TokenProviderFactory,
+    resume: bool,
+    retry_quarantine: bool,
+    index: int,
+    max_concurrency: int,
+    max_sites: int,
+    updates: "queue.Queue[Dict[str, Any]]",
+) -> None:
+    """
+    Migrates a group of sites in a worker process, putting the progress of each site
+    on the updates queue whenever it starts or finishes. The request metrics of the
+    process are written next to those of the run, with the worker index.
+    """
+    log_settings = LogSettings(
+        settings.LOG_LEVEL,
+        settings.LOG_FORMAT,
+        settings.LOG_JSON,
+        settings.LOG_QUEUE,
+        settings.LOG_REQUEST_RATE,
+    )
+    for name in ("METRICS_PROMETHEUS_PATH", "METRICS_SUMMARY_PATH"):
+        path = getattr(settings, name)
+        if path:
+            root, extension = os.path.splitext(path)
+            setattr(settings, name, f"{root}.{index}{extension}")
+    orchestrator = SiteOrchestrator(
+        settings, sites, run_site, create_token_provider, resume, retry_quarantine
+    )
+    try:
+        asyncio.run(
+            orchestrator.run_sites(
+                max_concurrency,
+                max_sites,
+                lambda site: updates.put(site.to_dict()),
+            )
+        )
+    finally:
+        log_settings.stop()
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+import urllib.parse
+from typing import Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+
+from app.exceptions import InventoryWriteError
+from app.services.inventory_store import InventoryStore, SQLiteInventoryStore
+
+# The first segments of the server-relative URL of a site collection.
+SITE_COLLECTION_PATHS = ("sites", "teams", "personal")
+
+
+def split_site_url(url: str) -> Tuple[str, str]:
+    """
+    Splits the URL of a folder into the URL of its site, to send REST requests to,
+    and its server-relative path, e.g. "https://contoso.sharepoint.com/sites/hr/Shared
+    Documents" into "https://contoso.sharepoint.com/sites/hr" and "/sites/hr/Shared
+    Documents". Folders of subsites need the site URL to be given instead.
+
+    Args:
+        url (str): The URL of the folder.
+
+    Returns:
+        Tuple[str, str]: The site URL and the server-relative path of the folder.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = urllib.parse.unquote(parts.path).rstrip("/")
+    segments = path.strip("/").split("/")
+    site_path = ""
+    if len(segments) >= 2 and segments[0].lower() in SITE_COLLECTION_PATHS:
+        site_path = f"/{segments[0]}/{segments[1]}"
+    site_url = urllib.parse.urlunsplit(
+        (parts.scheme, parts.netloc, urllib.parse.quote(site_path), "", "")
+    )
+    return site_url, path
+
+
+class TreeVerifier:
+    """
+    Compares the folder tree crawled from the destination with the source inventory,
+    joined on the path of each folder relative to the destination folder, and reports
+    the missing folders, the extra folders and the folders whose ItemCount differs.
+
+    With copy jobs per level, each selected folder at level is copied into the
+    destination folder, so a source folder is expected at its path without its first
+    level segments, and only below the selected folders. When the jobs preserve the
+    hierarchy, the selected folders keep their path, and the ancestors provisioned
+    for them above level are left out of both trees. With planned jobs (level is
+    None), every source folder is expected at its own path.
+
+    Both inventories are streamed in batches into a SQLite work database, indexed
+    on the relative path, and compared with indexed joins whose results are streamed
+    to a JSON Lines report, so memory stays bounded whatever the size of the trees.
+    Paths are compared case-insensitively, as SharePoint does.
+
+    Attributes:
+        source (InventoryStore): The inventory of the source.
+        destination (InventoryStore): The inventory crawled from the destination.
+        level (Optional[int]): The level of the copy jobs, or None for planned jobs.
+        roots (Optional[Iterable[str]]): The paths of the folders copy jobs were
+            created for, or None for all folders at level.
+        preserve_hierarchy (bool): Whether the folders at level were copied below
+            the path of their parent instead of into the destination folder.
+        work_path (str): The path to the SQLite work database, removed afterwards.
+        batch_size (int): The number of records read and inserted at a time.
+    """
+
+    DIFFERENCES = ("missing", "extra", "item_count")
+
+    def __init__(
+        self,
+        source: InventoryStore,
+        destination: InventoryStore,
+        level: Optional[int],
+        work_path: str,
+        roots: Optional[Iterable[str]] = None,
+        preserve_hierarchy: bool = False,
+        batch_size: int = 100000,
+    ) -> None:
+        self.source = source
+        self.destination = destination
+        self.level = level
+        self.roots = roots
+        self.preserve_hierarchy = preserve_hierarchy
+        self.work_path = work_path
+        self.batch_size = batch_size
+
+    def verify(self, report_path: str) -> Dict[str, int]:
+        """
+        Compares the trees and writes each difference to a JSON Lines file, with its
+        kind ("missing", "extra" or "item_count"), relative path and ItemCounts.
+
+        Args:
+            report_path (str): The path to the report file.
+
+        Returns:
+            Dict[str, int]: The number of folders compared and of each difference.
+
+        Raises:
+            InventoryReadError: If an inventory cannot be read.
+            InventoryWriteError: If the work database or the report cannot be written.
+        """
+        start = time.perf_counter()
+        self._remove_work_database()
+        try:
+            connection = sqlite3.connect(self.work_path)
+        except sqlite3.Error as e:
+            raise InventoryWriteError(
+                f"Failed to create verification database {self.work_path}: {e}"
+            )
+        try:
+            summary = self._compare(connection, report_path)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to compare the inventories: {e}")
+            raise InventoryWriteError(f"Failed to compare the inventories: {e}")
+        finally:
+            connection.close()
+            self._remove_work_database()
+        logging.info(
+            f"Verification report written to {report_path} in "
+            f"{time.perf_counter() - start:.1f}s: {summary['source']} source and "
+            f"{summary['destination']} destination folders, {summary['missing']} "
+            f"missing, {summary['extra']} extra, {summary['item_count']} ItemCount "
+            "mismatches"
+        )
+        return summary
+
+    def _compare(
+        self, connection: sqlite3.Connection, report_path: str
+    ) -> Dict[str, int]:
+        """
+        Loads both trees into the work database and streams the differences to the
+        report.
+        """
+        # The work database is thrown away, so it needs no journal.
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA cache_size = -65536")
+        connection.execute(
+            "CREATE TABLE source (Root TEXT, RelativePath TEXT, ItemCount INTEGER)"
+        )
+        connection.execute(
+            "CREATE TABLE destination (RelativePath TEXT, ItemCount INTEGER)"
+        )
+        # The relative path drops the segments above level; the root is the path of
+        # the ancestor at level, i.e. of the folder the copy job copied.
+        connection.create_function(
+            "relative_path", 1, self._relative_path, deterministic=True
+        )
+        connection.create_function("root_path", 1, self._root_path, deterministic=True)
+        with connection:
+            if self.level is None:
+                self._load(
+                    connection,
+                    self.source,
+                    "INSERT INTO source SELECT Path, Path, ItemCount FROM {folders}",
+                )
+            else:
+                self._load(
+                    connection,
+                    self.source,
+                    "INSERT INTO source SELECT root_path(Path), relative_path(Path), "
+                    f"ItemCount FROM {{folders}} WHERE Level >= {int(self.level)}",
+                )
+            destination_insert = (
+                "INSERT INTO destination SELECT Path, ItemCount FROM {folders}"
+            )
+            if self.level is not None and self.preserve_hierarchy:
+                destination_insert += f" WHERE Level >= {int(self.level)}"
+            self._load(connection, self.destination, destination_insert)
+            if self.level is not None and self.roots is not None:
+                connection.execute(
+                    "CREATE TABLE roots (Path TEXT PRIMARY KEY COLLATE NOCASE)"
+                )
+                connection.executemany(
+                    "INSERT OR IGNORE INTO roots VALUES (?)",
+                    ((root,) for root in self.roots),
+                )
+                connection.execute(
+                    "DELETE FROM source WHERE Root NOT IN (SELECT Path FROM roots)"
+                )
+        for table in ("source", "destination"):
+            connection.execute(
+                f"CREATE INDEX idx_{table}_path ON {table} (RelativePath COLLATE NOCASE)"
+            )
+
+        summary = {
+            table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("source", "destination")
+        }
+        # One pass over the source finds the missing folders and the ItemCount
+        # mismatches, one over the destination finds the extra folders; both walk
+        # their path index, so the report comes out sorted by path.
+        queries = (
+            "SELECT s.RelativePath, s.ItemCount, d.ItemCount, d.rowid IS NULL "
+            "FROM source s LEFT JOIN destination d ON d.RelativePath = "
+            "s.RelativePath COLLATE NOCASE WHERE d.rowid IS NULL OR s.ItemCount "
+            "IS NOT d.ItemCount ORDER BY s.RelativePath COLLATE NOCASE",
+            "SELECT d.RelativePath, NULL, d.ItemCount, NULL FROM destination d "
+            "WHERE NOT EXISTS (SELECT 1 FROM source s WHERE s.RelativePath = "
+            "d.RelativePath COLLATE NOCASE) ORDER BY d.RelativePath COLLATE NOCASE",
+        )
+        summary.update((difference, 0) for difference in self.DIFFERENCES)
+        try:
+            with open(report_path, "w", encoding="utf-8") as file:
+                for query in queries:
+                    for (
+                        path,
+                        item_count,
+                        destination_item_count,
+                        missing,
+                    ) in connection.execute(query):
+                        if missing is None:
+                            difference = "extra"
+                        else:
+                            difference = "missing" if missing else "item_count"
+                        file.write(
+                            json.dumps(
+                                {
+                                    "Difference": difference,
+                                    "Path": path,
+                                    "ItemCount": item_count,
+                                    "DestinationItemCount": destination_item_count,
+                                },
+                                ensure_ascii=False,
+                            )
+                            + "\n"
+                        )
+                        summary[difference] += 1
+        except OSError as e:
+            logging.error(f"Failed to write verification report {report_path}: {e}")
+            raise InventoryWriteError(
+                f"Failed to write verification report {report_path}: {e}"
+            )
+        return summary
+
+    def _load(
+        self, connection: sqlite3.Connection, store: InventoryStore, insert: str
+    ) -> None:
+        """
+        Copies the folders of an inventory into the work database with an INSERT
+        selecting from {folders}. A SQLite inventory is attached and copied in a
+        single statement; other backends are read in batches into a staging table.
+        """
+        if isinstance(store, SQLiteInventoryStore):
+            connection.execute("ATTACH DATABASE ? AS inventory", (store.path,))
+            try:
+                connection.execute(insert.format(folders="inventory.folders"))
+            finally:
+                connection.commit()
+                connection.execute("DETACH DATABASE inventory")
+            return
+
+        connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS staging "
+            "(Path TEXT, Level INTEGER, ItemCount INTEGER)"
+        )
+        for df in store.read_batches(["Path", "Level", "ItemCount"], self.batch_size):
+            counts = pd.to_numeric(df["ItemCount"], errors="coerce").astype("Int64")
+            connection.executemany(
+                "INSERT INTO staging VALUES (?, ?, ?)",
+                zip(
+                    df["Path"].astype(str),
+                    df["Level"].astype(int),
+                    counts.astype(object).where(counts.notna(), None),
+                ),
+            )
+            connection.execute(insert.format(folders="staging"))
+            connection.execute("DELETE FROM staging")
+
+    def _relative_path(self, path: str) -> str:
+        if self.preserve_hierarchy:
+            return path
+        return path.split("/", self.level)[-1]
+
+    def _root_path(self, path: str) -> str:
+        return "/".join(path.split("/", self.level + 1)[: self.level + 1])
+
+    def _remove_work_database(self) -> None:
+        if os.path.exists(self.work_path):
+            os.remove(self.work_path)
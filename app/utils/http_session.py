@@ -0,0 +1,138 @@
+import logging
+from contextvars import ContextVar, Token
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import aiohttp
+
+# The session of the shared PooledSession entered in the current context, borrowed by
+# the PooledSessions entered within it.
+_shared_session: ContextVar[Optional[aiohttp.ClientSession]] = ContextVar(
+    "shared_session", default=None
+)
+
+
+class ConnectionStats:
+    """
+    A class to count the connections opened and reused by a pooled aiohttp session.
+
+    Attributes:
+        opened (int): The number of new connections opened (TCP + TLS handshake).
+        reused (int): The number of requests served by an existing keep-alive connection.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the ConnectionStats instance with zeroed counters.
+        """
+        self.opened = 0
+        self.reused = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        """
+        Returns the fraction of requests that reused an existing connection.
+
+        Returns:
+            float: The reuse ratio, between 0 and 1.
+        """
+        total = self.opened + self.reused
+        return self.reused / total if total else 0.0
+
+    def create_trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Creates an aiohttp trace config that updates the counters.
+
+        Returns:
+            aiohttp.TraceConfig: The trace config to attach to a session.
+        """
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        return trace_config
+
+    async def _on_connection_create_end(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: Any
+    ) -> None:
+        self.opened += 1
+
+    async def _on_connection_reuseconn(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: Any
+    ) -> None:
+        self.reused += 1
+
+    def __str__(self) -> str:
+        return (
+            f"{self.opened} connections opened, {self.reused} reused "
+            f"({self.reuse_ratio:.1%} reuse)"
+        )
+
+
+class PooledSession:
+    """
+    An async context manager that owns one long-lived aiohttp session backed by a
+    single connection pool, so every request of a run shares keep-alive connections,
+    the DNS cache and the global connection cap.
+
+    A shared PooledSession lends its session to every PooledSession entered in the
+    tasks started within it, so the sites of a multi-site migration share a single
+    connection pool; those sessions then ignore their own pool settings.
+
+    Attributes:
+        limit (int): The global connection limit of the pool.
+        keepalive_timeout (float): Seconds an idle connection is kept open for reuse.
+        dns_cache_ttl (int): Seconds a resolved host is kept in the DNS cache.
+        shared (bool): Whether to lend the session to the PooledSessions entered
+            within it.
+        stats (ConnectionStats): The counters of connections opened versus reused.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        shared: bool = False,
+    ) -> None:
+        """
+        Initializes the PooledSession instance with the pool settings.
+        """
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.shared = shared
+        self.stats = ConnectionStats()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._borrowed = False
+        self._token: Optional[Token] = None
+
+    async def __aenter__(self) -> aiohttp.ClientSession:
+        borrowed = _shared_session.get()
+        if borrowed is not None and not self.shared:
+            self._borrowed = True
+            return borrowed
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            trace_configs=[self.stats.create_trace_config()],
+        )
+        if self.shared:
+            self._token = _shared_session.set(self._session)
+        return self._session
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self._borrowed:
+            self._borrowed = False
+            return
+        if self._token is not None:
+            _shared_session.reset(self._token)
+            self._token = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        logging.info(f"HTTP connection pool closed: {self.stats}")
@@ -0,0 +1,83 @@
+import json
+import logging
+import logging.handlers
+import time
+from typing import Any, Dict, List, Optional
+
+# The logger of the messages logged for every request, e.g. each folder listed or
+# each retry. Its messages are rate limited by LogSettings, so they should be logged
+# with %-style arguments, which are only formatted when the message is kept.
+request_log = logging.getLogger("app.requests")
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that puts records on the queue as they are. The standard handler
+    formats every message before enqueueing it, so it can be pickled; the queue here
+    stays in the process, so formatting is left to the listener thread as well.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits how often each message is logged with a token bucket per message format:
+    up to rate messages per second with bursts of burst messages. The number of
+    messages dropped in between is appended to the next message logged.
+
+    Attributes:
+        rate (float): The messages per second kept for each message format.
+        burst (int): The number of messages kept in a burst.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        # The tokens, the time they were counted and the messages suppressed since
+        # the last one kept, per message format.
+        self._buckets: Dict[str, List[Any]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        bucket = self._buckets.get(record.msg)
+        if bucket is None:
+            bucket = self._buckets[record.msg] = [float(self.burst), now, 0]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False
+        bucket[0] = tokens - 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            if isinstance(record.args, tuple):
+                record.msg = f"{record.msg} (%d similar messages suppressed)"
+                record.args = (*record.args, bucket[2])
+            bucket[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as JSON lines with the time, level, logger, message and, when
+    present, the exception and the number of suppressed messages.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
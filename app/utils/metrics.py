@@ -0,0 +1,360 @@
+import bisect
+import json
+import logging
+import os
+import re
+import time
+import urllib.parse
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, DefaultDict, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+ENDPOINT_PATTERN = re.compile(r"/_api/(?:(?:web|site)/(\w+)|(\$batch))", re.IGNORECASE)
+
+
+def endpoint_name(url: str) -> str:
+    """
+    Returns the low-cardinality endpoint label of a SharePoint REST URL, e.g.
+    "GetFolderByServerRelativeUrl/Folders" or "CreateCopyJobs".
+
+    Args:
+        url (str): The request URL.
+
+    Returns:
+        str: The endpoint label.
+    """
+    path = urllib.parse.urlsplit(url).path
+    match = ENDPOINT_PATTERN.search(path)
+    if not match:
+        return "other"
+    name = match.group(1) or match.group(2)
+    tail = path.rstrip("/").rsplit("/", 1)[-1]
+    if tail != name and "(" not in tail and "'" not in tail:
+        name = f"{name}/{tail}"
+    return name
+
+
+class LatencyHistogram:
+    """
+    A cumulative latency histogram with fixed buckets, as exposed by Prometheus.
+
+    Attributes:
+        counts (List[int]): The number of observations per bucket (the last one is +Inf).
+        total (float): The sum of all observations in seconds.
+        count (int): The number of observations.
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in, or None if
+        it falls above the last bucket, which has no finite bound (JSON has no
+        infinity, so None is written as null in the run summary).
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+
+class RequestMetrics:
+    """
+    The metrics of every SharePoint HTTP call of a run, recorded by the RateGovernor.
+
+    Besides the request latency, it accounts for the time spent waiting for a
+    concurrency slot, waiting for throttling (Retry-After and RateLimit pauses) and
+    decoding JSON, so a slow crawl can be attributed to latency, throttling or parsing.
+    The metrics are written as a Prometheus text file and as a JSON run summary.
+
+    Attributes:
+        latency (Dict[str, LatencyHistogram]): The request latency per endpoint.
+        responses (Dict[Tuple[str, int], int]): The number of responses per endpoint and status.
+        bytes_received (Dict[str, int]): The response bytes per endpoint.
+        retries (Dict[Tuple[str, str], int]): The number of retries per endpoint and reason.
+        network_errors (Dict[str, int]): The number of failed requests per endpoint.
+        queue_wait (Dict[str, float]): Seconds spent waiting for a concurrency slot.
+        throttle_wait (Dict[str, float]): Seconds spent paused by throttling.
+        backoff_wait (Dict[str, float]): Seconds spent in retry backoff after errors.
+        decode_time (Dict[str, float]): Seconds spent decoding JSON responses.
+        in_flight (int): The number of requests in flight.
+        max_in_flight (int): The highest number of requests in flight.
+        concurrency (float): The last concurrency cap of the rate governor.
+        phases (Dict[str, float]): The wall time in seconds of each phase of the run.
+        breaker_trips (int): The number of times the circuit breaker opened.
+        quarantined_folders (int): The folders the crawl could not list.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the RequestMetrics instance with empty metrics.
+        """
+        self.started = time.time()
+        self.latency: DefaultDict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.responses: DefaultDict[Tuple[str, int], int] = defaultdict(int)
+        self.bytes_received: DefaultDict[str, int] = defaultdict(int)
+        self.retries: DefaultDict[Tuple[str, str], int] = defaultdict(int)
+        self.network_errors: DefaultDict[str, int] = defaultdict(int)
+        self.queue_wait: DefaultDict[str, float] = defaultdict(float)
+        self.throttle_wait: DefaultDict[str, float] = defaultdict(float)
+        self.backoff_wait: DefaultDict[str, float] = defaultdict(float)
+        self.decode_time: DefaultDict[str, float] = defaultdict(float)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.concurrency = 0.0
+        self.phases: Dict[str, float] = {}
+        self.breaker_trips = 0
+        self.quarantined_folders = 0
+
+    def request_started(self) -> None:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(
+        self, endpoint: str, latency: float, status: Optional[int], size: int = 0
+    ) -> None:
+        """
+        Records a finished request; status is None when it failed without a response.
+        """
+        self.in_flight -= 1
+        self.latency[endpoint].observe(latency)
+        if status is None:
+            self.network_errors[endpoint] += 1
+        else:
+            self.responses[(endpoint, status)] += 1
+            self.bytes_received[endpoint] += size
+
+    def record_retry(self, endpoint: str, reason: str, delay: float) -> None:
+        self.retries[(endpoint, reason)] += 1
+        if reason == "throttled":
+            self.throttle_wait[endpoint] += delay
+        else:
+            self.backoff_wait[endpoint] += delay
+
+    def record_wait(self, endpoint: str, queued: float, paused: float) -> None:
+        self.queue_wait[endpoint] += queued
+        self.throttle_wait[endpoint] += paused
+
+    def record_decode(self, endpoint: str, seconds: float) -> None:
+        self.decode_time[endpoint] += seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Records the wall time of a phase of the run.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns the JSON run summary.
+
+        Returns:
+            Dict[str, Any]: The totals of the run and the metrics of each endpoint.
+        """
+        endpoints: Dict[str, Any] = {}
+        for endpoint, histogram in sorted(self.latency.items()):
+            endpoints[endpoint] = {
+                "requests": histogram.count,
+                "statuses": {
+                    str(status): count
+                    for (name, status), count in sorted(self.responses.items())
+                    if name == endpoint
+                },
+                "network_errors": self.network_errors.get(endpoint, 0),
+                "retries": {
+                    reason: count
+                    for (name, reason), count in sorted(self.retries.items())
+                    if name == endpoint
+                },
+                "bytes_received": self.bytes_received.get(endpoint, 0),
+                "latency_seconds": {
+                    "total": round(histogram.total, 3),
+                    "mean": round(histogram.total / histogram.count, 4),
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                },
+                "queue_wait_seconds": round(self.queue_wait.get(endpoint, 0.0), 3),
+                "throttle_wait_seconds": round(
+                    self.throttle_wait.get(endpoint, 0.0), 3
+                ),
+                "backoff_wait_seconds": round(self.backoff_wait.get(endpoint, 0.0), 3),
+                "json_decode_seconds": round(self.decode_time.get(endpoint, 0.0), 3),
+            }
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+            "duration_seconds": round(time.time() - self.started, 3),
+            "phases_seconds": {
+                name: round(seconds, 3) for name, seconds in self.phases.items()
+            },
+            "requests": sum(h.count for h in self.latency.values()),
+            "retries": sum(self.retries.values()),
+            "bytes_received": sum(self.bytes_received.values()),
+            "max_in_flight": self.max_in_flight,
+            "final_concurrency": int(self.concurrency),
+            "breaker_trips": self.breaker_trips,
+            "quarantined_folders": self.quarantined_folders,
+            "endpoints": endpoints,
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics text.
+        """
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP sharepoint_{name} {help_text}")
+            lines.append(f"# TYPE sharepoint_{name} {kind}")
+
+        def labels(**values: Any) -> str:
+            pairs = ",".join(
+                f'{key}="{self._escape(str(value))}"' for key, value in values.items()
+            )
+            return f"{{{pairs}}}"
+
+        metric("request_duration_seconds", "histogram", "SharePoint request latency.")
+        for endpoint, histogram in sorted(self.latency.items()):
+            cumulative = 0
+            for bound, count in zip(
+                LATENCY_BUCKETS + (float("inf"),), histogram.counts
+            ):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"sharepoint_request_duration_seconds_bucket{labels(endpoint=endpoint, le=le)} {cumulative}"
+                )
+            lines.append(
+                f"sharepoint_request_duration_seconds_sum{labels(endpoint=endpoint)} {histogram.total}"
+            )
+            lines.append(
+                f"sharepoint_request_duration_seconds_count{labels(endpoint=endpoint)} {histogram.count}"
+            )
+
+        metric("responses_total", "counter", "SharePoint responses by status code.")
+        for (endpoint, status), count in sorted(self.responses.items()):
+            lines.append(
+                f"sharepoint_responses_total{labels(endpoint=endpoint, status=status)} {count}"
+            )
+
+        metric(
+            "network_errors_total",
+            "counter",
+            "SharePoint requests that failed without a response.",
+        )
+        for endpoint, count in sorted(self.network_errors.items()):
+            lines.append(
+                f"sharepoint_network_errors_total{labels(endpoint=endpoint)} {count}"
+            )
+
+        metric("retries_total", "counter", "SharePoint request retries by reason.")
+        for (endpoint, reason), count in sorted(self.retries.items()):
+            lines.append(
+                f"sharepoint_retries_total{labels(endpoint=endpoint, reason=reason)} {count}"
+            )
+
+        for name, values, help_text in (
+            ("response_bytes_total", self.bytes_received, "Response bytes received."),
+            (
+                "queue_wait_seconds_total",
+                self.queue_wait,
+                "Time spent waiting for a concurrency slot.",
+            ),
+            (
+                "throttle_wait_seconds_total",
+                self.throttle_wait,
+                "Time spent paused by Retry-After and RateLimit headers.",
+            ),
+            (
+                "backoff_wait_seconds_total",
+                self.backoff_wait,
+                "Time spent in retry backoff after errors.",
+            ),
+            (
+                "json_decode_seconds_total",
+                self.decode_time,
+                "Time spent decoding JSON responses.",
+            ),
+        ):
+            metric(name, "counter", help_text)
+            for endpoint, value in sorted(values.items()):
+                lines.append(f"sharepoint_{name}{labels(endpoint=endpoint)} {value}")
+
+        metric("requests_in_flight", "gauge", "SharePoint requests in flight.")
+        lines.append(f"sharepoint_requests_in_flight {self.in_flight}")
+        metric(
+            "requests_in_flight_max", "gauge", "Highest SharePoint requests in flight."
+        )
+        lines.append(f"sharepoint_requests_in_flight_max {self.max_in_flight}")
+        metric("concurrency_limit", "gauge", "Concurrency cap of the rate governor.")
+        lines.append(f"sharepoint_concurrency_limit {int(self.concurrency)}")
+
+        metric(
+            "circuit_breaker_trips_total",
+            "counter",
+            "Times the circuit breaker paused all requests.",
+        )
+        lines.append(f"sharepoint_circuit_breaker_trips_total {self.breaker_trips}")
+        metric("quarantined_folders", "gauge", "Folders the crawl could not list.")
+        lines.append(f"sharepoint_quarantined_folders {self.quarantined_folders}")
+
+        metric("phase_duration_seconds", "gauge", "Wall time of each phase of the run.")
+        for name, seconds in self.phases.items():
+            lines.append(
+                f"sharepoint_phase_duration_seconds{labels(phase=name)} {seconds}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def write(
+        self, prometheus_path: Optional[str], summary_path: Optional[str]
+    ) -> None:
+        """
+        Writes the Prometheus text file and the JSON run summary. Each file is written
+        to a temporary file first so a scraper never reads a partial file.
+
+        Args:
+            prometheus_path (Optional[str]): The Prometheus text file, or None to skip it.
+            summary_path (Optional[str]): The JSON summary file, or None to skip it.
+        """
+        for path, content in (
+            (prometheus_path, self.to_prometheus),
+            (summary_path, lambda: json.dumps(self.summary(), indent=2)),
+        ):
+            if not path:
+                continue
+            try:
+                temporary_path = f"{path}.tmp"
+                with open(temporary_path, "w", encoding="utf-8") as file:
+                    file.write(content())
+                os.replace(temporary_path, path)
+                logging.info(f"Metrics written to {path}")
+            except OSError as e:
+                logging.warning(f"Failed to write metrics to {path}: {e}")
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,77 @@
+import json
+from typing import Any, Iterable, List, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library decoder is used instead
+    orjson = None
+
+METADATA_LEVELS = ("verbose", "minimalmetadata", "nometadata")
+
+
+def loads(data: bytes) -> Any:
+    """
+    Decodes a JSON response body, with orjson when it is installed.
+
+    Args:
+        data (bytes): The response body.
+
+    Returns:
+        Any: The decoded JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def accept_header(metadata: str) -> str:
+    """
+    Returns the Accept header requesting JSON with the given OData metadata level.
+    odata=nometadata leaves out the __metadata and __deferred blocks of every entity.
+
+    Args:
+        metadata (str): "verbose", "minimalmetadata" or "nometadata".
+
+    Returns:
+        str: The Accept header value.
+    """
+    return f"application/json;odata={metadata}"
+
+
+def select(fields: Iterable[str], navigation: Optional[str] = None) -> str:
+    """
+    Builds the value of a $select query option, optionally for the fields of an
+    expanded navigation property.
+
+    Args:
+        fields (Iterable[str]): The fields to select.
+        navigation (Optional[str]): The expanded navigation property, e.g. "Folders".
+
+    Returns:
+        str: The comma separated fields.
+    """
+    prefix = f"{navigation}/" if navigation else ""
+    return ",".join(f"{prefix}{field}" for field in fields)
+
+
+def results(payload: Any, navigation: Optional[str] = None) -> List[Any]:
+    """
+    Returns the entities of a collection response, or of an expanded collection of
+    an entity, in either the verbose ({"d": {"results": [...]}}) or the light
+    ({"value": [...]}) format.
+
+    Args:
+        payload (Any): The decoded response.
+        navigation (Optional[str]): The expanded navigation property, e.g. "Folders".
+
+    Returns:
+        List[Any]: The entities of the collection.
+    """
+    entity = payload.get("d", payload)
+    if navigation is None:
+        collection = entity.get("results", payload.get("value", []))
+    else:
+        collection = entity.get(navigation, [])
+    if isinstance(collection, dict):
+        collection = collection.get("results", [])
+    return collection
@@ -0,0 +1,430 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from typing import Any, Mapping, NamedTuple, Optional, Protocol, Tuple
+
+import aiohttp
+
+from app.utils import odata
+from app.utils.log_handlers import request_log
+from app.utils.metrics import RequestMetrics, endpoint_name
+
+
+class GovernedResponse(NamedTuple):
+    """
+    The status, headers and body of a response read by the RateGovernor. Decoding
+    the body with json() (with orjson when it is installed) is timed in the metrics
+    of the endpoint.
+    """
+
+    status: int
+    headers: Mapping[str, str]
+    body: bytes
+    endpoint: str = "other"
+    metrics: Optional[RequestMetrics] = None
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return odata.loads(self.body)
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_decode(self.endpoint, time.perf_counter() - start)
+
+
+class Governor(Protocol):
+    """
+    What the services need of a governor of SharePoint requests: a way to send a
+    request, the highest number of requests in flight, to size connection pools and
+    worker counts, and the metrics phases are timed in. RateGovernor and SiteGovernor
+    are governors.
+
+    Attributes:
+        max_concurrency (int): The highest number of requests in flight.
+        metrics (RequestMetrics): The metrics of the requests sent through the governor.
+    """
+
+    max_concurrency: int
+    metrics: RequestMetrics
+
+    async def request(
+        self, session: aiohttp.ClientSession, method: str, url: str, **kwargs: Any
+    ) -> GovernedResponse:
+        """
+        Sends a request, retrying throttled, server and network errors.
+        """
+        ...
+
+
+class RateGovernor:
+    """
+    A rate governor shared by every SharePoint request of a run. It caps the number
+    of requests in flight and adapts that cap with AIMD: the cap grows by one request
+    per window of successful requests, and is multiplied by decrease_factor when
+    SharePoint throttles, the error rate rises or latency exceeds latency_target.
+
+    Throttled requests (429 and 503) are retried after the Retry-After delay, which
+    pauses every request sharing the governor. RateLimit-* headers that announce an
+    exhausted quota pause requests until the quota resets. Server and network errors
+    are retried with jittered exponential backoff.
+
+    A circuit breaker stops hammering an unhealthy tenant: after breaker_threshold
+    consecutive server or network errors across all requests, every request is
+    paused for breaker_cooldown seconds. A single probe request is then let through;
+    if it succeeds the breaker closes and requests resume at full speed, otherwise
+    the pause starts again with twice the cooldown, up to breaker_max_cooldown.
+
+    Every request is recorded in the metrics: latency, status, bytes, retries, time
+    spent queued or paused, and requests in flight.
+
+    Attributes:
+        concurrency (float): The current concurrency cap.
+        min_concurrency (int): The lowest concurrency cap.
+        max_concurrency (int): The highest concurrency cap.
+        max_retries (int): The number of retries of a failed request.
+        backoff_base (float): The base delay in seconds of the exponential backoff.
+        backoff_max (float): The maximum delay in seconds of a retry.
+        latency_target (float): The latency in seconds above which concurrency decreases.
+        decrease_factor (float): The factor applied to the cap on congestion.
+        error_rate_threshold (float): The smoothed error rate above which concurrency decreases.
+        breaker_threshold (int): The consecutive errors that open the circuit breaker,
+            0 to disable it.
+        breaker_cooldown (float): Seconds requests are paused when the breaker opens.
+        breaker_max_cooldown (float): The longest pause after failed probes.
+        metrics (RequestMetrics): The metrics of the requests sent through the governor.
+    """
+
+    RETRY_STATUSES = (429, 503)
+
+    def __init__(
+        self,
+        initial_concurrency: int,
+        min_concurrency: int = 1,
+        max_concurrency: Optional[int] = None,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        latency_target: float = 5.0,
+        decrease_factor: float = 0.5,
+        error_rate_threshold: float = 0.1,
+        metrics: Optional[RequestMetrics] = None,
+        breaker_threshold: int = 20,
+        breaker_cooldown: float = 30.0,
+        breaker_max_cooldown: float = 600.0,
+    ) -> None:
+        """
+        Initializes the RateGovernor instance with its concurrency bounds and retry policy.
+        """
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(
+            self.min_concurrency, max_concurrency or initial_concurrency
+        )
+        self.concurrency = float(
+            min(max(initial_concurrency, self.min_concurrency), self.max_concurrency)
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.error_rate_threshold = error_rate_threshold
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.breaker_max_cooldown = breaker_max_cooldown
+        self.metrics = metrics or RequestMetrics()
+        self.metrics.concurrency = self.concurrency
+        self._in_flight = 0
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+        self._error_rate = 0.0
+        self._condition = asyncio.Condition()
+        self._consecutive_errors = 0
+        self._breaker_open = False
+        self._breaker_delay = 0.0
+        self._probing = False
+
+    async def request(
+        self, session: aiohttp.ClientSession, method: str, url: str, **kwargs: Any
+    ) -> GovernedResponse:
+        """
+        Sends a request once a concurrency slot is free, retrying throttled, server
+        and network errors.
+
+        Args:
+            session (aiohttp.ClientSession): The aiohttp session to use.
+            method (str): The HTTP method.
+            url (str): The request URL.
+            **kwargs (Any): Passed to aiohttp.ClientSession.request.
+
+        Returns:
+            GovernedResponse: The response, which is the last error response if all
+                retries were throttled or failed with a server error.
+
+        Raises:
+            aiohttp.ClientError: If the request still fails after all retries.
+            asyncio.TimeoutError: If the request still times out after all retries.
+        """
+        endpoint = endpoint_name(url)
+        attempt = 0
+        while True:
+            queued = time.monotonic()
+            paused, probe = await self._acquire()
+            start = time.monotonic()
+            self.metrics.record_wait(endpoint, start - queued - paused, paused)
+            self.metrics.request_started()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    result = GovernedResponse(
+                        response.status,
+                        response.headers,
+                        await response.read(),
+                        endpoint,
+                        self.metrics,
+                    )
+            except asyncio.CancelledError:
+                self.metrics.request_finished(endpoint, time.monotonic() - start, None)
+                if probe:
+                    self._probing = False
+                await self._release()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.metrics.request_finished(endpoint, time.monotonic() - start, None)
+                self._record_health(False, probe)
+                await self._release()
+                self._on_error(start)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                self.metrics.record_retry(endpoint, "network_error", delay)
+                request_log.warning(
+                    "Request to %s failed (%s), retrying in %.1fs", url, e, delay
+                )
+            else:
+                latency = time.monotonic() - start
+                self.metrics.request_finished(
+                    endpoint, latency, result.status, len(result.body)
+                )
+                if result.status in self.RETRY_STATUSES:
+                    # Throttling says nothing about health; a throttled probe is
+                    # simply sent again after the pause.
+                    if probe:
+                        self._probing = False
+                else:
+                    self._record_health(result.status < 500, probe)
+                await self._release()
+                if result.status in self.RETRY_STATUSES:
+                    delay = self._retry_after(result.headers) or self._backoff(attempt)
+                    self._on_throttle(start, delay)
+                    request_log.warning(
+                        "Request to %s throttled (%d), retrying in %.1fs at concurrency %d",
+                        url,
+                        result.status,
+                        delay,
+                        int(self.concurrency),
+                    )
+                    reason = "throttled"
+                elif result.status >= 500:
+                    self._on_error(start)
+                    delay = self._backoff(attempt)
+                    reason = "server_error"
+                else:
+                    self._on_success(start, latency, result.headers)
+                    return result
+                if attempt >= self.max_retries:
+                    return result
+                self.metrics.record_retry(endpoint, reason, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _acquire(self) -> Tuple[float, bool]:
+        """
+        Waits for any global pause to end and for a free concurrency slot. While the
+        circuit breaker is open, only one probe request is let through at a time.
+
+        Returns:
+            Tuple[float, bool]: The number of seconds spent in global pauses, and
+                whether the request is the probe of an open circuit breaker.
+        """
+        paused = 0.0
+        while True:
+            pause = self._resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                paused += pause
+                continue
+            async with self._condition:
+                if self._in_flight < int(self.concurrency):
+                    if not self._breaker_open:
+                        self._in_flight += 1
+                        return paused, False
+                    if not self._probing:
+                        self._probing = True
+                        self._in_flight += 1
+                        return paused, True
+                await self._condition.wait()
+
+    async def _release(self) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify(max(1, int(self.concurrency) - self._in_flight))
+
+    def _record_health(self, healthy: bool, probe: bool) -> None:
+        """
+        Counts consecutive server and network errors, opening the circuit breaker at
+        breaker_threshold and closing it on the first success.
+        """
+        if probe:
+            self._probing = False
+        if healthy:
+            self._consecutive_errors = 0
+            if self._breaker_open:
+                self._breaker_open = False
+                logging.info("Circuit breaker closed: requests resumed")
+            return
+        self._consecutive_errors += 1
+        if probe:
+            self._open_breaker(self._breaker_delay * 2)
+        elif (
+            self.breaker_threshold
+            and not self._breaker_open
+            and self._consecutive_errors >= self.breaker_threshold
+        ):
+            self._open_breaker(self.breaker_cooldown)
+
+    def _open_breaker(self, delay: float) -> None:
+        """
+        Pauses every request for the given delay, bounded by breaker_max_cooldown.
+        """
+        self._breaker_open = True
+        self._breaker_delay = min(self.breaker_max_cooldown, delay)
+        self._resume_at = max(self._resume_at, time.monotonic() + self._breaker_delay)
+        self.metrics.breaker_trips += 1
+        logging.warning(
+            f"Circuit breaker open after {self._consecutive_errors} consecutive errors: "
+            f"pausing all requests for {self._breaker_delay:.1f}s"
+        )
+
+    def _on_success(
+        self, start: float, latency: float, headers: Mapping[str, str]
+    ) -> None:
+        self._error_rate *= 0.95
+        if latency > self.latency_target:
+            self._decrease(start, f"latency {latency:.1f}s")
+        elif self._quota_exhausted(headers):
+            self._decrease(start, "RateLimit quota nearly exhausted")
+        else:
+            # Additive increase: about one more slot per window of successful requests.
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / self.concurrency
+            )
+            self.metrics.concurrency = self.concurrency
+
+    def _on_error(self, start: float) -> None:
+        self._error_rate = self._error_rate * 0.95 + 0.05
+        if self._error_rate > self.error_rate_threshold:
+            self._decrease(start, f"error rate {self._error_rate:.0%}")
+
+    def _on_throttle(self, start: float, delay: float) -> None:
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        self._decrease(start, "throttled")
+
+    def _decrease(self, start: float, reason: str) -> None:
+        """
+        Multiplicatively decreases the concurrency cap, at most once per window: a
+        request sent before the last decrease does not trigger another one.
+        """
+        if start < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.concurrency = max(
+            self.min_concurrency, self.concurrency * self.decrease_factor
+        )
+        self.metrics.concurrency = self.concurrency
+        logging.info(f"Concurrency reduced to {int(self.concurrency)} ({reason})")
+
+    def _quota_exhausted(self, headers: Mapping[str, str]) -> bool:
+        """
+        Checks the RateLimit-* headers, pausing until the reset when no quota is left.
+        """
+        remaining = headers.get("RateLimit-Remaining")
+        if remaining is None:
+            return False
+        try:
+            remaining_value = float(remaining)
+            limit_value = float(headers.get("RateLimit-Limit", 0))
+            reset_value = float(headers.get("RateLimit-Reset", 0))
+        except ValueError:
+            return False
+        if remaining_value <= 0 and reset_value > 0:
+            self._resume_at = max(self._resume_at, time.monotonic() + reset_value)
+        return remaining_value <= 0.1 * limit_value
+
+    @staticmethod
+    def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+        """
+        Parses a Retry-After header given in seconds or as an HTTP date.
+        """
+        value = headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
+
+    def _backoff(self, attempt: int) -> float:
+        """
+        Returns a full-jitter exponential backoff delay for the given attempt.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+
+class SiteGovernor:
+    """
+    The governor of the requests of one site of a multi-site migration. It caps the
+    requests in flight for the site and sends them through the RateGovernor shared
+    by all sites, which keeps the global cap, the throttling pauses and the circuit
+    breaker of the tenant, and records the request metrics.
+
+    Its own metrics only hold what is specific to the site, such as the time of each
+    phase and the quarantined folders.
+
+    Attributes:
+        governor (RateGovernor): The governor shared by all sites.
+        max_concurrency (int): The highest number of requests of the site in flight.
+        requests (int): The number of requests the site sent, without retries.
+        metrics (RequestMetrics): The metrics specific to the site.
+    """
+
+    def __init__(self, governor: RateGovernor, max_concurrency: int = 0) -> None:
+        """
+        Initializes the SiteGovernor instance; a max_concurrency of 0 leaves the cap
+        to the shared governor.
+        """
+        self.governor = governor
+        self.max_concurrency = min(
+            max_concurrency or governor.max_concurrency, governor.max_concurrency
+        )
+        self.metrics = RequestMetrics()
+        self.requests = 0
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    async def request(
+        self, session: aiohttp.ClientSession, method: str, url: str, **kwargs: Any
+    ) -> GovernedResponse:
+        """
+        Sends a request through the shared governor once a slot of the site is free.
+        """
+        async with self._slots:
+            self.requests += 1
+            return await self.governor.request(session, method, url, **kwargs)
@@ -0,0 +1,464 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import urllib.parse
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set
+
+from aiohttp import web
+
+FOLDER_URL_PATTERN = re.compile(
+    r"^/_api/web/GetFolderByServerRelativeUrl\('(?P<url>.*)'\)(?P<tail>/Folders|/Properties)?$"
+)
+LIST_ITEMS_PATTERN = re.compile(r"^/_api/web/lists\(guid'(?P<id>[^']+)'\)/items$")
+ADD_FOLDER_PATTERN = re.compile(
+    r"^POST \S*/_api/web/folders/add\('(?P<url>.*)'\) HTTP", re.M
+)
+SKIPTOKEN_PATTERN = re.compile(r"p_ID=(?P<id>\d+)")
+
+
+class FakeSharePointTree:
+    """
+    A generated folder tree, computed on demand so that trees of millions of folders
+    use no memory. Every folder below max_depth has fanout subfolders.
+
+    Attributes:
+        root_url (str): The server relative URL of the root folder.
+        depth (int): The number of folder levels below the root.
+        fanout (int): The number of subfolders of each non-leaf folder.
+        files_per_folder (int): The number of files counted in each folder's ItemCount.
+    """
+
+    def __init__(
+        self, root_url: str, depth: int, fanout: int, files_per_folder: int = 5
+    ) -> None:
+        self.root_url = root_url.rstrip("/")
+        self.depth = depth
+        self.fanout = fanout
+        self.files_per_folder = files_per_folder
+
+    @property
+    def total_folders(self) -> int:
+        return sum(self.fanout**level for level in range(1, self.depth + 1))
+
+    @property
+    def list_id(self) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, self.root_url))
+
+    def folder_at(self, index: int) -> Dict[str, Any]:
+        """
+        Returns the folder at the given position of a breadth-first enumeration of the
+        tree, which is also the order of its list item IDs.
+        """
+        level, first = 1, 0
+        while index >= first + self.fanout**level:
+            first += self.fanout**level
+            level += 1
+        position = index - first
+        names = []
+        for _ in range(level):
+            position, digit = divmod(position, self.fanout)
+            names.append(f"f{digit}")
+        return self.folder(f"{self.root_url}/{'/'.join(reversed(names))}", level)
+
+    def level_of(self, server_relative_url: str) -> Optional[int]:
+        """
+        Returns the level of a folder below the root (0 for the root), or None if the
+        URL is not part of the tree.
+        """
+        if server_relative_url == self.root_url:
+            return 0
+        if not server_relative_url.startswith(self.root_url + "/"):
+            return None
+        names = server_relative_url[len(self.root_url) + 1 :].split("/")
+        if len(names) > self.depth or not all(
+            re.fullmatch(r"f\d+", name) and int(name[1:]) < self.fanout
+            for name in names
+        ):
+            return None
+        return len(names)
+
+    def subfolders(self, server_relative_url: str) -> List[Dict[str, Any]]:
+        level = self.level_of(server_relative_url)
+        if level is None or level >= self.depth:
+            return []
+        return [
+            self.folder(f"{server_relative_url}/f{index}", level + 1)
+            for index in range(self.fanout)
+        ]
+
+    def folder(self, server_relative_url: str, level: int) -> Dict[str, Any]:
+        subfolders = self.fanout if level < self.depth else 0
+        return {
+            "Exists": True,
+            "ExistsAllowThrowForPolicyFailures": True,
+            "ExistsWithException": True,
+            "IsWOPIEnabled": False,
+            "ItemCount": subfolders + self.files_per_folder,
+            "Name": server_relative_url.rsplit("/", 1)[-1],
+            "ProgID": None,
+            "ServerRelativeUrl": server_relative_url,
+            "ServerRelativePath": {"DecodedUrl": server_relative_url},
+            "TimeCreated": "2024-01-15T10:00:00Z",
+            "TimeLastModified": "2024-06-01T12:30:00Z",
+            "UniqueId": str(uuid.uuid5(uuid.NAMESPACE_URL, server_relative_url)),
+            "WelcomePage": "",
+        }
+
+
+class FakeSharePointServer:
+    """
+    An aiohttp application standing in for the SharePoint REST endpoints used by the
+    app: GetFolderByServerRelativeUrl (with $expand=Folders or /Folders),
+    CreateCopyJobs, GetCopyJobProgress and $batch requests of Folders.Add. Responses follow the Accept header
+    (odata=verbose or odata=nometadata) and honour $select.
+
+    Attributes:
+        tree (FakeSharePointTree): The folder tree served.
+        latency (float): Seconds added to every response.
+        throttle_rate (float): The fraction of requests answered with 429.
+        retry_after (float): The Retry-After value of throttled responses.
+        job_polls (int): The number of progress polls before a copy job finishes.
+        error_rate (float): The fraction of folder requests answered with 500.
+        broken_folders (Set[str]): Paths below the root of folders whose requests
+            always fail with 500.
+        stats (Counter): The number of requests per endpoint and status.
+        created_folders (Set[str]): The server relative URLs of the folders added.
+    """
+
+    def __init__(
+        self,
+        tree: FakeSharePointTree,
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        job_polls: int = 3,
+        error_rate: float = 0.0,
+        broken_folders: Optional[Set[str]] = None,
+    ) -> None:
+        self.tree = tree
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.job_polls = job_polls
+        self.error_rate = error_rate
+        self.broken_folders = broken_folders or set()
+        self.stats: Counter = Counter()
+        self.bytes_sent = 0
+        self.created_folders: Set[str] = set()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/_bench/stats", self.handle_stats)
+        app.router.add_post("/_api/site/CreateCopyJobs", self.handle_create_copy_jobs)
+        app.router.add_post(
+            "/_api/site/GetCopyJobProgress", self.handle_get_copy_job_progress
+        )
+        app.router.add_post("/_api/$batch", self.handle_batch)
+        app.router.add_get("/{tail:.*}", self.handle_get)
+        return app
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "requests": sum(self.stats.values()),
+                "by_endpoint": {key: value for key, value in self.stats.items()},
+                "bytes_sent": self.bytes_sent,
+                "total_folders": self.tree.total_folders,
+            }
+        )
+
+    async def handle_get(self, request: web.Request) -> web.Response:
+        match = LIST_ITEMS_PATTERN.match(request.path)
+        if match:
+            return await self.handle_list_items(request, match.group("id"))
+        match = FOLDER_URL_PATTERN.match(request.path)
+        if not match:
+            return self._respond(request, "unknown", {"error": "not found"}, 404)
+        return await self.handle_folder(request, match)
+
+    async def handle_folder(
+        self, request: web.Request, match: re.Match
+    ) -> web.Response:
+        endpoint = (match.group("tail") or "/Folder")[1:]
+        throttled = await self._delay_or_throttle(request, endpoint)
+        if throttled is not None:
+            return throttled
+
+        url = match.group("url")
+        path = url[len(self.tree.root_url) :].strip("/")
+        if path in self.broken_folders or (
+            self.error_rate and random.random() < self.error_rate
+        ):
+            return self._respond(request, endpoint, {"error": "server error"}, 500)
+        level = self.tree.level_of(url)
+        if level is None:
+            return self._respond(request, endpoint, {"error": "folder not found"}, 404)
+        if endpoint == "Properties":
+            properties = {"vti_x005f_listname": f"{{{self.tree.list_id.upper()}}}"}
+            return self._respond(request, endpoint, self._single(request, properties))
+        select = self._select(request)
+        expand = "Folders" in request.query.get("$expand", "")
+        root_select = subfolder_select = select
+        if select is not None and expand:
+            # Fields of the expanded folders are selected as Folders/<field>.
+            root_select = [field for field in select if "/" not in field]
+            subfolder_select = [
+                field[len("Folders/") :]
+                for field in select
+                if field.startswith("Folders/")
+            ] or None
+        subfolders = [
+            self._entity(request, folder, subfolder_select)
+            for folder in self.tree.subfolders(url)
+        ]
+        if endpoint == "Folders":
+            return self._respond(
+                request, endpoint, self._collection(request, subfolders)
+            )
+        root = self._entity(request, self.tree.folder(url, level), root_select)
+        if expand:
+            root["Folders"] = (
+                {"results": subfolders} if self._verbose(request) else subfolders
+            )
+        return self._respond(request, endpoint, self._single(request, root))
+
+    async def handle_list_items(
+        self, request: web.Request, list_id: str
+    ) -> web.Response:
+        """
+        Serves the folders of the tree as list items in pages of $top items, in ID
+        order, with a __next (or odata.nextLink) URL carrying a p_ID skip token.
+        """
+        throttled = await self._delay_or_throttle(request, "items")
+        if throttled is not None:
+            return throttled
+        if list_id.lower() != self.tree.list_id:
+            return self._respond(request, "items", {"error": "list not found"}, 404)
+
+        top = min(int(request.query.get("$top", 100)), 5000)
+        skiptoken = SKIPTOKEN_PATTERN.search(request.query.get("$skiptoken", ""))
+        start = int(skiptoken.group("id")) if skiptoken else 0
+        end = min(start + top, self.tree.total_folders)
+        items = []
+        for index in range(start, end):
+            folder = self.tree.folder_at(index)
+            item = {
+                "ID": index + 1,
+                "FileRef": folder["ServerRelativeUrl"],
+                "FileLeafRef": folder["Name"],
+                "FSObjType": 1,
+                "UniqueId": folder["UniqueId"],
+                "Folder": {
+                    key: folder[key]
+                    for key in (
+                        "Name",
+                        "ServerRelativeUrl",
+                        "TimeCreated",
+                        "TimeLastModified",
+                        "ItemCount",
+                        "UniqueId",
+                    )
+                },
+            }
+            if self._verbose(request):
+                uri = f"{request.url.origin()}/_api/Web/Lists(guid'{list_id}')/Items({index + 1})"
+                item["__metadata"] = {
+                    "id": uri,
+                    "uri": uri,
+                    "type": "SP.Data.DocumentsItem",
+                }
+                item["Folder"]["__metadata"] = {"type": "SP.Folder"}
+            items.append(item)
+
+        next_url = None
+        if end < self.tree.total_folders:
+            query = dict(request.query)
+            query["$skiptoken"] = f"Paged=TRUE&p_ID={end}"
+            next_url = str(request.url.with_query(query))
+        if self._verbose(request):
+            body: Dict[str, Any] = {"d": {"results": items}}
+            if next_url:
+                body["d"]["__next"] = next_url
+        else:
+            body = {"value": items}
+            if next_url:
+                body["odata.nextLink"] = next_url
+        return self._respond(request, "items", body)
+
+    async def handle_create_copy_jobs(self, request: web.Request) -> web.Response:
+        throttled = await self._delay_or_throttle(request, "CreateCopyJobs")
+        if throttled is not None:
+            return throttled
+        payload = await request.json()
+        results = []
+        for uri in payload.get("exportObjectUris", []):
+            job_id = str(uuid.uuid4())
+            self._jobs[job_id] = {"polls": 0, "uri": uri}
+            results.append(
+                {
+                    "EncryptionKey": "ZmFrZQ==",
+                    "JobId": job_id,
+                    "JobQueueUri": f"https://fake.queue.core.windows.net/{job_id}",
+                    "SourceListItemUniqueIds": [],
+                }
+            )
+        if self._verbose(request):
+            body = {"d": {"CreateCopyJobs": {"results": results}}}
+        else:
+            body = {"value": results}
+        return self._respond(request, "CreateCopyJobs", body)
+
+    async def handle_batch(self, request: web.Request) -> web.Response:
+        throttled = await self._delay_or_throttle(request, "$batch")
+        if throttled is not None:
+            return throttled
+        boundary = f"batchresponse_{uuid.uuid4()}"
+        parts = []
+        for match in ADD_FOLDER_PATTERN.finditer(await request.text()):
+            url = urllib.parse.unquote(match.group("url")).replace("''", "'")
+            self.created_folders.add(url)
+            parts += [
+                f"--{boundary}",
+                "Content-Type: application/http",
+                "Content-Transfer-Encoding: binary",
+                "",
+                "HTTP/1.1 200 OK",
+                "Content-Type: application/json;odata=nometadata",
+                "",
+                json.dumps({"ServerRelativeUrl": url}),
+            ]
+        parts += [f"--{boundary}--", ""]
+        self.stats["$batch 200"] += 1
+        return web.Response(
+            text="\r\n".join(parts),
+            headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+        )
+
+    async def handle_get_copy_job_progress(self, request: web.Request) -> web.Response:
+        throttled = await self._delay_or_throttle(request, "GetCopyJobProgress")
+        if throttled is not None:
+            return throttled
+        payload = await request.json()
+        job = self._jobs.get(payload.get("copyJobInfo", {}).get("JobId"))
+        if job is None:
+            return self._respond(
+                request, "GetCopyJobProgress", {"error": "no job"}, 404
+            )
+        job["polls"] += 1
+        finished = job["polls"] >= self.job_polls
+        event = {
+            "Event": "JobEnd" if finished else "JobProgress",
+            "ObjectsProcessed": str(job["polls"] * 10),
+            "BytesProcessed": str(job["polls"] * 1024),
+            "TotalErrors": "0",
+        }
+        progress = {"JobState": 0 if finished else 4, "Logs": [json.dumps(event)]}
+        if self._verbose(request):
+            progress["Logs"] = {"results": progress["Logs"]}
+            body: Dict[str, Any] = {"d": {"GetCopyJobProgress": progress}}
+        else:
+            body = progress
+        return self._respond(request, "GetCopyJobProgress", body)
+
+    async def _delay_or_throttle(
+        self, request: web.Request, endpoint: str
+    ) -> Optional[web.Response]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            self.stats[f"{endpoint} 429"] += 1
+            return web.Response(
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        return None
+
+    def _respond(
+        self, request: web.Request, endpoint: str, body: Any, status: int = 200
+    ) -> web.Response:
+        self.stats[f"{endpoint} {status}"] += 1
+        text = json.dumps(body)
+        self.bytes_sent += len(text)
+        return web.Response(text=text, status=status, content_type="application/json")
+
+    @staticmethod
+    def _verbose(request: web.Request) -> bool:
+        return "nometadata" not in request.headers.get("Accept", "")
+
+    @staticmethod
+    def _select(request: web.Request) -> Optional[List[str]]:
+        select = request.query.get("$select")
+        return [field.strip() for field in select.split(",")] if select else None
+
+    def _entity(
+        self,
+        request: web.Request,
+        folder: Dict[str, Any],
+        select: Optional[List[str]],
+    ) -> Dict[str, Any]:
+        entity = (
+            {key: folder[key] for key in select if key in folder}
+            if select is not None
+            else dict(folder)
+        )
+        if self._verbose(request):
+            uri = f"{request.url.origin()}/_api/Web/GetFolderByServerRelativePath(decodedurl='{folder['ServerRelativeUrl']}')"
+            entity["__metadata"] = {"id": uri, "uri": uri, "type": "SP.Folder"}
+            if not select:
+                for navigation in (
+                    "Files",
+                    "ListItemAllFields",
+                    "ParentFolder",
+                    "Properties",
+                    "StorageMetrics",
+                ):
+                    entity[navigation] = {"__deferred": {"uri": f"{uri}/{navigation}"}}
+        return entity
+
+    def _collection(self, request: web.Request, items: List[Dict[str, Any]]) -> Any:
+        return {"d": {"results": items}} if self._verbose(request) else {"value": items}
+
+    def _single(self, request: web.Request, item: Dict[str, Any]) -> Any:
+        return {"d": item} if self._verbose(request) else item
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a fake SharePoint REST server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--root", default="/sites/bench/Shared Documents")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--job-polls", type=int, default=3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--broken-folder",
+        action="append",
+        default=[],
+        help="Path of a folder whose requests always fail (repeatable)",
+    )
+    args = parser.parse_args()
+
+    server = FakeSharePointServer(
+        FakeSharePointTree(args.root, args.depth, args.fanout),
+        args.latency,
+        args.throttle_rate,
+        args.retry_after,
+        args.job_polls,
+        args.error_rate,
+        set(args.broken_folder),
+    )
+    web.run_app(
+        server.create_app(), host=args.host, port=args.port, print=None, access_log=None
+    )
+
+
+if __name__ == "__main__":
+    main()
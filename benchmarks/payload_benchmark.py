@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.folder_crawler import FolderCrawler  # noqa: E402
+from app.utils import odata  # noqa: E402
+from benchmarks.fake_sharepoint import (  # noqa: E402
+    FakeSharePointServer,
+    FakeSharePointTree,
+)
+
+ROOT_URL = "/sites/bench/Shared Documents"
+
+# The response formats compared, as (OData metadata level, $select of the fields).
+VARIANTS = [
+    ("verbose", False),
+    ("verbose", True),
+    ("nometadata", False),
+    ("nometadata", True),
+]
+
+
+async def fetch_bodies(fanout: int) -> Dict[str, bytes]:
+    """
+    Serves a folder with fanout subfolders from an in-process fake SharePoint server
+    and fetches its /Folders response in every variant.
+
+    Returns:
+        Dict[str, bytes]: The response body of each variant.
+    """
+    server = FakeSharePointServer(FakeSharePointTree(ROOT_URL, 1, fanout))
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/_api/web/GetFolderByServerRelativeUrl('{ROOT_URL}')/Folders"
+    bodies = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            for metadata, selected in VARIANTS:
+                params = (
+                    {"$select": odata.select(FolderCrawler.FOLDER_FIELDS)}
+                    if selected
+                    else None
+                )
+                async with session.get(
+                    url,
+                    params=params,
+                    headers={"Accept": odata.accept_header(metadata)},
+                ) as response:
+                    bodies[variant_name(metadata, selected)] = await response.read()
+    finally:
+        await runner.cleanup()
+    return bodies
+
+
+def variant_name(metadata: str, selected: bool) -> str:
+    return f"{metadata}{' + $select' if selected else ''}"
+
+
+def best_time(function: Callable[[], Any], repeat: int) -> float:
+    """
+    Returns the fastest of repeat runs of a function, in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(body: bytes, fanout: int, repeat: int) -> Dict[str, Any]:
+    """
+    Measures the size of a response and the CPU time to decode it and build the
+    folder records, with the standard library decoder and with orjson.
+
+    Returns:
+        Dict[str, Any]: The bytes and microseconds per folder.
+    """
+
+    def parse(loads: Callable[[bytes], Any]) -> None:
+        for folder in odata.results(loads(body)):
+            FolderCrawler.build_folder_info(folder, "", 0)
+
+    result: Dict[str, Any] = {
+        "bytes_per_folder": round(len(body) / fanout, 1),
+        "json_us_per_folder": round(
+            best_time(lambda: parse(json.loads), repeat) / fanout * 1e6, 2
+        ),
+    }
+    if odata.orjson is not None:
+        result["orjson_us_per_folder"] = round(
+            best_time(lambda: parse(odata.orjson.loads), repeat) / fanout * 1e6, 2
+        )
+    return result
+
+
+def print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    baseline = results[variant_name(*VARIANTS[0])]
+    print(
+        f"{'variant':>22} {'bytes/folder':>13} {'saved':>6} "
+        f"{'json µs':>8} {'orjson µs':>10} {'CPU saved':>10}"
+    )
+    for name, result in results.items():
+        fastest = result.get("orjson_us_per_folder", result["json_us_per_folder"])
+        print(
+            f"{name:>22} {result['bytes_per_folder']:>13} "
+            f"{1 - result['bytes_per_folder'] / baseline['bytes_per_folder']:>6.0%} "
+            f"{result['json_us_per_folder']:>8} "
+            f"{result.get('orjson_us_per_folder', '-'):>10} "
+            f"{1 - fastest / baseline['json_us_per_folder']:>10.0%}"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare the size and decoding cost of SharePoint folder responses."
+    )
+    parser.add_argument("--fanout", type=int, default=1000, help="Folders per response")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    bodies = asyncio.run(fetch_bodies(args.fanout))
+    results = {
+        name: measure(body, args.fanout, args.repeat) for name, body in bodies.items()
+    }
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"fanout": args.fanout, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.auth.token_provider import StaticTokenProvider  # noqa: E402
+from app.services.create_copy_jobs import CopyJobsCreator  # noqa: E402
+from app.services.create_excel import EXCEL_MAX_ROWS, ExcelExporter  # noqa: E402
+from app.services.fetch_structure import SharePointStructureFetcher  # noqa: E402
+from app.services.inventory_store import SQLiteInventoryStore  # noqa: E402
+from app.utils import odata  # noqa: E402
+from app.utils.rate_governor import RateGovernor  # noqa: E402
+
+# Tree shapes of the benchmark sizes, as (depth, fanout).
+SIZES = {
+    "1k": (3, 10),
+    "100k": (5, 10),
+    "1m": (6, 10),
+}
+ROOT_URL = "/sites/bench/Shared Documents"
+
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident set size of the current process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_stats(base_url: str) -> Dict[str, Any]:
+    with urllib.request.urlopen(f"{base_url}/_bench/stats") as response:
+        return json.loads(response.read())
+
+
+def start_server(args: argparse.Namespace, depth: int, fanout: int) -> tuple:
+    """
+    Starts the fake SharePoint server in its own process and waits until it answers.
+
+    Returns:
+        tuple: The server process and its base URL.
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "fake_sharepoint.py"
+            ),
+            "--port",
+            str(port),
+            "--root",
+            ROOT_URL,
+            "--depth",
+            str(depth),
+            "--fanout",
+            str(fanout),
+            "--latency",
+            str(args.latency),
+            "--throttle-rate",
+            str(args.throttle_rate),
+            "--retry-after",
+            str(args.retry_after),
+        ]
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            server_stats(base_url)
+            return process, base_url
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("The fake SharePoint server did not start")
+            time.sleep(0.1)
+
+
+async def run_phases(
+    args: argparse.Namespace, base_url: str, workdir: str
+) -> Dict[str, Any]:
+    """
+    Runs the crawl, the Excel export and the copy job creation against the fake server.
+
+    Returns:
+        Dict[str, Any]: The wall time, request count and peak RSS of each phase, and
+            the request metrics of each endpoint.
+    """
+    token_provider = StaticTokenProvider("benchmark")
+    rate_governor = RateGovernor(
+        args.concurrency, max_concurrency=args.max_concurrency, latency_target=30.0
+    )
+    store = SQLiteInventoryStore(os.path.join(workdir, "inventory.db"))
+    phases: Dict[str, Any] = {}
+
+    async def measure(name: str, phase) -> Any:
+        requests_before = server_stats(base_url)["requests"]
+        start = time.perf_counter()
+        result = await phase()
+        wall_time = time.perf_counter() - start
+        requests = server_stats(base_url)["requests"] - requests_before
+        phases[name] = {
+            "wall_time": round(wall_time, 3),
+            "requests": requests,
+            "requests_per_second": round(requests / wall_time, 1) if wall_time else 0.0,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        return result
+
+    fetcher = SharePointStructureFetcher(
+        token_provider,
+        base_url,
+        ROOT_URL,
+        args.concurrency,
+        rate_governor=rate_governor,
+        enumeration=args.enumeration,
+        odata_metadata=args.odata_metadata,
+    )
+
+    async def crawl() -> int:
+        with store.open_writer() as sink:
+            count = await fetcher.stream_structure(sink)
+        store.commit()
+        return count
+
+    folders = await measure("crawl", crawl)
+    phases["crawl"]["folders"] = folders
+
+    if args.skip_excel or folders > EXCEL_MAX_ROWS:
+        logging.warning(f"Skipping the Excel export of {folders} folders")
+    else:
+        await measure(
+            "excel",
+            lambda: ExcelExporter.export_store_to_excel(
+                store, os.path.join(workdir, "inventory.xlsx")
+            ),
+        )
+
+    creator = CopyJobsCreator(
+        token_provider,
+        args.job_level,
+        "https://bench.sharepoint.com/sites/destination/Shared Documents",
+        base_url,
+        args.concurrency,
+        "bench",
+        False,
+        False,
+        False,
+        False,
+        False,
+        False,
+        False,
+        False,
+        inventory_store=store,
+        batch_size=args.job_batch_size,
+        rate_governor=rate_governor,
+        tenant_url=base_url,
+        odata_metadata=args.odata_metadata,
+    )
+    jobs = await measure("copy_jobs", creator.create_copy_jobs)
+    phases["copy_jobs"]["jobs"] = len(jobs)
+    phases["metrics"] = rate_governor.metrics.summary()["endpoints"]
+    return phases
+
+
+def run_size(args: argparse.Namespace, size: str) -> Dict[str, Any]:
+    """
+    Runs the benchmark of one tree size in the current process.
+    """
+    depth, fanout = SIZES[size]
+    process, base_url = start_server(args, depth, fanout)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            start = time.perf_counter()
+            phases = asyncio.run(run_phases(args, base_url, workdir))
+            wall_time = time.perf_counter() - start
+        stats = server_stats(base_url)
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {
+        "size": size,
+        "folders": stats["total_folders"],
+        "wall_time": round(wall_time, 3),
+        "requests": stats["requests"],
+        "requests_per_second": round(stats["requests"] / wall_time, 1),
+        "bytes_received": stats["bytes_sent"],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "phases": phases,
+    }
+
+
+def run_child(args: argparse.Namespace, size: str) -> Dict[str, Any]:
+    """
+    Runs the benchmark of one size in a fresh interpreter, so that its peak RSS is
+    not inflated by the previous sizes.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--child", size]
+    for option in (
+        "latency",
+        "throttle_rate",
+        "retry_after",
+        "concurrency",
+        "max_concurrency",
+        "job_level",
+        "job_batch_size",
+        "enumeration",
+        "odata_metadata",
+        "log_level",
+    ):
+        command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    if args.skip_excel:
+        command.append("--skip-excel")
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def find_regressions(
+    results: List[Dict[str, Any]], baseline: Dict[str, Any], max_regression: float
+) -> List[str]:
+    """
+    Compares the results with a baseline run.
+
+    Returns:
+        List[str]: A description of every metric worse than the baseline by more than
+            max_regression (a fraction).
+    """
+    baseline_by_size = {result["size"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_by_size.get(result["size"])
+        if previous is None:
+            continue
+        for metric, higher_is_better in (
+            ("requests_per_second", True),
+            ("wall_time", False),
+            ("peak_rss_mb", False),
+        ):
+            old, new = previous[metric], result[metric]
+            if not old:
+                continue
+            change = (old - new) / old if higher_is_better else (new - old) / old
+            if change > max_regression:
+                regressions.append(
+                    f"{result['size']} {metric}: {old} -> {new} ({change:.0%} worse)"
+                )
+    return regressions
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    print(
+        f"{'size':>6} {'folders':>9} {'wall (s)':>9} {'requests':>9} "
+        f"{'req/s':>8} {'RSS (MB)':>9}  phases"
+    )
+    for result in results:
+        phases = ", ".join(
+            f"{name} {phase['wall_time']}s"
+            for name, phase in result["phases"].items()
+            if name != "metrics"
+        )
+        print(
+            f"{result['size']:>6} {result['folders']:>9} {result['wall_time']:>9} "
+            f"{result['requests']:>9} {result['requests_per_second']:>8} "
+            f"{result['peak_rss_mb']:>9}  {phases}"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the crawl, Excel export and copy job creation against a fake SharePoint server."
+    )
+    parser.add_argument(
+        "--sizes",
+        default="1k,100k",
+        help=f"Comma separated sizes among {', '.join(SIZES)}",
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--max-concurrency", type=int, default=100)
+    parser.add_argument("--job-level", type=int, default=2)
+    parser.add_argument("--job-batch-size", type=int, default=10)
+    parser.add_argument(
+        "--enumeration",
+        choices=SharePointStructureFetcher.ENUMERATIONS,
+        default="folders",
+    )
+    parser.add_argument(
+        "--odata-metadata", choices=odata.METADATA_LEVELS, default="nometadata"
+    )
+    parser.add_argument("--skip-excel", action="store_true")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument(
+        "--baseline", help="Compare with the JSON results of a previous run"
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="Fail when a metric is worse than the baseline by more than this fraction",
+    )
+    parser.add_argument("--child", choices=list(SIZES), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        stream=sys.stderr,
+    )
+
+    if args.child:
+        print(json.dumps(run_size(args, args.child)))
+        return
+
+    sizes = [size.strip().lower() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        sys.exit(f"Unknown sizes: {', '.join(unknown)}")
+
+    results = [run_child(args, size) for size in sizes]
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"results": results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(
+                results, json.load(file), args.max_regression
+            )
+        if regressions:
+            print("Performance regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
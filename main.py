@@ -1,63 +1,298 @@
+import argparse
 import asyncio
 import logging
 import os
+from typing import Any, Dict, List, Optional, Tuple
 
 from app.auth.authenticator import Authenticator
+from app.auth.token_provider import TokenProvider
 from app.config.log_settings import LogSettings
 from app.config.settings import Settings
-from app.exceptions import MainExecutionError
-from app.services.create_copy_jobs import CopyJobsCreator
+from app.exceptions import InventoryReadError, MainExecutionError
+from app.services.crawl_checkpoint import CrawlCheckpoint
+from app.services.crawl_quarantine import CrawlQuarantine
+from app.services.create_copy_jobs import CopyJobsCreator, JobPipeline
 from app.services.create_excel import ExcelExporter
 from app.services.fetch_structure import SharePointStructureFetcher
+from app.services.folder_filter import FolderFilter
+from app.services.folder_provisioner import FolderProvisioner
+from app.services.folder_selector import FolderSelector
+from app.services.inventory_delta import PreviousInventory, write_changeset
+from app.services.inventory_store import create_inventory_store
+from app.services.job_ledger import JobLedger
+from app.services.job_partitioner import JobPartitioner
+from app.services.monitor_jobs import CopyJobsMonitor
+from app.services.site_orchestrator import SiteOrchestrator, load_manifest
+from app.services.tree_verifier import TreeVerifier, split_site_url
+from app.utils.metrics import RequestMetrics
+from app.utils.rate_governor import Governor, RateGovernor
 
 
-async def main() -> None:
+async def run_migration(
+    settings: Settings,
+    token_provider: TokenProvider,
+    resume: bool = False,
+    retry_quarantine: bool = False,
+) -> None:
     """
-    The main function that configures logging, acquires an access token, fetches the SharePoint folder structure,
-    saves it to an Excel file, and creates copy jobs based on a specified level.
+    Fetches the SharePoint folder structure into the inventory store, creates copy jobs
+    based on a specified level and optionally monitors them.
 
-    Raises:
-        MainExecutionError: If an error occurs during the main execution.
+    Args:
+        settings (Settings): The configuration settings.
+        token_provider (TokenProvider): The provider of the current access token.
+        resume (bool): Whether to resume an interrupted crawl from its checkpoint.
+        retry_quarantine (bool): Whether to crawl the quarantined folders again.
     """
+    # Share one adaptive rate governor between the crawler and the job creator,
+    # recording the metrics of every SharePoint request
+    rate_governor = _create_rate_governor(settings)
     try:
-        # Load configuration settings
-        settings = Settings()
+        await _run_phases(
+            settings, token_provider, rate_governor, resume, retry_quarantine
+        )
+    finally:
+        rate_governor.metrics.write(
+            settings.METRICS_PROMETHEUS_PATH, settings.METRICS_SUMMARY_PATH
+        )
 
-        # Configure logging
-        LogSettings(settings.LOG_LEVEL, settings.LOG_FORMAT)
-
-        # Acquire access token
-        authenticator = Authenticator(
-            settings.CLIENT_ID,
-            settings.TENANT_ID,
-            settings.THUMBPRINT,
-            settings.CERTIFICATE_PATH,
-            settings.API_SCOPE,
+
+async def run_verification(
+    settings: Settings, token_provider: TokenProvider
+) -> Dict[str, int]:
+    """
+    Crawls the destination folder into its own inventory and compares it with the
+    source inventory, reporting the missing and extra folders and the ItemCount
+    mismatches.
+
+    Args:
+        settings (Settings): The configuration settings.
+        token_provider (TokenProvider): The provider of the current access token.
+
+    Returns:
+        Dict[str, int]: The number of folders compared and of each difference.
+
+    Raises:
+        InventoryReadError: If the source inventory does not exist.
+    """
+    inventory_store = create_inventory_store(
+        settings.INVENTORY_BACKEND,
+        os.path.join(settings.DATA_DIR, settings.INVENTORY_FILENAME),
+    )
+    if not inventory_store.exists():
+        raise InventoryReadError(
+            f"Inventory {inventory_store.path} not found. Run the migration first."
         )
-        access_token = await authenticator.get_access_token()
+    destination_store = create_inventory_store(
+        settings.INVENTORY_BACKEND,
+        os.path.join(settings.DATA_DIR, settings.VERIFY_INVENTORY_FILENAME),
+    )
+    site_url, destination_path = _destination_site(settings)
 
-        # Check if the Excel file already exists
-        excel_file_path = f"app/data/{settings.FETCH_FILENAME}"
-        if not os.path.exists(excel_file_path):
-            # Fetch SharePoint structure
-            fetcher = SharePointStructureFetcher(
-                access_token,
-                settings.ORIGIN_URL,
-                settings.PARTIAL_ORIGIN_URL,
-                settings.AIOHTTP_LIMIT,
-            )
-            structure = await fetcher.fetch_structure()
+    rate_governor = _create_rate_governor(settings)
+    metrics = rate_governor.metrics
+    try:
+        # Crawl the destination with the same engine as the source, unfiltered, so
+        # folders copied with their ancestors are all there
+        fetcher = SharePointStructureFetcher(
+            token_provider,
+            site_url,
+            destination_path,
+            settings.AIOHTTP_LIMIT,
+            settings.AIOHTTP_KEEPALIVE_TIMEOUT,
+            settings.AIOHTTP_DNS_CACHE_TTL,
+            settings.CRAWL_WORKERS,
+            settings.CRAWL_QUEUE_SIZE,
+            settings.CRAWL_PROGRESS_INTERVAL,
+            rate_governor,
+            settings.CRAWL_ENUMERATION,
+            settings.CRAWL_LIST_PAGE_SIZE,
+            settings.CRAWL_LIST_SERVER_SIDE_FILTER,
+            odata_metadata=settings.ODATA_METADATA,
+            folder_retries=settings.CRAWL_FOLDER_RETRIES,
+            folder_retry_delay=settings.CRAWL_FOLDER_RETRY_DELAY,
+        )
+        with metrics.phase("verify_crawl"), destination_store.open_writer() as sink:
+            await fetcher.stream_structure(sink)
+        destination_store.commit()
 
-            # Save the structure to an Excel file
-            await ExcelExporter.save_structure_to_excel(structure, excel_file_path)
+        # Folders at LEVEL are copied into the destination folder, or below their
+        # parent path, so only the subtrees of the selected ones are expected there;
+        # planned jobs keep paths
+        level: Optional[int] = settings.LEVEL
+        roots = None
+        if settings.COPY_JOB_PARTITION == "items":
+            level = None
         else:
-            logging.info(
-                f"Excel file {excel_file_path} already exists. Skipping fetch structure step."
+            folder_filter = FolderFilter(
+                settings.FOLDER_INCLUDE, settings.FOLDER_EXCLUDE
             )
+            roots = _create_selector(settings, folder_filter).select(
+                inventory_store, ["Path"]
+            )["Path"]
+        with metrics.phase("verify_diff"):
+            return TreeVerifier(
+                inventory_store,
+                destination_store,
+                level,
+                os.path.join(settings.DATA_DIR, "verification.tmp.db"),
+                roots,
+                settings.COPY_JOB_PRESERVE_HIERARCHY,
+            ).verify(os.path.join(settings.DATA_DIR, settings.VERIFY_REPORT_FILENAME))
+    finally:
+        metrics.write(settings.METRICS_PROMETHEUS_PATH, settings.METRICS_SUMMARY_PATH)
+
+
+def _destination_site(settings: Settings) -> Tuple[str, str]:
+    """
+    Returns the URL of the destination site and the server-relative path of the
+    destination folder.
+
+    Args:
+        settings (Settings): The configuration settings.
 
-        # Create copy jobs
+    Returns:
+        Tuple[str, str]: The site URL and the path of the destination folder.
+    """
+    site_url, destination_path = split_site_url(settings.DESTINATION_URL)
+    return settings.DESTINATION_SITE_URL or site_url, destination_path
+
+
+def _create_rate_governor(settings: Settings) -> RateGovernor:
+    """
+    Creates the rate governor of a run, recording its requests in new metrics.
+
+    Args:
+        settings (Settings): The configuration settings.
+
+    Returns:
+        RateGovernor: The rate governor.
+    """
+    return RateGovernor(
+        settings.AIOHTTP_LIMIT,
+        settings.RATE_MIN_CONCURRENCY,
+        settings.RATE_MAX_CONCURRENCY,
+        settings.RATE_MAX_RETRIES,
+        latency_target=settings.RATE_LATENCY_TARGET,
+        metrics=RequestMetrics(),
+        breaker_threshold=settings.RATE_BREAKER_THRESHOLD,
+        breaker_cooldown=settings.RATE_BREAKER_COOLDOWN,
+    )
+
+
+def _create_selector(settings: Settings, folder_filter: FolderFilter) -> FolderSelector:
+    """
+    Creates the selector of the folders to create copy jobs for.
+
+    Args:
+        settings (Settings): The configuration settings.
+        folder_filter (FolderFilter): The include and exclude rules.
+
+    Returns:
+        FolderSelector: The folder selector.
+    """
+    return FolderSelector(
+        settings.LEVEL,
+        settings.SELECT_NAME_PATTERNS,
+        settings.SELECT_MODIFIED_SINCE,
+        settings.SELECT_MIN_ITEM_COUNT,
+        settings.SELECT_MAX_ITEM_COUNT,
+        folder_filter,
+    )
+
+
+async def _run_phases(
+    settings: Settings,
+    token_provider: TokenProvider,
+    rate_governor: Governor,
+    resume: bool = False,
+    retry_quarantine: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Runs the fetch, export, job creation and monitoring phases, timing each of them
+    in the metrics of the rate governor.
+
+    Args:
+        settings (Settings): The configuration settings.
+        token_provider (TokenProvider): The provider of the current access token.
+        rate_governor (Governor): The governor of SharePoint requests.
+        resume (bool): Whether to resume an interrupted crawl from its checkpoint.
+        retry_quarantine (bool): Whether to crawl the quarantined folders again.
+
+    Returns:
+        List[Dict[str, Any]]: The copy jobs created.
+    """
+    metrics = rate_governor.metrics
+
+    # Check if a complete inventory already exists
+    inventory_store = create_inventory_store(
+        settings.INVENTORY_BACKEND,
+        os.path.join(settings.DATA_DIR, settings.INVENTORY_FILENAME),
+    )
+    # A checkpoint is left by an interrupted crawl, to be resumed with --resume
+    checkpoint = CrawlCheckpoint(
+        os.path.join(settings.DATA_DIR, settings.CRAWL_CHECKPOINT_FILENAME),
+        settings.CRAWL_CHECKPOINT_INTERVAL,
+    )
+    resume_state = checkpoint.load() if resume else None
+    if resume and resume_state is None:
+        logging.warning(
+            f"No crawl checkpoint found at {checkpoint.path}. Starting a new crawl."
+        )
+
+    # Folders the crawl could not list are quarantined, to be retried with
+    # --retry-quarantine, which crawls them again into the existing inventory
+    quarantine = CrawlQuarantine(
+        os.path.join(settings.DATA_DIR, settings.CRAWL_QUARANTINE_FILENAME)
+    )
+    if retry_quarantine and resume_state is None:
+        retry_state = quarantine.resume_state()
+        if not retry_state["frontier"]:
+            logging.warning(f"No quarantined folders found at {quarantine.path}.")
+        elif not inventory_store.exists():
+            logging.warning(
+                f"Inventory {inventory_store.path} not found. Starting a new crawl."
+            )
+        else:
+            logging.info(f"Retrying {len(retry_state['frontier'])} quarantined folders")
+            resume_state = {**retry_state, "records": inventory_store.reopen()}
+            # Folders failing again are quarantined again; the retried ones are kept
+            # aside until the inventory is committed, in case the crawl stops before
+            # its first checkpoint.
+            quarantine.begin_retry()
+
+    # The job ledger keeps reruns from submitting the folders that already have a job
+    job_ledger = None
+    if settings.JOB_LEDGER_FILENAME:
+        job_ledger = JobLedger(
+            os.path.join(settings.DATA_DIR, settings.JOB_LEDGER_FILENAME)
+        )
+    try:
+        # The include and exclude rules prune the crawl and narrow down the copy jobs
+        folder_filter = FolderFilter(settings.FOLDER_INCLUDE, settings.FOLDER_EXCLUDE)
+
+        # Copy jobs are created for the folders at LEVEL or for subtrees of bounded size,
+        # narrowed down by the selection criteria
+        partitioner = None
+        provisioner = None
+        if settings.COPY_JOB_PARTITION == "items":
+            partitioner = JobPartitioner(settings.COPY_JOB_MAX_ITEMS)
+        if partitioner is not None or settings.COPY_JOB_PRESERVE_HIERARCHY:
+            # Jobs copied below their parent path need it to exist when they start,
+            # before the job copying the parent itself may have run
+            site_url, destination_path = _destination_site(settings)
+            provisioner = FolderProvisioner(
+                token_provider,
+                site_url,
+                destination_path,
+                rate_governor,
+                settings.AIOHTTP_LIMIT,
+                settings.COPY_JOB_PROVISION_BATCH_SIZE,
+                settings.ODATA_METADATA,
+            )
+        selector = _create_selector(settings, folder_filter)
         copy_jobs_creator = CopyJobsCreator(
-            access_token,
+            token_provider,
             settings.LEVEL,
             settings.DESTINATION_URL,
             settings.BASE_URL,
@@ -71,16 +306,280 @@ async def main() -> None:
             settings.BYPASS_SHARED_LOCK,
             settings.MOVE_BUT_KEEP_SOURCE,
             settings.EXCLUDE_CHILDREN,
+            inventory_store,
+            settings.COPY_JOB_BATCH_SIZE,
+            settings.COPY_JOB_BATCH_MAX_ITEMS,
+            rate_governor,
+            job_ledger=job_ledger,
+            partitioner=partitioner,
+            odata_metadata=settings.ODATA_METADATA,
+            selector=selector,
+            provisioner=provisioner,
+        )
+
+        jobs = None
+        if (
+            not inventory_store.exists()
+            or settings.INCREMENTAL_CRAWL
+            or resume_state is not None
+        ):
+            # An incremental crawl skips the unchanged folders of the existing inventory;
+            # the quarantined ones were never listed, so their subfolders are unknown
+            previous_inventory = None
+            if inventory_store.exists():
+                previous_inventory = PreviousInventory(
+                    inventory_store, [entry["path"] for entry in quarantine.load()]
+                )
+
+            # Fetch SharePoint structure, streaming each folder to the inventory
+            fetcher = SharePointStructureFetcher(
+                token_provider,
+                settings.ORIGIN_URL,
+                settings.PARTIAL_ORIGIN_URL,
+                settings.AIOHTTP_LIMIT,
+                settings.AIOHTTP_KEEPALIVE_TIMEOUT,
+                settings.AIOHTTP_DNS_CACHE_TTL,
+                settings.CRAWL_WORKERS,
+                settings.CRAWL_QUEUE_SIZE,
+                settings.CRAWL_PROGRESS_INTERVAL,
+                rate_governor,
+                settings.CRAWL_ENUMERATION,
+                settings.CRAWL_LIST_PAGE_SIZE,
+                settings.CRAWL_LIST_SERVER_SIDE_FILTER,
+                previous_inventory,
+                checkpoint,
+                settings.ODATA_METADATA,
+                folder_filter,
+                settings.CRAWL_FOLDER_RETRIES,
+                settings.CRAWL_FOLDER_RETRY_DELAY,
+                quarantine,
+                settings.CRAWL_MAX_QUARANTINED,
+            )
+
+            # In pipeline mode copy jobs are created while the crawl runs
+            pipeline = None
+            if settings.PIPELINE_JOBS:
+                if partitioner is not None:
+                    logging.warning(
+                        "Planned copy jobs need the complete inventory; PIPELINE_JOBS is ignored"
+                    )
+                elif provisioner is not None:
+                    logging.warning(
+                        "Copy jobs keeping the folder hierarchy need their destination "
+                        "folders first; PIPELINE_JOBS is ignored"
+                    )
+                else:
+                    pipeline = JobPipeline(
+                        copy_jobs_creator, settings.PIPELINE_QUEUE_SIZE
+                    )
+
+            resume_records = resume_state["records"] if resume_state else None
+            if resume_records is None:
+                quarantine.remove()
+            with metrics.phase("crawl"), inventory_store.open_writer(
+                resume_records
+            ) as sink:
+                if pipeline is None:
+                    await fetcher.stream_structure(sink, resume_state)
+                else:
+                    jobs = await pipeline.run(
+                        fetcher.stream_structure(
+                            sink, resume_state, pipeline.offer, pipeline.wait_for_room
+                        )
+                    )
+            if previous_inventory is not None:
+                write_changeset(
+                    inventory_store,
+                    create_inventory_store(
+                        settings.INVENTORY_BACKEND, inventory_store.partial_path
+                    ),
+                    os.path.join(settings.DATA_DIR, settings.CHANGESET_FILENAME),
+                )
+            inventory_store.commit()
+            checkpoint.remove()
+            quarantine.end_retry()
+
+            # Optionally export the inventory to an Excel file
+            if settings.EXPORT_EXCEL and settings.INVENTORY_BACKEND != "excel":
+                with metrics.phase("excel_export"):
+                    await ExcelExporter.export_store_to_excel(
+                        inventory_store,
+                        os.path.join(settings.DATA_DIR, settings.FETCH_FILENAME),
+                    )
+        else:
+            logging.info(
+                f"Inventory {inventory_store.path} already exists. Skipping fetch structure step."
+            )
+
+        # Create copy jobs. After a pipelined crawl, the inventory is checked against
+        # the ledger for folders the pipeline missed, e.g. those listed before a resume.
+        if jobs is None or job_ledger is not None:
+            with metrics.phase("copy_jobs"):
+                jobs = await copy_jobs_creator.create_copy_jobs()
+        elif resume_state is not None:
+            logging.warning(
+                "Without a job ledger, folders listed before the crawl was resumed "
+                "may not have a copy job"
+            )
+
+        # Monitor copy jobs until they finish
+        if settings.MONITOR_JOBS:
+            monitor = CopyJobsMonitor(
+                token_provider,
+                settings.TENANT_NAME,
+                settings.AIOHTTP_LIMIT,
+                settings.MONITOR_MIN_INTERVAL,
+                settings.MONITOR_MAX_INTERVAL,
+                batch_size=settings.MONITOR_BATCH_SIZE,
+                max_requests_per_second=settings.MONITOR_MAX_REQUESTS_PER_SECOND,
+                rate_governor=rate_governor,
+                job_ledger=job_ledger,
+                odata_metadata=settings.ODATA_METADATA,
+            )
+            with metrics.phase("monitor"):
+                await monitor.monitor(jobs)
+        return jobs or []
+    finally:
+        if job_ledger is not None:
+            job_ledger.close()
+
+
+def create_token_provider(settings: Settings) -> TokenProvider:
+    """
+    Creates the token provider of the run, which acquires the access token when it
+    is entered and refreshes it in the background.
+
+    Args:
+        settings (Settings): The configuration settings.
+
+    Returns:
+        TokenProvider: The token provider.
+    """
+    authenticator = Authenticator(
+        settings.CLIENT_ID,
+        settings.TENANT_ID,
+        settings.THUMBPRINT,
+        settings.CERTIFICATE_PATH,
+        settings.API_SCOPE,
+        settings.TOKEN_CACHE_PATH or None,
+    )
+    return TokenProvider(authenticator, settings.TOKEN_REFRESH_MARGIN)
+
+
+async def main(
+    resume: bool = False,
+    retry_quarantine: bool = False,
+    manifest: Optional[str] = None,
+    verify: bool = False,
+) -> None:
+    """
+    The main function that configures logging, starts the token provider and runs the
+    migration: fetches the SharePoint folder structure, saves it to the inventory store,
+    and creates copy jobs based on a specified level.
+
+    With a manifest, the migrations of all the sites it lists are run concurrently
+    instead, each with the settings of its entry. With verify, the destination is
+    crawled and compared with the source inventory instead.
+
+    Args:
+        resume (bool): Whether to resume an interrupted crawl from its checkpoint.
+        retry_quarantine (bool): Whether to crawl the quarantined folders again.
+        manifest (Optional[str]): The path to a manifest of the sites to migrate.
+        verify (bool): Whether to verify the destination against the source inventory.
+
+    Raises:
+        MainExecutionError: If an error occurs during the main execution.
+    """
+    try:
+        # Load configuration settings; the site settings of a manifest migration
+        # come from its entries
+        settings = Settings(require_site=manifest is None)
+
+        # Configure logging
+        LogSettings(
+            settings.LOG_LEVEL,
+            settings.LOG_FORMAT,
+            settings.LOG_JSON,
+            settings.LOG_QUEUE,
+            settings.LOG_REQUEST_RATE,
         )
-        await copy_jobs_creator.create_copy_jobs()
+
+        if manifest is not None:
+            sites = load_manifest(manifest, settings.DATA_DIR)
+            orchestrator = SiteOrchestrator(
+                settings,
+                sites,
+                _run_phases,
+                create_token_provider,
+                resume,
+                retry_quarantine,
+            )
+            failed = [
+                site.name
+                for site in await orchestrator.run()
+                if site.status == "failed"
+            ]
+            if failed:
+                raise MainExecutionError(
+                    f"{len(failed)} of {len(sites)} sites failed: {', '.join(failed)}"
+                )
+            return
+
+        # Acquire access token, refreshed in the background for the whole run
+        async with create_token_provider(settings) as token_provider:
+            if verify:
+                summary = await run_verification(settings, token_provider)
+                differences = sum(summary[name] for name in TreeVerifier.DIFFERENCES)
+                if differences:
+                    logging.warning(
+                        f"The destination differs from the source in {differences} folders"
+                    )
+                return
+            await run_migration(settings, token_provider, resume, retry_quarantine)
 
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         raise MainExecutionError(f"An error occurred during the main execution: {e}")
 
 
+def parse_args() -> argparse.Namespace:
+    """
+    Parses the command line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="SharePoint migration")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume an interrupted crawl from its checkpoint",
+    )
+    parser.add_argument(
+        "--retry-quarantine",
+        action="store_true",
+        help="list the folders a previous crawl quarantined again",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="migrate the sites of a JSON or CSV manifest concurrently",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="crawl the destination and report its differences with the source",
+    )
+    args = parser.parse_args()
+    if args.verify and args.manifest:
+        parser.error("--verify cannot be combined with --manifest")
+    return args
+
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(
+            main(args.resume, args.retry_quarantine, args.manifest, args.verify)
+        )
     except MainExecutionError as e:
         logging.critical(f"Main execution failed: {e}")